@@ -9,6 +9,7 @@ Usage:
                             [--path_out=FILENAME]
                             [--title=TITLE]
                             [--use_gpu]
+                            [--lossless]
   run_calorie_estimation.py (-h | --help)
 
 Options:
@@ -23,6 +24,7 @@ Options:
   --path_in=FILENAME              Video file to stream from
   --path_out=FILENAME             Video file to stream to
   --title=TITLE                   This adds a title to the window display
+  --lossless                      Never drop frames or predictions, e.g. to not lose steps when processing a video file
 """
 from docopt import docopt
 
@@ -41,6 +43,7 @@ if __name__ == "__main__":
     age = float(args['--age'])
     gender = args['--gender'] or None
     use_gpu = args['--use_gpu']
+    lossless = args['--lossless']
 
     camera_id = int(args['--camera_id'] or 0)
     path_in = args['--path_in'] or None
@@ -85,6 +88,7 @@ if __name__ == "__main__":
         camera_id=camera_id,
         path_in=path_in,
         path_out=path_out,
-        use_gpu=use_gpu
+        use_gpu=use_gpu,
+        lossless=lossless
     )
     controller.run_inference()
@@ -8,12 +8,14 @@ Usage:
                              [--path_out=FILENAME]
                              [--title=TITLE]
                              [--use_gpu]
+                             [--lossless]
   run_fitness_rep_counter.py (-h | --help)
 
 Options:
   --path_in=FILENAME              Video file to stream from
   --path_out=FILENAME             Video file to stream to
   --title=TITLE                   This adds a title to the window display
+  --lossless                      Never drop frames or predictions, e.g. to not lose steps when processing a video file
 """
 from docopt import docopt
 
@@ -36,6 +38,7 @@ if __name__ == "__main__":
     path_out = args['--path_out'] or None
     title = args['--title'] or None
     use_gpu = args['--use_gpu']
+    lossless = args['--lossless']
 
     # Load feature extractor
     feature_extractor = feature_extractors.StridedInflatedEfficientNet()
@@ -75,6 +78,7 @@ if __name__ == "__main__":
         camera_id=camera_id,
         path_in=path_in,
         path_out=path_out,
-        use_gpu=use_gpu
+        use_gpu=use_gpu,
+        lossless=lossless
     )
     controller.run_inference()
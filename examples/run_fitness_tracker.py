@@ -9,6 +9,7 @@ Usage:
                          [--path_out=FILENAME]
                          [--title=TITLE]
                          [--use_gpu]
+                         [--lossless]
   run_fitness_tracker.py (-h | --help)
 
 Options:
@@ -19,6 +20,7 @@ Options:
   --path_in=FILENAME     Video file to stream from
   --path_out=FILENAME    Video file to stream to
   --title=TITLE          This adds a title to the window display
+  --lossless             Never drop frames or predictions, e.g. to not lose steps when processing a video file
 """
 import torch
 from docopt import docopt
@@ -29,7 +31,7 @@ from sense.controller import Controller
 from sense.downstream_tasks import calorie_estimation
 from sense.downstream_tasks.fitness_activity_recognition import INT2LAB
 from sense.downstream_tasks.nn_utils import LogisticRegression
-from sense.downstream_tasks.nn_utils import Pipe
+from sense.downstream_tasks.nn_utils import MultiHeadPipe
 from sense.downstream_tasks.nn_utils import load_weights_from_resources
 from sense.downstream_tasks.postprocess import PostprocessClassificationOutput
 
@@ -46,6 +48,7 @@ if __name__ == "__main__":
     path_out = args['--path_out'] or None
     title = args['--title'] or None
     use_gpu = True
+    lossless = args['--lossless']
 
     # Load feature extractor
     feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
@@ -65,9 +68,11 @@ if __name__ == "__main__":
     met_value_converter.load_state_dict(checkpoint)
     met_value_converter.eval()
 
-    # Concatenate feature extractor with downstream nets
-    net = Pipe(feature_extractor, feature_converter=[gesture_classifier,
-                                                     met_value_converter])
+    # Share the feature extractor between downstream nets. MET values vary slowly, so the
+    # converter only runs every other step
+    net = MultiHeadPipe(feature_extractor)
+    net.add_head('fitness_activity', gesture_classifier)
+    net.add_head('met_value', met_value_converter, stride=2)
 
     post_processors = [
         PostprocessClassificationOutput(INT2LAB, smoothing=8,
@@ -100,6 +105,7 @@ if __name__ == "__main__":
         camera_id=camera_id,
         path_in=path_in,
         path_out=path_out,
-        use_gpu=use_gpu
+        use_gpu=use_gpu,
+        lossless=lossless
     )
     controller.run_inference()
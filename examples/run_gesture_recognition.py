@@ -8,23 +8,23 @@ Usage:
                              [--path_out=FILENAME]
                              [--title=TITLE]
                              [--use_gpu]
+                             [--tflite_model=FILENAME]
   run_gesture_recognition.py (-h | --help)
 
 Options:
   --path_in=FILENAME         Video file to stream from
   --path_out=FILENAME        Video file to stream to
   --title=TITLE              This adds a title to the window display
+  --tflite_model=FILENAME    Run a model converted with `tools/conversion/convert_to_tflite.py` with the
+                             TensorFlow Lite interpreter instead of PyTorch
 """
 from docopt import docopt
 
 import sense.display
-from sense import feature_extractors
 from sense.controller import Controller
 from sense.downstream_tasks.gesture_recognition import INT2LAB
-from sense.downstream_tasks.nn_utils import LogisticRegression
-from sense.downstream_tasks.nn_utils import Pipe
-from sense.downstream_tasks.nn_utils import load_weights_from_resources
 from sense.downstream_tasks.postprocess import PostprocessClassificationOutput
+from sense.tflite_interpreter import TFLiteNet
 
 
 if __name__ == "__main__":
@@ -34,27 +34,38 @@ if __name__ == "__main__":
     path_in = args['--path_in'] or None
     path_out = args['--path_out'] or None
     title = args['--title'] or None
+    tflite_model = args['--tflite_model']
     use_gpu = False
 
-    # Load feature extractor
-    feature_extractor = feature_extractors.StridedInflatedEfficientNet()
-    feature_extractor.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
-    # feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
-    # feature_extractor.load_weights_from_resources(r'../resources\backbone\strided_inflated_mobilenet.ckpt')
+    if tflite_model:
+        # Load the converted feature extractor and classifier
+        net = TFLiteNet(tflite_model)
+    else:
+        # PyTorch is only imported when running the PyTorch network
+        from sense import feature_extractors
+        from sense.downstream_tasks.nn_utils import LogisticRegression
+        from sense.downstream_tasks.nn_utils import Pipe
+        from sense.downstream_tasks.nn_utils import load_weights_from_resources
 
-    feature_extractor.eval()
+        # Load feature extractor
+        feature_extractor = feature_extractors.StridedInflatedEfficientNet()
+        feature_extractor.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
+        # feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
+        # feature_extractor.load_weights_from_resources(r'../resources\backbone\strided_inflated_mobilenet.ckpt')
 
-    # Load a logistic regression classifier
-    gesture_classifier = LogisticRegression(num_in=feature_extractor.feature_dim,
-                                            num_out=30)
-    checkpoint = load_weights_from_resources('gesture_detection/efficientnet_logistic_regression.ckpt')
-    # checkpoint = load_weights_from_resources('gesture_detection/mobilenet_logistic_regression.ckpt')
+        feature_extractor.eval()
 
-    gesture_classifier.load_state_dict(checkpoint)
-    gesture_classifier.eval()
+        # Load a logistic regression classifier
+        gesture_classifier = LogisticRegression(num_in=feature_extractor.feature_dim,
+                                                num_out=30)
+        checkpoint = load_weights_from_resources('gesture_detection/efficientnet_logistic_regression.ckpt')
+        # checkpoint = load_weights_from_resources('gesture_detection/mobilenet_logistic_regression.ckpt')
 
-    # Concatenate feature extractor and met converter
-    net = Pipe(feature_extractor, gesture_classifier)
+        gesture_classifier.load_state_dict(checkpoint)
+        gesture_classifier.eval()
+
+        # Concatenate feature extractor and met converter
+        net = Pipe(feature_extractor, gesture_classifier)
 
     postprocessor = [
         PostprocessClassificationOutput(INT2LAB, smoothing=4)
@@ -7,6 +7,8 @@ from threading import Thread
 from typing import Optional
 from typing import Tuple
 
+from sense.metrics import REGISTRY
+
 
 class VideoSource:
     """
@@ -22,7 +24,7 @@ class VideoSource:
         :param filename:
             Path to a video file.
         :param size:
-            The expected frame size of the video.
+            The expected frame size of the video, as (height, width).
         :param camera_id:
             Device index for the camera.
         :param preserve_aspect_ratio:
@@ -30,6 +32,7 @@ class VideoSource:
         """
         self.size = size
         self.preserve_aspect_ratio = preserve_aspect_ratio
+        self.filename = filename
         if filename:
             self._cam = cv2.VideoCapture(filename)
         else:
@@ -42,37 +45,126 @@ class VideoSource:
         Capture image from video stream frame-by-frame.
         The captured image and a scaled copy of the image are returned.
         """
-        ret, img = self._cam.read()
+        with REGISTRY.timer('sense_camera_read_seconds'):
+            ret, img = self._read_frame()
         if ret:
-            img_copy = img.copy()
-            if self.preserve_aspect_ratio:
-                img_copy = self.pad_to_square(img)
-            scaled_img = cv2.resize(img_copy, self.size) if self.size else img
+            with REGISTRY.timer('sense_camera_resize_seconds'):
+                img_copy = img.copy()
+                if self.preserve_aspect_ratio:
+                    img_copy = self.pad_to_aspect_ratio(img, self.size) if self.size else self.pad_to_square(img)
+                # cv2 expects the target size as (width, height)
+                scaled_img = cv2.resize(img_copy, (self.size[1], self.size[0])) if self.size else img
             return img, scaled_img
         else:
             # Could not grab another frame (file ended?)
             return None
 
+    def _read_frame(self) -> Tuple[bool, Optional[np.ndarray]]:
+        return self._cam.read()
+
     def pad_to_square(self, img):
         """Pad an image to the shape of a square with borders."""
-        square_size = max(img.shape[0:2])
-        pad_top = int((square_size - img.shape[0]) / 2)
-        pad_bottom = square_size - img.shape[0] - pad_top
-        pad_left = int((square_size - img.shape[1]) / 2)
-        pad_right = square_size - img.shape[1] - pad_left
+        return self.pad_to_aspect_ratio(img, (1, 1))
+
+    def pad_to_aspect_ratio(self, img, size):
+        """Pad an image with borders to the aspect ratio of the given (height, width) size."""
+        height, width = img.shape[0:2]
+        padded_height = max(height, int(round(width * size[0] / size[1])))
+        padded_width = max(width, int(round(height * size[1] / size[0])))
+        pad_top = int((padded_height - height) / 2)
+        pad_bottom = padded_height - height - pad_top
+        pad_left = int((padded_width - width) / 2)
+        pad_right = padded_width - width - pad_left
         return cv2.copyMakeBorder(img, pad_top, pad_bottom, pad_left, pad_right, cv2.BORDER_CONSTANT)
 
     def get_fps(self) -> float:
         """Return the frame rate of the video source."""
         return self._cam.get(cv2.CAP_PROP_FPS)
 
+    def get_frame_count(self) -> int:
+        """Return the number of frames of a video file, as reported by its container."""
+        return int(self._cam.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def count_frames(self) -> int:
+        """
+        Return the number of frames of a video file by reading through it once, which unlike
+        `get_frame_count` does not rely on the container metadata. Returns -1 for cameras.
+        """
+        if not self.filename:
+            return -1
+        cam = cv2.VideoCapture(self.filename)
+        num_frames = 0
+        while cam.grab():
+            num_frames += 1
+        cam.release()
+        return num_frames
+
+
+class SyntheticVideoSource(VideoSource):
+    """
+    VideoSource that generates random frames, e.g. to benchmark the pipeline without a camera. Frames
+    go through the same padding and resizing as the frames of a camera.
+    """
+
+    def __init__(self,
+                 size: Tuple[int, int] = None,
+                 fps: float = 16.,
+                 num_frames: Optional[int] = None,
+                 frame_shape: Tuple[int, int] = (480, 640),
+                 preserve_aspect_ratio: bool = True,
+                 seed: int = 0):
+        """
+        :param size:
+            The expected frame size of the video, as (height, width).
+        :param fps:
+            The frame rate reported for the video.
+        :param num_frames:
+            Number of frames after which the video ends. If None, the video never ends.
+        :param frame_shape:
+            Height and width of the generated frames, before resizing.
+        :param preserve_aspect_ratio:
+            Whether to preserve the aspect ratio of the video frames.
+        :param seed:
+            Seed of the random frames.
+        """
+        self.size = size
+        self.preserve_aspect_ratio = preserve_aspect_ratio
+        self.fps = fps
+        self.num_frames = num_frames
+        self._frame_index = 0
+        # Cycle through a few pre-generated frames so that generating them does not dominate timings
+        random_state = np.random.RandomState(seed)
+        self._frames = random_state.randint(0, 256, size=(8, *frame_shape, 3), dtype=np.uint8)
+
+    def _read_frame(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.num_frames is not None and self._frame_index >= self.num_frames:
+            return False, None
+        img = self._frames[self._frame_index % len(self._frames)].copy()
+        self._frame_index += 1
+        return True, img
+
+    def get_fps(self) -> float:
+        """Return the frame rate of the video source."""
+        return self.fps
+
+    def get_frame_count(self) -> int:
+        """Return the number of frames of the video, or -1 if it never ends."""
+        return self.num_frames if self.num_frames is not None else -1
+
+    def count_frames(self) -> int:
+        return self.get_frame_count()
+
 
 class VideoStream(Thread):
     """
     Thread that reads frames from the video source at a given frame rate.
+
+    When frames are not consumed fast enough, the oldest frame is dropped. In lossless mode, reading
+    is paused instead until there is room in the queue. The number of dropped frames and of frames
+    that were read later than scheduled are counted in either mode.
     """
 
-    def __init__(self, video_source: VideoSource, fps: float, queue_size: int = 4):
+    def __init__(self, video_source: VideoSource, fps: float, queue_size: int = 4, lossless: bool = False):
         """
         :param video_source:
             An instance of VideoSource that represents a camera stream or video file.
@@ -80,13 +172,23 @@ class VideoStream(Thread):
             Frame rate of the inference engine.
         :param queue_size:
             Size of the FIFO queue that stores a tuple of image and scaled image.
+        :param lossless:
+            Whether to block instead of dropping frames when the queue is full.
         """
         Thread.__init__(self)
         self.video_source = video_source
         self.frames = queue.Queue(queue_size)
         self.fps = fps
         self.delta_t = 1.0 / self.fps
+        self.lossless = lossless
         self._shutdown = False
+        self.num_dropped_frames = 0
+        self.num_late_frames = 0
+        # Time at which the last frame returned by `get_image` was captured
+        self.last_frame_time = None
+        self._queue_depth = REGISTRY.gauge('sense_video_stream_queue_depth')
+        self._dropped_frames = REGISTRY.counter('sense_video_stream_dropped_frames_total')
+        self._late_frames = REGISTRY.counter('sense_video_stream_late_frames_total')
 
     def stop(self):
         """Stop the VideoStream instance."""
@@ -94,19 +196,28 @@ class VideoStream(Thread):
 
     def get_image(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
         """Get an image frame from the FIFO queue of frames."""
-        return self.frames.get()
+        image_tuple, self.last_frame_time = self.frames.get()
+        self._queue_depth.set(self.frames.qsize())
+        return image_tuple
 
     def run(self):
         while not self._shutdown:
             time_start = time.perf_counter()
             image_tuple = self.video_source.get_image()
+            item = (image_tuple, time.perf_counter())
 
-            if self.frames.full():
-                # Remove one frame
-                self.frames.get_nowait()
-                print("*** Frame skipped ***")
+            if self.lossless:
+                self._put_blocking(item)
+            else:
+                if self.frames.full():
+                    # Remove one frame
+                    self.frames.get_nowait()
+                    self.num_dropped_frames += 1
+                    self._dropped_frames.inc()
+                    print("*** Frame skipped ***")
 
-            self.frames.put(image_tuple, False)
+                self.frames.put(item, False)
+            self._queue_depth.set(self.frames.qsize())
 
             # Last frame was a None
             if image_tuple is None:
@@ -118,6 +229,60 @@ class VideoStream(Thread):
             delay = self.delta_t - elapsed
             if delay > 0:
                 time.sleep(delay)
+            else:
+                self.num_late_frames += 1
+                self._late_frames.inc()
+
+    def _put_blocking(self, item):
+        while not self._shutdown:
+            try:
+                self.frames.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+class ClipBuffer:
+    """
+    Preallocated buffer that assembles captured frames into clips for the inference engine.
+
+    Each frame is written once, in place, into one of several clip slots. A slot is only handed out
+    once it holds a complete step, and it is only overwritten after `num_clips - 1` further clips have
+    been handed out, which leaves time for the inference engine to consume it.
+    """
+
+    def __init__(self, step_size: int, frame_size: Tuple[int, int], num_clips: int = 3, dtype=np.uint8):
+        """
+        :param step_size:
+            Number of frames in a clip.
+        :param frame_size:
+            The size of the frames, as (height, width).
+        :param num_clips:
+            Number of clip slots that are used in a round-robin fashion.
+        :param dtype:
+            Data type of the stored frames. Frames are kept as uint8 by default, which networks
+            supporting it normalize inside their first layer.
+        """
+        self.step_size = step_size
+        self._clips = np.zeros((num_clips, 1, step_size, frame_size[0], frame_size[1], 3), dtype=dtype)
+        self._clip_index = 0
+        self._frame_index = 0
+
+    def append(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Write a frame into the buffer. If the frame completes a step, the clip is returned as a
+        contiguous array of shape (1, step_size, height, width, 3), otherwise None is returned.
+        """
+        clip = self._clips[self._clip_index]
+        clip[0, self._frame_index] = frame
+        self._frame_index += 1
+
+        if self._frame_index < self.step_size:
+            return None
+
+        self._frame_index = 0
+        self._clip_index = (self._clip_index + 1) % len(self._clips)
+        return clip
 
 
 class VideoWriter:
@@ -143,7 +308,8 @@ class VideoWriter:
         now = time.perf_counter()
         if now - self._last_time >= self.delta_t:
             self.last_time_written = now
-            self.writer.write(frame)
+            with REGISTRY.timer('sense_video_writer_seconds'):
+                self.writer.write(frame)
 
     def release(self):  # noqa: D102
         self.writer.release()
@@ -1,30 +1,40 @@
-from collections import Callable
+from typing import TYPE_CHECKING
+from typing import Callable
 from typing import List
 from typing import Optional
 from typing import Union
 
+from sense.camera import ClipBuffer
 from sense.camera import VideoSource
 from sense.camera import VideoStream
 from sense.display import DisplayResults
 from sense.engine import InferenceEngine
-from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
 from sense.downstream_tasks.postprocess import PostProcessor
+from sense.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
 
 import cv2
 import numpy as np
+import time
 
 
 class Controller:
     def __init__(
             self,
-            neural_network: RealtimeNeuralNet,
+            neural_network: 'RealtimeNeuralNet',
             post_processors: Union[PostProcessor, List[PostProcessor]],
             results_display: DisplayResults,
             callbacks: Optional[List[Callable]] = None,
             camera_id: int = 0,
             path_in: str = Optional[None],
             path_out: str = Optional[None],
-            use_gpu: bool = True):
+            use_gpu: bool = True,
+            lossless: bool = False,
+            queue_size: int = 1,
+            metrics_port: Optional[int] = None,
+            metrics_trace: Optional[str] = None):
         """
         :param neural_network:
             The neural network that produces the predictions for the camera image.
@@ -47,14 +57,27 @@ class Controller:
             If provided, store the captured video in a file in this location
         :param use_gpu:
             If True, run the model on the GPU
+        :param lossless:
+            If True, frames, clips and predictions are never dropped: the video stream and the inference
+            engine are slowed down instead, and every prediction is post-processed. Use this for
+            post-processors that accumulate over steps, such as rep counting or calorie estimation.
+        :param queue_size:
+            Number of clips that can be queued for inference.
+        :param metrics_port:
+            If provided, serve the timings and counters of all pipeline stages in the Prometheus text format
+            under http://localhost:<metrics_port>/metrics while the inference is running.
+        :param metrics_trace:
+            If provided, append the timing of every pipeline stage to this JSONL file while the inference is running.
         """
-        self.inference_engine = InferenceEngine(neural_network, use_gpu=use_gpu)
+        self.lossless = lossless
+        self.inference_engine = InferenceEngine(neural_network, use_gpu=use_gpu, lossless=lossless,
+                                                queue_size=queue_size)
         video_source = VideoSource(
             camera_id=camera_id,
             size=self.inference_engine.expected_frame_size,
             filename=path_in
         )
-        self.video_stream = VideoStream(video_source, self.inference_engine.fps)
+        self.video_stream = VideoStream(video_source, self.inference_engine.fps, lossless=lossless)
 
         if isinstance(post_processors, list):
             self.postprocessors = post_processors
@@ -63,14 +86,18 @@ class Controller:
 
         self.callbacks = callbacks or []
 
-        self.frame_index = None
-        self.clip = None
+        self.clip_buffer = None  # created in `_start_inference`
 
         self.results_display = results_display
         self.path_out = path_out
         self.video_recorder = None  # created in `display_prediction`
         self.video_recorder_raw = None  # created in `display_prediction`
 
+        self.metrics_port = metrics_port
+        self.metrics_trace = metrics_trace
+        self.metrics_server = None  # created in `_start_inference`
+        self._frame_age = REGISTRY.histogram('sense_frame_age_seconds')
+
     def run_inference(self):
         runtime_error = None
 
@@ -78,30 +105,33 @@ class Controller:
 
         while True:
             try:
-                self.frame_index += 1
-
                 # Grab frame if possible
                 img_tuple = self.video_stream.get_image()
                 # If not possible, stop
                 if img_tuple is None:
+                    if self.lossless:
+                        # Process the remaining clips
+                        self.inference_engine.wait_until_done()
+                        for prediction in self._get_predictions():
+                            self.postprocess_prediction(prediction)
                     break
 
                 # Unpack
                 img, numpy_img = img_tuple
 
-                self.clip = np.roll(self.clip, -1, 1)
-                self.clip[:, -1, :, :, :] = numpy_img
+                clip = self.clip_buffer.append(numpy_img)
 
-                if self.frame_index == self.inference_engine.step_size:
-                    # A new clip is ready
-                    self.inference_engine.put_nowait(self.clip)
+                # Get predictions, before possibly waiting for room in the inference engine's queue
+                predictions = self._get_predictions()
 
-                self.frame_index = self.frame_index % self.inference_engine.step_size
+                if clip is not None:
+                    # A new clip is ready
+                    self.inference_engine.put(clip)
 
-                # Get predictions
-                prediction = self.inference_engine.get_nowait()
+                predictions += self._get_predictions()
 
-                prediction_postprocessed = self.postprocess_prediction(prediction)
+                for prediction in predictions or [None]:
+                    prediction_postprocessed = self.postprocess_prediction(prediction)
 
                 self.display_prediction(img, prediction_postprocessed)
 
@@ -122,34 +152,54 @@ class Controller:
         if runtime_error:
             raise runtime_error
 
+    def _get_predictions(self) -> list:
+        """
+        Return all available predictions. Only the latest one is available unless running in lossless mode.
+        """
+        predictions = []
+        prediction = self.inference_engine.get_nowait()
+        while prediction is not None:
+            predictions.append(prediction)
+            prediction = self.inference_engine.get_nowait()
+        return predictions
+
     def postprocess_prediction(self, prediction):
         post_processed_data = {}
         for post_processor in self.postprocessors:
-            post_processed_data.update(post_processor(prediction))
+            with REGISTRY.timer('sense_postprocess_seconds', labels={'postprocessor': type(post_processor).__name__}):
+                post_processed_data.update(post_processor(prediction))
         return {'prediction': prediction, **post_processed_data}
 
     def display_prediction(self, img: np.ndarray, prediction_postprocessed: dict):
         # Live display
-        img_augmented = self.results_display.show(img, prediction_postprocessed)
+        with REGISTRY.timer('sense_display_seconds'):
+            img_augmented = self.results_display.show(img, prediction_postprocessed)
+
+        # Time from capturing the frame to displaying it
+        if self.video_stream.last_frame_time is not None:
+            self._frame_age.observe(time.perf_counter() - self.video_stream.last_frame_time)
 
         # Recording
         if self.path_out:
             if self.video_recorder is None or self.video_recorder_raw is None:
                 self._instantiate_video_recorders(img_augmented, img)
 
-            self.video_recorder.write(img_augmented)
-            self.video_recorder_raw.write(img)
+            with REGISTRY.timer('sense_video_writer_seconds'):
+                self.video_recorder.write(img_augmented)
+                self.video_recorder_raw.write(img)
 
     def _start_inference(self):
         print("Starting inference")
-        self.clip = np.random.randn(
-            1,
-            self.inference_engine.step_size,
-            self.inference_engine.expected_frame_size[0],
-            self.inference_engine.expected_frame_size[1],
-            3
+        self.clip_buffer = ClipBuffer(
+            step_size=self.inference_engine.step_size,
+            frame_size=self.inference_engine.expected_frame_size,
+            # A clip slot must not be overwritten while it is queued or processed
+            num_clips=self.inference_engine.queue_size + 2,
         )
-        self.frame_index = 0
+        if self.metrics_port is not None:
+            self.metrics_server = REGISTRY.serve(self.metrics_port)
+        if self.metrics_trace is not None:
+            REGISTRY.start_trace(self.metrics_trace)
         self.inference_engine.start()
         self.video_stream.start()
 
@@ -159,6 +209,19 @@ class Controller:
         self.video_stream.stop()
         self.inference_engine.stop()
 
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        if self.metrics_trace is not None:
+            REGISTRY.stop_trace()
+
+        num_dropped_steps = self.inference_engine.num_dropped_clips + self.inference_engine.num_dropped_predictions
+        if num_dropped_steps or self.video_stream.num_dropped_frames:
+            print(f"Dropped {self.video_stream.num_dropped_frames} frames, "
+                  f"{self.inference_engine.num_dropped_clips} clips and "
+                  f"{self.inference_engine.num_dropped_predictions} predictions")
+
         if self.video_recorder is not None:
             self.video_recorder.release()
 
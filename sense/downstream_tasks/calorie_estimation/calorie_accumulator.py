@@ -15,7 +15,7 @@ class CalorieAccumulator(PostProcessor):
     """
 
     def __init__(self, weight=70, height=170, age=30, gender='unknown', smoothing=20,
-                 recovery_factor=60, **kwargs):
+                 recovery_factor=60, clock=None, **kwargs):
         """
         :param weight:           User's weight (in kg).
         :param height:           User's height (in cm).
@@ -27,6 +27,8 @@ class CalorieAccumulator(PostProcessor):
                                  resting MET value. recovery_factor=30 means that it will
                                  take ~2 minutes to get back to a MET value of 1 after
                                  reaching a MET value of 8.
+        :param clock:            Function returning the current time (in seconds). Defaults to
+                                 `time.perf_counter`; offline scoring uses the video time instead.
         """
         super().__init__(**kwargs)
         self.weight = weight
@@ -35,6 +37,7 @@ class CalorieAccumulator(PostProcessor):
         self.gender = gender
         self.smoothing = smoothing
         self.recovery_factor = recovery_factor
+        self.clock = clock or time.perf_counter
         self.met_value_running = 0.
         self.calorie_count = 0
         self.buffer = [(5, 0)]  # initialize with 5 seconds of MET=0
@@ -47,7 +50,7 @@ class CalorieAccumulator(PostProcessor):
         """
         if met_value_live is not None:
             met_value_live = met_value_live.mean()
-            now = time.perf_counter()
+            now = self.clock()
             duration = now - (self.time_last_update or now - 1.)
             self.time_last_update = now
             self.buffer.insert(0, (duration, self.correct_met_value(self.met_value_live)))
@@ -1,13 +1,97 @@
+import copy
+import json
 import os
+import struct
+from collections import OrderedDict
 from pathlib import Path
 
 import numpy as np
 import torch
 import torch.nn as nn
+from typing import Dict
+from typing import List
+from typing import Optional
 from typing import Tuple
 
 from sense import RESOURCES_DIR
 
+TENSOR_ARCHIVE_EXTENSION = '.tensors'
+_TENSOR_ARCHIVE_MAGIC = b'SENSETNS'
+_TENSOR_ARCHIVE_ALIGNMENT = 64
+
+# Checkpoints loaded by this process, with the modification time of their file, by resolved path
+_checkpoint_cache = {}
+
+
+class InternalState:
+    """
+    Snapshot of the temporal internal states of all steppable layers of a network.
+
+    All layer states are stored back-to-back in a single flat tensor, which makes the bundle cheap
+    to copy, move between devices or keep around for many streams.
+    """
+
+    def __init__(self, data: torch.Tensor, shapes: List[torch.Size]):
+        """
+        :param data:
+            Flat tensor holding the concatenated states of all layers.
+        :param shapes:
+            The shape of each layer state, in the order the layers appear in the network.
+        """
+        self.data = data
+        self.shapes = shapes
+
+    @classmethod
+    def from_layer_states(cls, layer_states: List[torch.Tensor]) -> 'InternalState':
+        """Bundle a list of layer states into a single flat tensor."""
+        data = torch.cat([layer_state.reshape(-1) for layer_state in layer_states])
+        return cls(data, [layer_state.shape for layer_state in layer_states])
+
+    @classmethod
+    def interleave(cls, states: List['InternalState']) -> 'InternalState':
+        """
+        Combine the states of several streams into the state of a batched network, see
+        `RealtimeNeuralNet.set_batch_size`.
+        """
+        batch_size = len(states)
+        shapes = [torch.Size((shape[0] * batch_size, *shape[1:])) for shape in states[0].shapes]
+        interleaved = cls(states[0].data.new_empty(batch_size * states[0].data.numel()), shapes)
+        for layer_state, *stream_layer_states in zip(interleaved.layer_states(),
+                                                     *[state.layer_states() for state in states]):
+            layer_state = layer_state.view(-1, batch_size, *layer_state.shape[1:])
+            for index, stream_layer_state in enumerate(stream_layer_states):
+                layer_state[:, index] = stream_layer_state
+        return interleaved
+
+    def deinterleave(self, batch_size: int) -> List['InternalState']:
+        """
+        Split the state of a batched network into the states of the individual streams. This is
+        the inverse of `interleave`.
+        """
+        shapes = [torch.Size((shape[0] // batch_size, *shape[1:])) for shape in self.shapes]
+        states = [InternalState(self.data.new_empty(self.data.numel() // batch_size), shapes)
+                  for _ in range(batch_size)]
+        for layer_state, *stream_layer_states in zip(self.layer_states(),
+                                                     *[state.layer_states() for state in states]):
+            layer_state = layer_state.view(-1, batch_size, *layer_state.shape[1:])
+            for index, stream_layer_state in enumerate(stream_layer_states):
+                stream_layer_state.copy_(layer_state[:, index])
+        return states
+
+    def layer_states(self) -> List[torch.Tensor]:
+        """Return the state of each layer as a view on the flat tensor."""
+        sizes = [shape.numel() for shape in self.shapes]
+        return [chunk.view(shape) for chunk, shape in zip(self.data.split(sizes), self.shapes)]
+
+    def to(self, device) -> 'InternalState':
+        """Return a copy of the bundle on the given device."""
+        return InternalState(self.data.to(device), self.shapes)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory footprint of the bundle in bytes."""
+        return self.data.numel() * self.data.element_size()
+
 
 class RealtimeNeuralNet(nn.Module):
     """
@@ -41,18 +125,71 @@ class RealtimeNeuralNet(nn.Module):
     @property
     def expected_frame_size(self) -> Tuple[int, int]:
         """
-        Return the expected frame size of the neural network.
+        Return the expected frame size of the neural network, as (height, width).
         """
         raise NotImplementedError
 
+    def set_batch_size(self, batch_size: int):
+        """
+        Set the number of independent clips that are interleaved along the time dimension of the
+        input tensor, e.g. to serve several video streams with a single forward pass. Frames are
+        expected in time-major order: the frame at time t of clip b is found at index t * batch_size + b.
+        """
+        for module in self.modules():
+            if hasattr(module, 'batch_size'):
+                module.batch_size = batch_size
+
+    def get_internal_state(self) -> Optional[InternalState]:
+        """
+        Export the temporal internal states of all steppable layers as a single bundle. Returns
+        None if the network has no steppable layer or has not processed any frame since its last reset.
+        """
+        layer_states = [layer.internal_state for layer in self._steppable_layers()]
+        if not layer_states or any(layer_state is None for layer_state in layer_states):
+            return None
+        return InternalState.from_layer_states(layer_states)
+
+    def set_internal_state(self, state: Optional[InternalState]):
+        """
+        Swap in a bundle of internal states that was exported with `get_internal_state`, e.g. before
+        processing the next clip of another video stream. The cost is proportional to the size of the
+        state instead of a re-run of the warm-up frames. Passing None resets all internal states.
+        """
+        layers = self._steppable_layers()
+        if state is None:
+            for layer in layers:
+                layer.internal_state = None
+            return
+
+        layer_states = state.layer_states()
+        if len(layer_states) != len(layers):
+            raise ValueError(f'Internal state holds {len(layer_states)} layer states, '
+                             f'but the network has {len(layers)} steppable layers')
+        for layer, layer_state in zip(layers, layer_states):
+            layer.internal_state = layer_state
+
+    def _steppable_layers(self):
+        return [module for module in self.modules() if hasattr(module, 'internal_state')]
+
     def load_weights_from_resources(self, checkpoint_path: str, strict: bool = True):
         """
         Load weights from provided checkpoint file, unless the TRAVIS environment
         variable is defined.
+
+        The weights of a tensor archive (see `save_tensor_archive`) are used in place: they stay
+        memory-mapped, so that networks and processes loading the same archive share them through the
+        page cache until they are modified, e.g. by training.
         """
         if not os.getenv('TRAVIS', False) == 'true':
             checkpoint = load_weights_from_resources(checkpoint_path)
             self.load_state_dict(checkpoint, strict=strict)
+            if checkpoint_path.endswith(TENSOR_ARCHIVE_EXTENSION):
+                tensors = dict(self.named_parameters())
+                tensors.update(self.named_buffers())
+                for name, tensor in checkpoint.items():
+                    if name in tensors and tensors[name].shape == tensor.shape \
+                            and tensors[name].dtype == tensor.dtype:
+                        tensors[name].data = tensor
         else:
             print('Weights are not loaded on Travis.')
 
@@ -65,11 +202,36 @@ class Pipe(RealtimeNeuralNet):
         self.feature_converter = feature_converter
 
     def forward(self, input_tensor):
+        if input_tensor.dim() == 5:
+            return self.forward_batch(input_tensor)
+
         feature = self.feature_extractor(input_tensor)
         if isinstance(self.feature_converter, list):
             return [convert(feature) for convert in self.feature_converter]
         return self.feature_converter(feature)
 
+    def forward_batch(self, input_tensor):
+        """
+        Process a batch of independent clips of shape (batch, time, channels, height, width) with a
+        single forward pass, e.g. during training. The clips are interleaved along the time dimension
+        so that the steppable layers keep them apart. Outputs have the shape (batch, time, ...).
+        Existing internal states are left untouched.
+        """
+        batch_size = input_tensor.shape[0]
+        internal_state = self.get_internal_state()
+        self.set_internal_state(None)
+        self.set_batch_size(batch_size)
+        try:
+            output = self(input_tensor.transpose(0, 1).flatten(0, 1))
+        finally:
+            self.set_batch_size(1)
+            self.set_internal_state(internal_state)
+
+        if isinstance(output, list):
+            return [out.view(-1, batch_size, *out.shape[1:]).transpose(0, 1) if out is not None else None
+                    for out in output]
+        return output.view(-1, batch_size, *output.shape[1:]).transpose(0, 1)
+
     @property
     def expected_frame_size(self) -> Tuple[int, int]:
         return self.feature_extractor.expected_frame_size
@@ -86,6 +248,121 @@ class Pipe(RealtimeNeuralNet):
         return self.feature_extractor.preprocess(clip)
 
 
+class MultiHeadPipe(Pipe):
+    """
+    Pipe running several feature converters, called heads, on top of a shared feature extractor.
+
+    Heads are registered by name and return their outputs in the order of registration, so that
+    post-processors can select them with `indices` as with a list of feature converters. Each head can
+    be disabled at runtime, or run on every `stride`-th forward pass only, e.g. for slowly varying
+    outputs such as MET values. Disabled and skipped heads output None for that pass, which
+    post-processors treat as a missing prediction. Strides are meant for step-by-step inference, where
+    every forward pass processes one step, and are counted from the last reset of the internal states.
+    The number of forward passes is kept along with the internal states, so that each stream of a
+    `MultiStreamInferenceEngine` counts its own passes. When several streams are processed with a
+    single forward pass, a head runs for all of them as soon as it is due for one of them.
+
+    Features are globally average-pooled once for all heads that pool them (i.e. heads with
+    `global_average_pooling=True`, such as `LogisticRegression`), which receive them as maps of 1x1
+    pixels: their own pooling is then trivial, and heads are not modified by the pipe.
+    """
+
+    def __init__(self, feature_extractor, heads: Optional[Dict[str, nn.Module]] = None):
+        """
+        :param feature_extractor:
+            The feature extractor shared by all heads.
+        :param heads:
+            Heads to add with a stride of 1, by name.
+        """
+        super().__init__(feature_extractor, nn.ModuleDict())
+        self.strides = {}
+        self.enabled = {}
+        self._pass_counter = _ForwardPassCounter()
+        for name, head in (heads or {}).items():
+            self.add_head(name, head)
+
+    @property
+    def heads(self) -> nn.ModuleDict:
+        return self.feature_converter
+
+    @property
+    def head_names(self) -> List[str]:
+        """Names of the heads, in the order of their outputs."""
+        return list(self.heads)
+
+    def add_head(self, name: str, head: nn.Module, stride: int = 1, enabled: bool = True):
+        """
+        :param name:
+            Name of the head, which must be unique.
+        :param head:
+            Module converting the features of the feature extractor.
+        :param stride:
+            Number of forward passes between two runs of the head.
+        :param enabled:
+            Whether the head is run.
+        """
+        if name in self.heads:
+            raise ValueError(f'A head named {name} already exists')
+        self.heads[name] = head
+        self.set_stride(name, stride)
+        self.enabled[name] = enabled
+
+    def set_stride(self, name: str, stride: int):
+        if stride < 1:
+            raise ValueError(f'The stride of a head should be at least 1, got {stride}')
+        self.strides[name] = stride
+
+    def enable_head(self, name: str, enabled: bool = True):
+        self.enabled[name] = enabled
+
+    def disable_head(self, name: str):
+        self.enable_head(name, False)
+
+    def forward(self, input_tensor):
+        if input_tensor.dim() == 5:
+            return self.forward_batch(input_tensor)
+
+        feature = self.feature_extractor(input_tensor)
+        num_forward_passes = self._pass_counter.step(feature, period=int(np.lcm.reduce(list(self.strides.values()))))
+        pooled_feature = None
+        outputs = []
+        for name, head in self.heads.items():
+            if not self.enabled[name] or not (num_forward_passes % self.strides[name] == 0).any():
+                outputs.append(None)
+            elif getattr(head, 'global_average_pooling', False):
+                if pooled_feature is None:
+                    pooled_feature = feature.mean(dim=(-2, -1), keepdim=True)
+                outputs.append(head(pooled_feature))
+            else:
+                outputs.append(head(feature))
+        return outputs
+
+
+class _ForwardPassCounter(nn.Module):
+    """
+    Count the forward passes of each stream of a `MultiHeadPipe`. The counts are exposed as an internal
+    state, so that they are exported, swapped, batched and reset along with the internal states of the
+    steppable layers. Batches of `forward_batch` thus start counting from zero and do not count
+    towards the strides.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batch_size = 1
+        self.internal_state = None
+
+    def step(self, reference: torch.Tensor, period: int) -> torch.Tensor:
+        """
+        Return the number of forward passes of each stream so far, modulo the given period, and count
+        one more pass.
+        """
+        if self.internal_state is None:
+            self.internal_state = reference.new_zeros(self.batch_size)
+        num_forward_passes = self.internal_state
+        self.internal_state = (num_forward_passes + 1) % period
+        return num_forward_passes
+
+
 class LogisticRegression(nn.Sequential):
 
     def __init__(self, num_in, num_out, use_softmax=True, global_average_pooling=True):
@@ -108,19 +385,115 @@ class LogisticRegressionSigmoid(LogisticRegression):
         self.add_module(str(len(self)), nn.Sigmoid())
 
 
-def load_weights_from_resources(checkpoint_path: str):
+def load_weights_from_resources(checkpoint_path: str, use_cache: bool = False):
     """
     Load weights from a checkpoint file located in the resources folder.
 
+    Checkpoints saved as tensor archives (see `save_tensor_archive`) are memory-mapped instead of being
+    read. They are never cached: each load gets its own copy-on-write mapping, so that the tensors of
+    different loads can be modified independently while their unmodified pages are still shared
+    through the page cache.
+
     :param checkpoint_path:
         A string representing the absolute/relative path to the checkpoint file.
+    :param use_cache:
+        Whether to cache a PyTorch checkpoint for the lifetime of the process, by resolved path and
+        modification time. Loading the same file again then returns a new dictionary holding the same
+        tensors, which must thus not be modified in-place. Off by default, as a cached checkpoint is a
+        second copy of the weights in memory, next to the network they are loaded into.
     """
     checkpoint_path = os.path.join(RESOURCES_DIR, checkpoint_path.split(f'resources{os.sep}')[-1])
     try:
-        return torch.load(checkpoint_path, map_location='cpu')
+        modification_time = os.stat(checkpoint_path).st_mtime_ns
 
     except FileNotFoundError:
         raise FileNotFoundError('Weights file missing: {}. '
                                 'To download, please go to '
                                 'https://20bn.com/licensing/sdk/evaluation and follow the '
                                 'instructions.'.format(checkpoint_path))
+
+    if checkpoint_path.endswith(TENSOR_ARCHIVE_EXTENSION):
+        return load_tensor_archive(checkpoint_path)
+
+    resolved_path = os.path.realpath(checkpoint_path)
+    cached = _checkpoint_cache.get(resolved_path)
+    if use_cache and cached is not None and cached[0] == modification_time:
+        return copy.copy(cached[1])
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    if use_cache:
+        _checkpoint_cache[resolved_path] = (modification_time, checkpoint)
+    return copy.copy(checkpoint)
+
+
+def clear_checkpoint_cache():
+    """Forget the checkpoints cached by `load_weights_from_resources`."""
+    _checkpoint_cache.clear()
+
+
+def save_tensor_archive(state_dict: Dict[str, torch.Tensor], path: str):
+    """
+    Save a state dict as a tensor archive: a json header describing the tensors, followed by their raw
+    data. Unlike PyTorch checkpoints, archives can be memory-mapped when loaded, see `load_tensor_archive`.
+    The file is replaced atomically, which leaves the archive mapped by running processes untouched.
+
+    :param state_dict:
+        Dictionary of dense tensors, e.g. the state dict of a network.
+    :param path:
+        Path of the archive, which should have the `.tensors` extension.
+    """
+    entries = OrderedDict()
+    arrays = []
+    size = 0
+    for name, tensor in state_dict.items():
+        if tensor.is_quantized or tensor.is_sparse:
+            raise ValueError(f'Tensor archives only support dense tensors, but {name} is not')
+        array = tensor.detach().cpu().contiguous().numpy()
+        offset = _align(size)
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        arrays.append((offset, array))
+        size = offset + array.nbytes
+
+    header = json.dumps(entries).encode()
+    data_start = _align(len(_TENSOR_ARCHIVE_MAGIC) + 8 + len(header))
+    path_tmp = f'{path}.tmp'
+    with open(path_tmp, 'wb') as f:
+        f.write(_TENSOR_ARCHIVE_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + size)
+    os.replace(path_tmp, path)
+
+
+def load_tensor_archive(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Load a tensor archive written by `save_tensor_archive`. The tensors are copy-on-write views on a new
+    mapping of the file: their memory is shared with the other mappings of the same file, in this
+    process or others, until they are modified.
+
+    :param path:
+        Path of the archive.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_TENSOR_ARCHIVE_MAGIC)) != _TENSOR_ARCHIVE_MAGIC:
+            raise ValueError(f'{path} is not a tensor archive')
+        header_size, = struct.unpack('<Q', f.read(8))
+        entries = json.loads(f.read(header_size), object_pairs_hook=OrderedDict)
+
+    data_start = _align(len(_TENSOR_ARCHIVE_MAGIC) + 8 + header_size)
+    buffer = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = OrderedDict()
+    for name, entry in entries.items():
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        num_bytes = int(np.prod(entry['shape'])) * dtype.itemsize
+        array = buffer[start:start + num_bytes].view(dtype).reshape(entry['shape'])
+        state_dict[name] = torch.from_numpy(array)
+    return state_dict
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _TENSOR_ARCHIVE_ALIGNMENT) * _TENSOR_ARCHIVE_ALIGNMENT
@@ -1,37 +1,76 @@
+import asyncio
+import contextlib
 import numpy as np
 import queue
-import torch
+import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
 from threading import Thread
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import Hashable
 from typing import List
 from typing import Optional
 from typing import Tuple
 from typing import Union
 
-from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
+from sense.metrics import BATCH_SIZE_BUCKETS
+from sense.metrics import Histogram
+from sense.metrics import REGISTRY
+from sense.runtime import RuntimeNet
+
+if TYPE_CHECKING:
+    # PyTorch is only imported once a PyTorch network is run, runtime backends do not need it
+    from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
 
 
 class InferenceEngine(Thread):
     """
     InferenceEngine takes in a neural network and uses it to output predictions
     either using the local machine's CPU or GPU.
+
+    By default, the engine favors latency: when it cannot keep up, the oldest pending clip and the
+    oldest unused prediction are dropped. In lossless mode, no clip and no prediction is ever dropped:
+    `put` blocks until there is room in the input queue and all predictions are kept until they are
+    retrieved. The number of dropped clips and predictions, as well as the number of clips that had to
+    wait for room in the input queue, are counted in either mode.
     """
 
-    def __init__(self, net: RealtimeNeuralNet, use_gpu: bool = False):
+    def __init__(self, net: 'RealtimeNeuralNet', use_gpu: bool = False, lossless: bool = False, queue_size: int = 1):
         """
         :param net:
-            The neural network to be run by the inference engine.
+            The neural network to be run by the inference engine. Besides PyTorch networks, runtime
+            backends such as `sense.onnx_runtime.OnnxRuntimeNet` or `sense.tflite_interpreter.TFLiteNet`
+            are supported.
         :param use_gpu:
             Whether to leverage CUDA or not for neural network inference.
+        :param lossless:
+            Whether to apply backpressure instead of dropping clips and predictions.
+        :param queue_size:
+            Number of clips that can be queued for inference.
         """
         Thread.__init__(self)
         self.net = net
-        self.use_gpu = use_gpu
-        if use_gpu:
+        # Runtime backends manage their own devices
+        self.use_gpu = use_gpu and hasattr(net, 'cuda')
+        if self.use_gpu:
             self.net.cuda()
-        self._queue_in = queue.Queue(1)
-        self._queue_out = queue.Queue(1)
+        self.lossless = lossless
+        self.queue_size = queue_size
+        self._queue_in = queue.Queue(queue_size)
+        # In lossless mode, predictions are never held back so that a consumer blocked in `put` cannot
+        # deadlock the engine
+        self._queue_out = queue.Queue(0 if lossless else 1)
         self._shutdown = False
+        self.num_dropped_clips = 0
+        self.num_dropped_predictions = 0
+        self.num_late_clips = 0
+        self._queue_depth = REGISTRY.gauge('sense_engine_queue_depth')
+        self._dropped_clips = REGISTRY.counter('sense_engine_dropped_clips_total')
+        self._dropped_predictions = REGISTRY.counter('sense_engine_dropped_predictions_total')
+        self._late_clips = REGISTRY.counter('sense_engine_late_clips_total')
 
     @property
     def expected_frame_size(self) -> Tuple[int, int]:
@@ -58,7 +97,38 @@ class InferenceEngine(Thread):
         if self._queue_in.full():
             # Remove one clip
             self._queue_in.get_nowait()
+            self._queue_in.task_done()
+            self.num_dropped_clips += 1
+            self._dropped_clips.inc()
         self._queue_in.put_nowait(clip)
+        self._queue_depth.set(self._queue_in.qsize())
+
+    def put(self, clip: np.ndarray):
+        """
+        Add a new clip to the input queue of the inference engine for prediction. In lossless mode,
+        block until there is room in the queue, otherwise see `put_nowait`.
+
+        :param clip:
+            The video frame to be added to the inference engine's input queue.
+        """
+        if not self.lossless:
+            self.put_nowait(clip)
+            return
+
+        if self._queue_in.full():
+            self.num_late_clips += 1
+            self._late_clips.inc()
+        while not self._shutdown:
+            try:
+                self._queue_in.put(clip, timeout=1)
+                self._queue_depth.set(self._queue_in.qsize())
+                return
+            except queue.Full:
+                pass
+
+    def wait_until_done(self):
+        """Block until all queued clips have been processed."""
+        self._queue_in.join()
 
     def get_nowait(self) -> Optional[np.ndarray]:
         """
@@ -79,6 +149,7 @@ class InferenceEngine(Thread):
         while not self._shutdown:
             try:
                 clip = self._queue_in.get(timeout=1)
+                self._queue_depth.set(self._queue_in.qsize())
             except queue.Empty:
                 clip = None
 
@@ -87,15 +158,19 @@ class InferenceEngine(Thread):
 
                 # Remove time dimension
                 if isinstance(predictions, list):
-                    predictions = [pred[0] for pred in predictions]
+                    # Outputs of heads that were skipped (see `MultiHeadPipe`) are None
+                    predictions = [pred[0] if pred is not None else None for pred in predictions]
                 else:
                     predictions = predictions[0]
 
                 if self._queue_out.full():
                     # Remove one frame
                     self._queue_out.get_nowait()
+                    self.num_dropped_predictions += 1
+                    self._dropped_predictions.inc()
                     print("*** Unused predictions ***")
                 self._queue_out.put(predictions, block=False)
+                self._queue_in.task_done()
 
     def infer(self, clip: np.ndarray, batch_size=None) -> Union[np.ndarray, List[np.ndarray]]:
         """
@@ -121,26 +196,415 @@ class InferenceEngine(Thread):
             Predictions from the neural network.
         """
         predictions = []
-        with torch.no_grad():
-            clip = self.net.preprocess(clip)
+        with _no_grad(self.net):
+            with REGISTRY.timer('sense_engine_preprocess_seconds'):
+                clip = self.net.preprocess(clip)
 
-            if self.use_gpu:
-                clip = clip.cuda()
-            if batch_size is None:
-                predictions = self.net(clip)
-            else:
-                for sub_clip in torch.Tensor.split(clip, batch_size):
-                    if sub_clip.shape[0] >= self.net.num_required_frames_per_layer_padding[0]:
-                        predictions.append(self.net(sub_clip))
-                if isinstance(predictions[0], list):
-                    predictions = list(zip(predictions))
-                    predictions = [torch.cat(x, dim=0) for x in predictions]
+                if self.use_gpu:
+                    clip = clip.cuda()
+            with REGISTRY.timer('sense_engine_forward_seconds'):
+                if batch_size is None:
+                    predictions = self.net(clip)
                 else:
-                    predictions = torch.cat(predictions, dim=0)
+                    for start in range(0, len(clip), batch_size):
+                        sub_clip = clip[start:start + batch_size]
+                        if sub_clip.shape[0] >= self.net.num_required_frames_per_layer_padding[0]:
+                            predictions.append(self.net(sub_clip))
+                    if isinstance(predictions[0], list):
+                        predictions = [_concatenate(x) for x in zip(*predictions)]
+                    else:
+                        predictions = _concatenate(predictions)
 
         if isinstance(predictions, list):
-            predictions = [pred.cpu().numpy() for pred in predictions]
+            predictions = [_to_numpy(pred) for pred in predictions]
         else:
-            predictions = predictions.cpu().numpy()
+            predictions = _to_numpy(predictions)
 
         return predictions
+
+
+class MultiStreamInferenceEngine(InferenceEngine):
+    """
+    MultiStreamInferenceEngine serves several video streams with a single neural network.
+
+    Clips are tagged with a stream id. The pending clips of all streams are stacked into one
+    batch and processed with a single forward pass, while the temporal internal states of the
+    network are kept separately for each stream. Predictions are scattered back per stream.
+
+    Batches are formed by a scheduler that waits for the clips of more streams until either
+    `max_batch_size` clips are pending or the oldest pending clip has waited for `max_latency`
+    seconds. The latency of each clip (from `put_nowait` until its prediction is available) and the
+    size of each batch are recorded in `latency_histogram` and `batch_size_histogram`.
+    """
+
+    def __init__(self, net: 'RealtimeNeuralNet', use_gpu: bool = False, max_batch_size: Optional[int] = None,
+                 max_latency: float = 0.):
+        """
+        :param net:
+            The neural network to be run by the inference engine.
+        :param use_gpu:
+            Whether to leverage CUDA or not for neural network inference.
+        :param max_batch_size:
+            Maximum number of clips processed with a single forward pass. Unlimited if None.
+        :param max_latency:
+            Maximum time (in seconds) a clip waits for other clips to be batched with. With the default
+            of 0, all pending clips are processed as soon as the engine is idle.
+        """
+        super().__init__(net, use_gpu=use_gpu)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.latency_histogram = Histogram()
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self._internal_states = {}
+        self._clips = {}
+        self._predictions = {}
+        self._condition = Condition()
+
+    @property
+    def stream_ids(self) -> List[Hashable]:
+        """Ids of all streams for which an internal state is currently stored."""
+        return list(self._internal_states)
+
+    def put_nowait(self, stream_id: Hashable, clip: np.ndarray):
+        """
+        Add a new clip of the given stream to the inference engine for prediction. If a clip
+        of the same stream is still pending, it is replaced.
+
+        :param stream_id:
+            The id of the video stream the clip belongs to.
+        :param clip:
+            The video frames to be added to the inference engine's input.
+        """
+        with self._condition:
+            self._clips[stream_id] = (clip, time.perf_counter())
+            self._condition.notify()
+
+    def put(self, stream_id: Hashable, clip: np.ndarray):
+        """
+        Add a new clip of the given stream to the inference engine for prediction. Clips are never
+        waited for, as a pending clip of the same stream is replaced, see `put_nowait`.
+
+        :param stream_id:
+            The id of the video stream the clip belongs to.
+        :param clip:
+            The video frames to be added to the inference engine's input.
+        """
+        self.put_nowait(stream_id, clip)
+
+    def get_nowait(self, stream_id: Hashable) -> Optional[Union[np.ndarray, List[np.ndarray]]]:
+        """
+        Return the latest prediction for the given stream if available.
+
+        :param stream_id:
+            The id of the video stream.
+        """
+        with self._condition:
+            return self._predictions.pop(stream_id, None)
+
+    def remove_stream(self, stream_id: Hashable):
+        """
+        Forget about a stream, including its pending clip, prediction and internal state.
+
+        :param stream_id:
+            The id of the video stream.
+        """
+        with self._condition:
+            self._clips.pop(stream_id, None)
+            self._predictions.pop(stream_id, None)
+            self._internal_states.pop(stream_id, None)
+
+    def run(self):
+        """
+        Keep the inference engine running and batch the pending clips of all streams.
+        """
+        while not self._shutdown:
+            requests = self._next_batch()
+
+            if requests:
+                predictions = self.infer_streams({stream_id: clip for stream_id, (clip, _) in requests.items()})
+                end_time = time.perf_counter()
+
+                self.batch_size_histogram.observe(len(requests))
+                for _, start_time in requests.values():
+                    self.latency_histogram.observe(end_time - start_time)
+
+                with self._condition:
+                    for stream_id, stream_predictions in predictions.items():
+                        # Remove time dimension
+                        if isinstance(stream_predictions, list):
+                            stream_predictions = [pred[0] if pred is not None else None
+                                                  for pred in stream_predictions]
+                        else:
+                            stream_predictions = stream_predictions[0]
+
+                        if stream_id in self._predictions:
+                            print(f"*** Unused predictions (stream {stream_id}) ***")
+                        self._predictions[stream_id] = stream_predictions
+
+    def _next_batch(self) -> Dict[Hashable, Tuple[np.ndarray, float]]:
+        """
+        Wait for the next batch of clips according to the batch size limit and the latency budget, and
+        remove it from the pending clips. The oldest clips are processed first.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._clips, timeout=1):
+                return {}
+
+            deadline = min(start_time for _, start_time in self._clips.values()) + self.max_latency
+            max_batch_size = self.max_batch_size or float('inf')
+            while len(self._clips) < max_batch_size and not self._shutdown:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            stream_ids = sorted(self._clips, key=lambda stream_id: self._clips[stream_id][1])
+            if self.max_batch_size:
+                stream_ids = stream_ids[:self.max_batch_size]
+            return {stream_id: self._clips.pop(stream_id) for stream_id in stream_ids}
+
+    def infer_streams(self, clips: Dict[Hashable, np.ndarray]) -> Dict[Hashable, Union[np.ndarray, List[np.ndarray]]]:
+        """
+        Infer predictions for one clip per stream with a single forward pass. All clips need to
+        have the same number of frames. The internal state of each stream is restored before and
+        stored after the forward pass.
+
+        :param clips:
+            A mapping from stream id to the clip of that stream.
+
+        :return:
+            A mapping from stream id to the predictions for that stream, see `infer` for the format.
+        """
+        import torch
+
+        stream_ids = list(clips)
+        batch_size = len(stream_ids)
+
+        with torch.no_grad():
+            with REGISTRY.timer('sense_engine_preprocess_seconds'):
+                # Interleave the streams along the time dimension (time-major)
+                batch = torch.stack([self.net.preprocess(clips[stream_id]) for stream_id in stream_ids], dim=1)
+                batch = batch.flatten(0, 1)
+
+                if self.use_gpu:
+                    batch = batch.cuda()
+
+            with REGISTRY.timer('sense_engine_forward_seconds'):
+                self._load_internal_states(stream_ids)
+                self.net.set_batch_size(batch_size)
+                try:
+                    predictions = self.net(batch)
+                finally:
+                    self.net.set_batch_size(1)
+                self._store_internal_states(stream_ids)
+
+        if isinstance(predictions, list):
+            predictions = [pred.view(-1, batch_size, *pred.shape[1:]).cpu().numpy() if pred is not None else None
+                           for pred in predictions]
+            return {stream_id: [pred[:, index] if pred is not None else None for pred in predictions]
+                    for index, stream_id in enumerate(stream_ids)}
+
+        predictions = predictions.view(-1, batch_size, *predictions.shape[1:]).cpu().numpy()
+        return {stream_id: predictions[:, index] for index, stream_id in enumerate(stream_ids)}
+
+    def _load_internal_states(self, stream_ids: List[Hashable]):
+        from sense.downstream_tasks.nn_utils import InternalState
+
+        states = [self._internal_states.get(stream_id) for stream_id in stream_ids]
+        reference = next((state for state in states if state is not None), None)
+        if reference is None:
+            # None of the streams has been seen before
+            self.net.set_internal_state(None)
+            return
+
+        # New streams start from a blank internal state
+        blank_state = InternalState(reference.data.new_zeros(reference.data.shape), reference.shapes)
+        states = [state if state is not None else blank_state for state in states]
+        self.net.set_internal_state(InternalState.interleave(states))
+
+    def _store_internal_states(self, stream_ids: List[Hashable]):
+        states = self.net.get_internal_state().deinterleave(len(stream_ids))
+        for stream_id, state in zip(stream_ids, states):
+            self._internal_states[stream_id] = state
+
+
+class AsyncInferenceEngine:
+    """
+    AsyncInferenceEngine serves the predictions of a neural network to asyncio code.
+
+    Each call to `infer_async` returns the predictions of the given clip. Clips of concurrent callers
+    that belong to different streams are micro-batched into a single forward pass (see
+    `MultiStreamInferenceEngine`), which runs in a worker thread so that the event loop is never blocked.
+    The number of clips waiting for inference is bounded: when the limit is reached, callers wait
+    before their clip is accepted instead of clips being dropped.
+
+    Usage:
+        async with AsyncInferenceEngine(net) as inference_engine:
+            predictions = await inference_engine.infer_async(clip, stream_id=client_id)
+    """
+
+    def __init__(self, net: 'RealtimeNeuralNet', use_gpu: bool = False, max_batch_size: int = 16,
+                 max_pending: int = 64):
+        """
+        :param net:
+            The neural network to be run by the inference engine.
+        :param use_gpu:
+            Whether to leverage CUDA or not for neural network inference.
+        :param max_batch_size:
+            Maximum number of clips processed with a single forward pass.
+        :param max_pending:
+            Maximum number of clips waiting for inference before callers of `infer_async` are held back.
+        """
+        self._engine = MultiStreamInferenceEngine(net, use_gpu=use_gpu)
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self._queue = None
+        self._task = None
+        self._executor = None
+
+    @property
+    def net(self) -> 'RealtimeNeuralNet':
+        return self._engine.net
+
+    @property
+    def expected_frame_size(self) -> Tuple[int, int]:
+        """Return the frame size of the video source input."""
+        return self._engine.expected_frame_size
+
+    @property
+    def fps(self) -> int:
+        """Frame rate of the inference engine's neural network."""
+        return self._engine.fps
+
+    @property
+    def step_size(self) -> int:
+        """The step size of the inference engine's neural network."""
+        return self._engine.step_size
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def start(self):
+        """Start processing clips. Needs to be called from within the running event loop."""
+        if self._task is not None:
+            raise RuntimeError('The inference engine is already running')
+        self._queue = asyncio.Queue(self.max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop processing clips. Predictions that are still awaited are cancelled."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._task = None
+
+    async def infer_async(self, clip: np.ndarray, stream_id: Hashable = None) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Infer and return the predictions for the given clip, see `InferenceEngine.infer` for the format.
+        Clips of the same stream are processed in the order in which they were submitted, and share the
+        temporal internal state of the network.
+
+        :param clip:
+            The video frames to be inferred.
+        :param stream_id:
+            The id of the video stream the clip belongs to.
+        """
+        if self._task is None:
+            raise RuntimeError('The inference engine needs to be started first')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((stream_id, clip, future))
+        return await future
+
+    async def remove_stream(self, stream_id: Hashable):
+        """
+        Forget about the internal state of a stream.
+
+        :param stream_id:
+            The id of the video stream.
+        """
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._engine.remove_stream, stream_id)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        batch = []
+        try:
+            while True:
+                if not pending:
+                    pending.append(await self._queue.get())
+                while len(pending) < self.max_batch_size and not self._queue.empty():
+                    pending.append(self._queue.get_nowait())
+
+                batch, pending = self._next_batch(pending)
+                clips = {stream_id: clip for stream_id, clip, _ in batch}
+                try:
+                    predictions = await loop.run_in_executor(self._executor, self._engine.infer_streams, clips)
+                except Exception as error:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+
+                for stream_id, _, future in batch:
+                    if not future.done():
+                        future.set_result(predictions[stream_id])
+        finally:
+            # Cancel the predictions of the batch in flight too, if stopped while waiting for them
+            for _, _, future in [*batch, *pending]:
+                future.cancel()
+
+    def _next_batch(self, pending: deque) -> Tuple[list, deque]:
+        """
+        Split the pending requests into the next batch and the remaining ones. A batch holds at most one
+        clip per stream, and only clips with the same number of frames. Once a request of a stream is
+        deferred, the later requests of that stream are deferred too, to keep them in order.
+        """
+        batch = []
+        remaining = deque()
+        num_frames = pending[0][1].shape[1]
+        stream_ids = set()
+        for request in pending:
+            stream_id, clip, _ = request
+            if stream_id in stream_ids or clip.shape[1] != num_frames or len(batch) == self.max_batch_size:
+                remaining.append(request)
+            else:
+                batch.append(request)
+            stream_ids.add(stream_id)
+        return batch, remaining
+
+
+def _no_grad(net):
+    if isinstance(net, RuntimeNet):
+        return contextlib.nullcontext()
+    import torch
+    return torch.no_grad()
+
+
+def _concatenate(arrays):
+    # Outputs of heads that were skipped (see `MultiHeadPipe`) are None
+    arrays = [array for array in arrays if array is not None]
+    if not arrays:
+        return None
+    if isinstance(arrays[0], np.ndarray):
+        return np.concatenate(arrays)
+    import torch
+    return torch.cat(arrays, dim=0)
+
+
+def _to_numpy(array) -> Optional[np.ndarray]:
+    if array is None or isinstance(array, np.ndarray):
+        return array
+    return array.cpu().numpy()
@@ -1,5 +1,7 @@
+import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from torch.nn.modules.utils import _triple
 from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
@@ -15,8 +17,18 @@ class SteppableConv3dAs2d(nn.Conv2d):
         self.kernel_size_temporal = kernel_size[0]
         self.stride_temporal = stride[0]
         self.dilation_temporal = dilation[0]
-        self.internal_state = None
+        # Window of frames seen by the convolution: the internal state followed by the current input,
+        # see `pad_internal_state`. It is reused from step to step as long as the input size is unchanged.
+        self._window = None
+        self._state_size = 0
         self.internal_padding = True
+        # Whether to pad the input with an out-of-place concatenation instead of the preallocated window,
+        # e.g. to export graphs whose internal states are explicit inputs and outputs, see `sense.onnx_export`
+        self.functional_state = False
+        # Number of independent clips interleaved along the time dimension (time-major)
+        self.batch_size = 1
+        # Cached gather indices of `rearrange_frames`, per (number of frames, batch size, device)
+        self._index_plans = {}
 
         in_channels *= self.kernel_size_temporal
 
@@ -31,28 +43,81 @@ class SteppableConv3dAs2d(nn.Conv2d):
         effective_kernel_size = 1 + (self.kernel_size_temporal - 1) * self.dilation_temporal
         return effective_kernel_size - self.stride_temporal
 
+    @property
+    def internal_state(self):
+        if self._window is None:
+            return None
+        return self._window[:self._state_size]
+
+    @internal_state.setter
+    def internal_state(self, state):
+        # The state is only read when the window is (re-)allocated by the next call to `pad_internal_state`
+        self._window = state
+        self._state_size = 0 if state is None else state.shape[0]
+
     def forward(self, x):
         if self.internal_padding:
             if self.internal_state is None:
                 self.initialize_internal_state(x)
-            x = self.pad_internal_state(x)
-        x = self.rearrange_frames(x)
+            if self.functional_state:
+                window = torch.cat([self.internal_state, x])
+                self.internal_state = window[window.shape[0] - self._state_size:]
+                x = self.rearrange_frames(window)
+            else:
+                x = self.rearrange_frames(self.pad_internal_state(x))
+                self.shift_internal_state()
+        else:
+            x = self.rearrange_frames(x)
         return super().forward(x)
 
     def initialize_internal_state(self, x):
-        self.internal_state = torch.cat(self.temporal_footprint * [torch.zeros_like(x[0:1])])
+        self._state_size = self.temporal_footprint * self.batch_size
+        self._window = x.new_zeros((self._state_size + x.shape[0], *x.shape[1:]))
 
     def pad_internal_state(self, x):
-        x = torch.cat([self.internal_state, x])
-        self.internal_state = x[-self.temporal_footprint:]
-        return x
+        """
+        Write the input behind the internal state in the preallocated window and return the window.
+        """
+        window_shape = (self._state_size + x.shape[0], *x.shape[1:])
+        if self._window.shape != window_shape or self._window.dtype != x.dtype or self._window.device != x.device:
+            # First step, or the size of the input has changed: allocate a new window
+            window = x.new_empty(window_shape)
+            window[:self._state_size] = self.internal_state
+            self._window = window
+        self._window[self._state_size:] = x
+        return self._window
+
+    def shift_internal_state(self):
+        """
+        Move the last frames of the window to its front, where they form the internal state of the next step.
+        """
+        state_size = self._state_size
+        if state_size > 0:
+            last_frames = self._window[-state_size:]
+            if 2 * state_size > self._window.shape[0]:
+                # Source and destination overlap
+                last_frames = last_frames.clone()
+            self._window[:state_size] = last_frames
 
     def rearrange_frames(self, x):
-        num_frames = x.shape[0]
-        x = torch.cat([x[offset: num_frames - self.kernel_size_temporal + offset + 1]
-                       for offset in range(self.kernel_size_temporal)], dim=1)
-        x = x[torch.arange(0, x.shape[0], self.stride_temporal)]
-        return x
+        # Stack the frames of each temporal window along the channel dimension with a single gather:
+        # output frame m of clip b holds input frames m * stride + offset, for all offsets in the kernel
+        num_frames = x.shape[0] // self.batch_size
+        index = self._get_index_plan(num_frames, x.device)
+        x = x.index_select(0, index)
+        return x.view(-1, self.kernel_size_temporal * x.shape[1], *x.shape[2:])
+
+    def _get_index_plan(self, num_frames, device):
+        key = (num_frames, self.batch_size, device)
+        index = self._index_plans.get(key)
+        if index is None:
+            num_outputs = (num_frames - self.kernel_size_temporal) // self.stride_temporal + 1
+            output_frames = torch.arange(num_outputs).view(-1, 1, 1) * self.stride_temporal
+            clips = torch.arange(self.batch_size).view(1, -1, 1)
+            offsets = torch.arange(self.kernel_size_temporal).view(1, 1, -1)
+            index = ((output_frames + offsets) * self.batch_size + clips).flatten().to(device)
+            self._index_plans[key] = index
+        return index
 
     def reset(self):
         self.internal_state = None
@@ -73,15 +138,18 @@ class SteppableSparseConv3dAs2d(SteppableConv3dAs2d):
 
     def rearrange_frames(self, x):
         # Note: rewrite this to support other kernel sizes (i.e. != 3) and different mixing ratios
-        quarter = int(x.shape[1] // 4)
-        half = int(x.shape[1] // 2)
-        out = torch.zeros_like(x[2:])
-        out[:, 0:quarter] = x[0:-2, 0:quarter]
-        out[:, quarter:half] = x[1:-1, quarter:half]
-        out[:, half:] = x[2:, half:]
-        indices = [-1 - offset for offset in range(0, out.shape[0], self.stride_temporal)]
-        out = out[indices[::-1]]
-        return out
+        num_frames = x.shape[0] // self.batch_size
+        x = x.reshape(num_frames, self.batch_size, *x.shape[1:])
+        quarter = int(x.shape[2] // 4)
+        half = int(x.shape[2] // 2)
+        # Outputs are aligned with the last frame, keep every `stride_temporal`-th one counting backwards
+        first = (num_frames - 3) % self.stride_temporal
+        out = torch.cat([
+            x[first:num_frames - 2:self.stride_temporal, :, 0:quarter],
+            x[first + 1:num_frames - 1:self.stride_temporal, :, quarter:half],
+            x[first + 2::self.stride_temporal, :, half:],
+        ], dim=2)
+        return out.flatten(0, 1)
 
 
 class ConvReLU(nn.Sequential):
@@ -95,6 +163,25 @@ class ConvReLU(nn.Sequential):
         )
 
 
+class FusedConvReLU(nn.Conv2d):
+    """
+    Convolution followed by an in-place ReLU6, as a single module. It replaces `ConvReLU` layers when
+    optimizing a network for inference, see `StridedInflatedMobileNetV2.optimize_for_inference`.
+    """
+
+    @classmethod
+    def from_conv(cls, conv):
+        fused = cls(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                    padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=conv.bias is not None,
+                    padding_mode=conv.padding_mode)
+        fused.weight = conv.weight
+        fused.bias = conv.bias
+        return fused
+
+    def forward(self, x):
+        return F.relu6(super().forward(x), inplace=True)
+
+
 class InvertedResidual(nn.Module):  # noqa: D101
 
     def __init__(self, in_planes, out_planes, spatial_kernel_size=3, spatial_stride=1, expand_ratio=1,
@@ -105,6 +192,8 @@ class InvertedResidual(nn.Module):  # noqa: D101
         self.use_residual = spatial_stride == 1 and in_planes == out_planes
         self.temporal_shift = temporal_shift
         self.temporal_stride = temporal_stride
+        # Number of independent clips interleaved along the time dimension (time-major)
+        self.batch_size = 1
 
         layers = []
         if expand_ratio != 1:
@@ -140,12 +229,14 @@ class InvertedResidual(nn.Module):  # noqa: D101
         return output_
 
     def realign(self, input_, output_):  # noqa: D102
-        n_out = output_.shape[0]
+        n_out = output_.shape[0] // self.batch_size
+        input_ = input_.reshape(-1, self.batch_size, *input_.shape[1:])
         if self.temporal_stride:
-            indices = [-1 - 2 * idx for idx in range(n_out)]
-            return input_[indices[::-1]]
+            # Every second frame, aligned with the last one
+            input_ = input_[input_.shape[0] - 1 - 2 * (n_out - 1)::2]
         else:
-            return input_[-n_out:]
+            input_ = input_[-n_out:]
+        return input_.flatten(0, 1)
 
 
 class StridedInflatedMobileNetV2(RealtimeNeuralNet):
@@ -189,9 +280,66 @@ class StridedInflatedMobileNetV2(RealtimeNeuralNet):
         )
 
     def forward(self, video):
+        if video.dtype == torch.uint8:
+            return self.cnn[1:](self.forward_first_layer_uint8(video))
         return self.cnn(video)
 
+    def forward_first_layer_uint8(self, video):
+        """
+        Run the first layer on raw uint8 frames. As in the float path of `preprocess`, frames are mirrored
+        horizontally, and their scaling to [0, 1] is folded into the weights of the first convolution.
+        """
+        first_layer = self.cnn[0]
+        if isinstance(first_layer, FusedConvReLU):
+            conv = first_layer
+        elif isinstance(first_layer, ConvReLU) and type(first_layer[0]) is nn.Conv2d:
+            conv = first_layer[0]
+        else:
+            return first_layer(video.flip(3).float() / 255.)
+
+        weight = conv.weight / 255.
+        video = F.conv2d(video.flip(3).to(weight.dtype), weight, conv.bias, conv.stride, conv.padding,
+                         conv.dilation, conv.groups)
+        return F.relu6(video, inplace=True)
+
+    def optimize_for_inference(self, fuse=True, channels_last=True, trace=False):
+        """
+        Optimize the network for inference, in place. Since the names of the parameters change, weights
+        must be loaded beforehand, and the network must be moved to its device beforehand if traced.
+
+        :param fuse:
+            Whether to fuse each convolution with the ReLU6 that follows it, see `FusedConvReLU`.
+        :param channels_last:
+            Whether to switch the weights, and thereby the activations, to the channels-last memory
+            format, which is significantly faster for depth-wise and point-wise convolutions on CPU.
+        :param trace:
+            Whether to replace the layers that do not keep an internal state with traced (and frozen,
+            where supported) modules. Steppable convolutions are kept as is, so that internal states can
+            still be exported and swapped in.
+        """
+        self.eval()
+        if fuse:
+            _fuse_conv_relu(self.cnn)
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+        if trace:
+            memory_format = torch.channels_last if channels_last else torch.contiguous_format
+            # The first layer is kept as is, its weights are used for uint8 inputs
+            for index, layer in enumerate(self.cnn[1:], 1):
+                if isinstance(layer, InvertedResidual):
+                    if any(isinstance(module, SteppableConv3dAs2d) for module in layer.conv[0].modules()):
+                        layer.conv = nn.Sequential(layer.conv[0], _trace(layer.conv[1:], memory_format))
+                    else:
+                        layer.conv = _trace(layer.conv, memory_format)
+                else:
+                    self.cnn[index] = _trace(layer, memory_format)
+        return self
+
     def preprocess(self, clip):
+        if clip.dtype == np.uint8:
+            # Zero-copy: normalization happens in the first layer, see `forward_first_layer_uint8`
+            return torch.from_numpy(clip[0]).permute(0, 3, 1, 2)
+
         clip = clip[:, :, :, ::-1].copy()
         clip /= 255.
         clip = clip.transpose(0, 1, 4, 2, 3)
@@ -234,3 +382,20 @@ class StridedInflatedMobileNetV2(RealtimeNeuralNet):
         num_required_frames_per_layer[0] = temporal_dependency
 
         return num_required_frames_per_layer
+
+
+def _fuse_conv_relu(module):
+    for name, child in module.named_children():
+        if isinstance(child, ConvReLU) and type(child[0]) is nn.Conv2d:
+            setattr(module, name, FusedConvReLU.from_conv(child[0]))
+        else:
+            _fuse_conv_relu(child)
+
+
+def _trace(module, memory_format):
+    first_conv = next(child for child in module.modules() if isinstance(child, nn.Conv2d))
+    example = torch.rand(2, first_conv.in_channels, 8, 8, device=first_conv.weight.device)
+    module = torch.jit.trace(module.eval(), example.to(memory_format=memory_format))
+    if hasattr(torch.jit, 'freeze'):
+        module = torch.jit.freeze(module)
+    return module
@@ -1,7 +1,7 @@
 import glob
 import itertools
 import json
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 import torch
@@ -11,7 +11,6 @@ import torch.optim as optim
 from PIL import Image
 from sense import camera
 from sense import engine
-from sklearn.metrics import confusion_matrix
 from os.path import join
 
 MODEL_TEMPORAL_DEPENDENCY = 45
@@ -41,8 +40,9 @@ class FeaturesDataset(torch.utils.data.Dataset):
     """
 
     def __init__(self, files, labels, temporal_annotation, full_network_minimum_frames,
-                 num_timesteps=None, stride=4):
+                 num_timesteps=None, stride=4, feature_store=None):
         self.files = files
+        self.feature_store = feature_store
         self.labels = labels
         self.num_timesteps = num_timesteps
         self.stride = stride
@@ -54,7 +54,11 @@ class FeaturesDataset(torch.utils.data.Dataset):
         return len(self.files)
 
     def __getitem__(self, idx):
-        features = np.load(self.files[idx])
+        if self.feature_store is not None and self.files[idx] in self.feature_store:
+            # Memory-mapped: only the sampled timesteps are read from disk
+            features = self.feature_store[self.files[idx]]
+        else:
+            features = np.load(self.files[idx])
         num_preds = features.shape[0]
 
         temporal_annotation = self.temporal_annotations[idx]
@@ -89,16 +93,133 @@ class FeaturesDataset(torch.utils.data.Dataset):
             # will assume that we need only one output
         if temporal_annotation is None:
             temporal_annotation = [-100]
+        if isinstance(features, np.memmap):
+            features = np.array(features)
         return [features, self.labels[idx], temporal_annotation]
 
 
+class FeatureStore:
+    """
+    Consolidated on-disk store for all features of a `features_*` folder.
+
+    The feature arrays of all videos are concatenated along their first axis into a single
+    memory-mapped .npy file, next to a json index holding the offset and length of each video. Slicing
+    the store only reads the bytes that are actually accessed, and avoids opening one file per sample.
+    """
+
+    DATA_FILE = 'feature_store.npy'
+    INDEX_FILE = 'feature_store.json'
+
+    def __init__(self, features_dir):
+        self.features_dir = os.path.abspath(features_dir)
+        with open(os.path.join(self.features_dir, self.INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self._data = None
+
+    @property
+    def data(self):
+        # Opened lazily so that the store can be sent to data loader workers without copying the data
+        if self._data is None:
+            self._data = np.load(os.path.join(self.features_dir, self.DATA_FILE), mmap_mode='r')
+        return self._data
+
+    def __getstate__(self):
+        return {**self.__dict__, '_data': None}
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.features_dir)
+
+    def __contains__(self, path):
+        return self._key(path) in self.index
+
+    def __getitem__(self, path):
+        entry = self.index[self._key(path)]
+        return self.data[entry['offset']:entry['offset'] + entry['length']]
+
+    @staticmethod
+    def _list_feature_files(features_dir):
+        return sorted(glob.glob(os.path.join(features_dir, '*', '*.npy')))
+
+    @classmethod
+    def is_up_to_date(cls, features_dir):
+        """
+        Check whether a store exists for the given folder and covers all of its current feature files.
+        """
+        index_path = os.path.join(features_dir, cls.INDEX_FILE)
+        if not os.path.isfile(index_path) or not os.path.isfile(os.path.join(features_dir, cls.DATA_FILE)):
+            return False
+
+        with open(index_path) as f:
+            index = json.load(f)
+        files = cls._list_feature_files(features_dir)
+        if len(files) != len(index):
+            return False
+        for path in files:
+            entry = index.get(os.path.relpath(path, features_dir))
+            if entry is None or entry['mtime'] != os.stat(path).st_mtime_ns:
+                return False
+        return True
+
+    @classmethod
+    def build(cls, features_dir):
+        """
+        Consolidate all feature files found in the label sub-folders of `features_dir` into a store.
+        """
+        files = cls._list_feature_files(features_dir)
+        if not files:
+            raise ValueError(f'No features found in {features_dir}')
+
+        arrays = [np.load(path, mmap_mode='r') for path in files]
+        feature_shape = arrays[0].shape[1:]
+        if any(array.shape[1:] != feature_shape for array in arrays):
+            raise ValueError(f'Features in {features_dir} have different shapes and cannot be consolidated')
+
+        index = {}
+        offset = 0
+        for path, array in zip(files, arrays):
+            index[os.path.relpath(path, features_dir)] = {
+                'offset': offset,
+                'length': array.shape[0],
+                'mtime': os.stat(path).st_mtime_ns,
+            }
+            offset += array.shape[0]
+
+        data_path = os.path.join(features_dir, cls.DATA_FILE)
+        data = np.lib.format.open_memmap(data_path + '.tmp', mode='w+', dtype=arrays[0].dtype,
+                                         shape=(offset, *feature_shape))
+        for entry, array in zip(index.values(), arrays):
+            data[entry['offset']:entry['offset'] + entry['length']] = array
+        data.flush()
+        del data
+        os.replace(data_path + '.tmp', data_path)
+
+        with open(os.path.join(features_dir, cls.INDEX_FILE), 'w') as f:
+            json.dump(index, f)
+
+        return cls(features_dir)
+
+    @classmethod
+    def open(cls, features_dir):
+        """
+        Open the store of the given folder, (re-)building it first if it is missing or outdated.
+        """
+        if not cls.is_up_to_date(features_dir):
+            return cls.build(features_dir)
+        return cls(features_dir)
+
+
 def generate_data_loader(dataset_dir, features_dir, tags_dir, label_names, label2int,
                          label2int_temporal_annotation, num_timesteps=5, batch_size=16, shuffle=True,
                          stride=4, path_annotations=None, temporal_annotation_only=False,
-                         full_network_minimum_frames=MODEL_TEMPORAL_DEPENDENCY):
+                         full_network_minimum_frames=MODEL_TEMPORAL_DEPENDENCY, use_feature_store=True,
+                         use_pooled_features=False):
     # Find pre-computed features and derive corresponding labels
     tags_dir = os.path.join(dataset_dir, tags_dir)
     features_dir = os.path.join(dataset_dir, features_dir)
+    if use_pooled_features:
+        # Heads that only need spatially pooled inputs are trained on the (much smaller) pooled features
+        pool_missing_features(features_dir)
+        features_dir = get_pooled_features_dir(features_dir)
     labels_string = []
     temporal_annotation = []
     if not path_annotations:
@@ -137,44 +258,193 @@ def generate_data_loader(dataset_dir, features_dir, tags_dir, label_names, label
         labels = [x for x, y in zip(labels, temporal_annotation) if y is not None]
         temporal_annotation = [x for x in temporal_annotation if x is not None]
 
+    # Consolidate features into a single memory-mapped file
+    feature_store = None
+    if use_feature_store and features:
+        feature_store = FeatureStore.open(features_dir)
+
     # Build dataloader
     dataset = FeaturesDataset(features, labels, temporal_annotation,
                               num_timesteps=num_timesteps, stride=stride,
-                              full_network_minimum_frames=full_network_minimum_frames)
+                              full_network_minimum_frames=full_network_minimum_frames,
+                              feature_store=feature_store)
     data_loader = torch.utils.data.DataLoader(dataset, shuffle=shuffle, batch_size=batch_size)
 
     return data_loader
 
 
+def get_pooled_features_dir(features_dir):
+    """
+    Return the folder holding the spatially pooled copies of the features found in `features_dir`.
+    """
+    return os.path.normpath(features_dir) + '_pooled'
+
+
+def get_pooled_features_path(path_features):
+    """
+    Return the path of the spatially pooled copy of a feature file located in a label sub-folder
+    of a features folder.
+    """
+    label_dir, filename = os.path.split(path_features)
+    features_dir, label = os.path.split(label_dir)
+    return os.path.join(get_pooled_features_dir(features_dir), label, filename)
+
+
+def pool_features(features):
+    """
+    Average features of shape (time, channels, height, width) over their spatial dimensions.
+    """
+    features = np.asarray(features)
+    if features.ndim == 4:
+        return features.mean(axis=(2, 3))
+    return features
+
+
+def pool_missing_features(features_dir):
+    """
+    Create the pooled copy of all features in the label sub-folders of `features_dir` that do not
+    have one yet.
+    """
+    for path_features in glob.glob(os.path.join(features_dir, '*', '*.npy')):
+        path_pooled = get_pooled_features_path(path_features)
+        if not os.path.isfile(path_pooled):
+            load_pooled_features(path_features)
+
+
+def load_pooled_features(path_features):
+    """
+    Load the spatially pooled features of shape (time, channels) corresponding to a feature file.
+    If the pooled copy does not exist yet, it is computed from the full features and cached.
+    """
+    path_pooled = get_pooled_features_path(path_features)
+    if os.path.isfile(path_pooled):
+        return np.load(path_pooled)
+
+    pooled = pool_features(np.load(path_features, mmap_mode='r'))
+    os.makedirs(os.path.dirname(path_pooled), exist_ok=True)
+    writer = NpyWriter(path_pooled)
+    writer.append(pooled)
+    writer.close()
+    return pooled
+
+
+def uniform_frame_indices(num_frames, sample_rate):
+    """
+    Return the indices of the frames that are kept when uniformly sampling a video of `num_frames`
+    frames according to the provided sample_rate.
+    """
+    if num_frames <= 0:
+        return np.arange(0)
+    if sample_rate < 1.:
+        indices = np.arange(0, num_frames, 1. / sample_rate)
+        offset = int((num_frames - indices[-1]) / 2)
+        return (indices + offset).astype(np.int32)
+    return np.arange(num_frames)
+
+
 def uniform_frame_sample(video, sample_rate):
     """
     Uniformly sample video frames according to the provided sample_rate.
     """
-
-    depth = video.shape[0]
     if sample_rate < 1.:
-        indices = np.arange(0, depth, 1. / sample_rate)
-        offset = int((depth - indices[-1]) / 2)
-        sampled_frames = (indices + offset).astype(np.int32)
-        return video[sampled_frames]
+        return video[uniform_frame_indices(video.shape[0], sample_rate)]
     return video
 
 
-def compute_features(video_path, path_out, inference_engine, num_timesteps=1, path_frames=None,
-                     batch_size=None):
-    video_source = camera.VideoSource(camera_id=None,
-                                      size=inference_engine.expected_frame_size,
-                                      filename=video_path)
-    video_fps = video_source.get_fps()
-    frames = []
+def read_sampled_frames(video_source, fps):
+    """
+    Decode a video source frame by frame and yield the rescaled frames that are kept when uniformly
+    sampling the video to the given frame rate (see `uniform_frame_sample`).
+    """
+    sample_rate = fps / video_source.get_fps()
+    indices = None
+    if sample_rate < 1.:
+        # Sampled frames are centered on the video, which requires its exact length: the frame count
+        # reported by containers can be missing or wrong, so frames are counted beforehand. Videos of
+        # unknown length (e.g. endless sources) are sampled from their first frame on instead.
+        num_frames = video_source.count_frames()
+        if num_frames > 0:
+            indices = set(uniform_frame_indices(num_frames, sample_rate))
+
+    index = 0
+    next_index = 0.
     while True:
         images = video_source.get_image()
         if images is None:
             break
+        if indices is not None:
+            keep = index in indices
         else:
-            image, image_rescaled = images
-            frames.append(image_rescaled)
-    frames = uniform_frame_sample(np.array(frames), inference_engine.fps / video_fps)
+            keep = index >= next_index
+        if keep:
+            yield images[1]
+            next_index += 1. / min(sample_rate, 1.)
+        index += 1
+
+
+class NpyWriter:
+    """
+    Write a .npy file incrementally along its first axis, so that the full array never needs to be
+    held in memory. The data is written to a temporary file which only replaces `path` once closed.
+    """
+
+    HEADER_SIZE = 128
+
+    def __init__(self, path):
+        self.path = path
+        self.shape = None
+        self.dtype = None
+        self._tmp_path = path + '.tmp'
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(b' ' * self.HEADER_SIZE)
+
+    def append(self, array):
+        array = np.asarray(array)
+        if self.shape is None:
+            self.shape = (0, *array.shape[1:])
+            self.dtype = array.dtype
+        elif array.shape[1:] != self.shape[1:]:
+            raise ValueError(f'Cannot append array of shape {array.shape} to array of shape {self.shape}')
+
+        self._file.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+        self.shape = (self.shape[0] + array.shape[0], *self.shape[1:])
+
+    def close(self):
+        header = {
+            'descr': np.lib.format.dtype_to_descr(self.dtype or np.dtype(np.float32)),
+            'fortran_order': False,
+            'shape': self.shape or (0,),
+        }
+        # Pad the header to the space that was reserved before writing the data
+        header = repr(header).encode('latin1')
+        header = header.ljust(self.HEADER_SIZE - len(np.lib.format.magic(1, 0)) - 3) + b'\n'
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0) + len(header).to_bytes(2, 'little') + header)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+
+def compute_features(video_path, path_out, inference_engine, num_timesteps=1, path_frames=None,
+                     batch_size=None, path_pooled=None):
+    """
+    Compute the features of a video and save them to `path_out`.
+
+    Frames are decoded and fed to the network chunk by chunk (the internal states of the steppable
+    layers carry the temporal context over) and features are written to disk as they are computed,
+    so that the peak memory does not depend on the length of the video. If `path_pooled` is provided,
+    the spatially pooled features are saved there as well.
+    """
+    video_source = camera.VideoSource(camera_id=None,
+                                      size=inference_engine.expected_frame_size,
+                                      filename=video_path)
+    frames = read_sampled_frames(video_source, inference_engine.fps)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        raise ValueError(f'Could not read any frame from {video_path}')
+
+    # Number of frames that are processed with a single forward pass
+    batch_size = batch_size or MODEL_TEMPORAL_STRIDE * 16
+    min_frames = inference_engine.net.num_required_frames_per_layer_padding[0]
 
     # Compute how many frames are padded to the left in order to "warm up" the model -- removing previous predictions
     # from the internal states --  with the first image, and to ensure we have enough frames in the video.
@@ -183,42 +453,56 @@ def compute_features(video_path, path_out, inference_engine, num_timesteps=1, pa
 
     # Possible improvement : investigate if a symmetric or reflect padding could be better for
     # temporal annotation prediction instead of the static first frame
-    frames = np.pad(frames, ((frames_to_add, 0), (0, 0), (0, 0), (0, 0)),
-                    mode='edge')
-
-    # Inference
-    clip = frames[None].astype(np.float32)
+    clip = np.repeat(first_frame[None, None], frames_to_add + 1, axis=1)
 
     # Run the model on padded frames in order to remove the state in the current model comming
-    # from the previous video.
-    pre_features = inference_engine.infer(clip[:, 0:frames_to_add + 1], batch_size=batch_size)
+    # from the previous video. (uint8 frames are normalized inside the network)
+    pre_features = inference_engine.infer(clip, batch_size=batch_size)
 
     # Depending on the number of layers we finetune, we keep the number of features from padding
     # equal to the temporal dependancy of the model.
-    temporal_dependancy_features = np.array(pre_features)[-num_timesteps:]
-
-    # predictions of the actual video frames
-    predictions = inference_engine.infer(clip[:, frames_to_add + 1:], batch_size=batch_size)
-    predictions = np.concatenate([temporal_dependancy_features, predictions], axis=0)
-    features = np.array(predictions)
     os.makedirs(os.path.dirname(path_out), exist_ok=True)
-    np.save(path_out, features)
+    writers = [(NpyWriter(path_out), np.asarray)]
+    if path_pooled is not None:
+        os.makedirs(os.path.dirname(path_pooled), exist_ok=True)
+        writers.append((NpyWriter(path_pooled), pool_features))
+
+    def write_features(features):
+        for writer, transform in writers:
+            writer.append(transform(features))
+
+    write_features(np.array(pre_features)[-num_timesteps:])
 
     if path_frames is not None:
         os.makedirs(os.path.dirname(path_frames), exist_ok=True)
-        frames_to_save = []
-        # remove the padded frames. extract frames starting at the first one (feature for the
-        # first frame)
-        for e, frame in enumerate(frames[frames_to_add:]):
-            if e % MODEL_TEMPORAL_STRIDE == 0:
-                frames_to_save.append(frame)
-
-        for e, frame in enumerate(frames_to_save):
+
+    def save_frame(index, frame):
+        # Keep one frame per feature, starting with the first frame of the video
+        if path_frames is not None and index % MODEL_TEMPORAL_STRIDE == 0:
             Image.fromarray(frame[:, :, ::-1]).resize((400, 300)).save(
-                os.path.join(path_frames, str(e) + '.jpg'), quality=50)
+                os.path.join(path_frames, str(index // MODEL_TEMPORAL_STRIDE) + '.jpg'), quality=50)
 
+    save_frame(0, first_frame)
 
-def compute_frames_features(inference_engine, split, label, dataset_path):
+    # predictions of the actual video frames
+    chunk = np.empty((1, batch_size, *first_frame.shape), dtype=first_frame.dtype)
+    num_frames = 0
+    for index, frame in enumerate(frames, start=1):
+        save_frame(index, frame)
+        chunk[0, num_frames] = frame
+        num_frames += 1
+        if num_frames == batch_size:
+            write_features(inference_engine.infer(chunk))
+            num_frames = 0
+
+    if num_frames >= min_frames:
+        write_features(inference_engine.infer(chunk[:, :num_frames]))
+
+    for writer, _ in writers:
+        writer.close()
+
+
+def compute_frames_features(inference_engine, split, label, dataset_path, num_workers=1):
     # Get data-set from path, given split and label
     folder = join(dataset_path, f'videos_{split}', label)
 
@@ -230,17 +514,23 @@ def compute_frames_features(inference_engine, split, label, dataset_path):
 
     # Loop through all videos for the given class-label
     videos = glob.glob(folder + '/*.mp4')
-    for e, video_path in enumerate(videos):
-        print(f"\r  Class: \"{label}\"  -->  Processing video {e + 1} / {len(videos)}", end="")
+    jobs = []
+    for video_path in videos:
         path_frames = join(frames_folder, os.path.basename(video_path).replace(".mp4", ""))
         path_features = join(features_folder, os.path.basename(video_path).replace(".mp4", ".npy"))
+        path_pooled = get_pooled_features_path(path_features)
         if not os.path.isfile(path_features):
             os.makedirs(path_frames, exist_ok=True)
-            compute_features(video_path, path_features, inference_engine,
-                             num_timesteps=1, path_frames=path_frames, batch_size=64)
+            jobs.append({'video_path': video_path, 'path_out': path_features, 'num_timesteps': 1,
+                         'path_frames': path_frames, 'batch_size': 64, 'path_pooled': path_pooled})
+        elif not os.path.isfile(path_pooled):
+            load_pooled_features(path_features)
 
+    compute_features_parallel(jobs, inference_engine, num_workers=num_workers,
+                              description=f"  Class: \"{label}\"  -->  Processing video")
 
-def extract_features(path_in, net, num_layers_finetune, use_gpu, num_timesteps=1):
+
+def extract_features(path_in, net, num_layers_finetune, use_gpu, num_timesteps=1, num_workers=1):
     # Create inference engine
     inference_engine = engine.InferenceEngine(net, use_gpu=use_gpu)
 
@@ -252,21 +542,63 @@ def extract_features(path_in, net, num_layers_finetune, use_gpu, num_timesteps=1
 
         print(f"\nFound {len(video_files)} videos to process in the {dataset}set")
 
-        for video_index, video_path in enumerate(video_files):
-            print(f"\rExtract features from video {video_index + 1} / {len(video_files)}",
-                  end="")
-            path_out = video_path.replace(videos_dir, features_dir).replace(".mp4", ".npy")
+        jobs = []
+        for video_path in video_files:
+            path_out = os.path.splitext(video_path.replace(videos_dir, features_dir))[0] + ".npy"
+            # Only the classification head is trained when no layer is finetuned: also keep pooled features
+            path_pooled = get_pooled_features_path(path_out) if num_layers_finetune == 0 else None
+            if not os.path.isfile(path_out):
+                jobs.append({'video_path': video_path, 'path_out': path_out, 'num_timesteps': num_timesteps,
+                             'path_frames': None, 'batch_size': 16, 'path_pooled': path_pooled})
+            elif path_pooled is not None and not os.path.isfile(path_pooled):
+                load_pooled_features(path_out)
 
-            if os.path.isfile(path_out):
-                print("\n\tSkipped - feature was already precomputed.")
-            else:
-                # Read all frames
-                compute_features(video_path, path_out, inference_engine,
-                                 num_timesteps=num_timesteps, path_frames=None, batch_size=16)
+        num_skipped = len(video_files) - len(jobs)
+        if num_skipped:
+            print(f"\tSkipped {num_skipped} videos - features were already precomputed.")
+
+        compute_features_parallel(jobs, inference_engine, num_workers=num_workers,
+                                  description="Extract features from video")
 
         print('\n')
 
 
+def compute_features_parallel(jobs, inference_engine, num_workers=1, description="Processing video"):
+    """
+    Run `compute_features` for a list of jobs, each given as a dictionary of keyword arguments.
+
+    With `num_workers > 1`, videos are processed by a pool of independent worker processes, each
+    holding its own copy of the network and an equal share of the CPU threads. Progress is printed as
+    videos complete.
+    """
+    if num_workers <= 1:
+        for index, job in enumerate(jobs):
+            print(f"\r{description} {index + 1} / {len(jobs)}", end="")
+            compute_features(inference_engine=inference_engine, **job)
+        return
+
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(num_workers, initializer=_init_features_worker,
+                      initargs=(inference_engine.net, inference_engine.use_gpu, num_threads)) as pool:
+        for index, _ in enumerate(pool.imap_unordered(_compute_features_job, jobs)):
+            print(f"\r{description} {index + 1} / {len(jobs)}", end="")
+
+
+_worker_inference_engine = None
+
+
+def _init_features_worker(net, use_gpu, num_threads):
+    global _worker_inference_engine
+    torch.set_num_threads(num_threads)
+    _worker_inference_engine = engine.InferenceEngine(net, use_gpu=use_gpu)
+
+
+def _compute_features_job(job):
+    compute_features(inference_engine=_worker_inference_engine, **job)
+    return job['path_out']
+
+
 def training_loops(net, train_loader, valid_loader, use_gpu, num_epochs, lr_schedule, label_names, path_out,
                    temporal_annotation_training=False):
     criterion = nn.CrossEntropyLoss()
@@ -326,10 +658,10 @@ def run_epoch(data_loader, net, criterion, optimizer=None, use_gpu=False,
 
         # forward + backward + optimize
         if net.training:
-            # Run on each batch element independently
-            outputs = [net(input_i) for input_i in inputs]
-            # Concatenate outputs to get a tensor of size batch_size x num_classes
-            outputs = torch.cat(outputs, dim=0)
+            # Run all batch elements with a single forward pass, then merge the batch and time
+            # dimensions to get a tensor of size (batch_size * num_outputs) x num_classes
+            outputs = net(inputs)
+            outputs = outputs.flatten(0, 1)
 
             if temporal_annotation_training:
                 # take only targets one batch
@@ -371,6 +703,8 @@ def run_epoch(data_loader, net, criterion, optimizer=None, use_gpu=False,
     top1 = np.mean(epoch_labels == epoch_top_predictions)
     loss = running_loss / len(data_loader)
 
+    # Imported here to keep sklearn out of the inference code paths
+    from sklearn.metrics import confusion_matrix
     cnf_matrix = confusion_matrix(epoch_labels, epoch_top_predictions)
 
     return loss, top1, cnf_matrix
@@ -382,15 +716,16 @@ def save_confusion_matrix(
         classes,
         normalize=False,
         title='Confusion matrix',
-        cmap=plt.cm.Blues):
+        cmap=None):
     """
     This function creates a matplotlib figure out of the provided confusion matrix and saves it
     to a file. The provided numpy array is also saved. Normalization can be applied by setting
-    `normalize=True`.
+    `normalize=True`. The color map defaults to `plt.cm.Blues`.
     """
+    import matplotlib.pyplot as plt
 
     plt.figure()
-    plt.imshow(confusion_matrix_array, interpolation='nearest', cmap=cmap)
+    plt.imshow(confusion_matrix_array, interpolation='nearest', cmap=cmap or plt.cm.Blues)
     plt.colorbar()
     tick_marks = np.arange(len(classes))
     plt.xticks(tick_marks, classes, rotation=90)
@@ -0,0 +1,259 @@
+import bisect
+import itertools
+import json
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from threading import Lock
+from threading import Thread
+from typing import Optional
+from typing import Sequence
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """
+    Thread-safe histogram that counts observed values in fixed buckets. Each bucket is given by its
+    (inclusive) upper bound, and values above the last bound fall into an additional overflow bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        :param buckets:
+            Increasing upper bounds of the buckets.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget about all observed values."""
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.
+            self.min = None
+            self.max = None
+
+    def observe(self, value: float):
+        """Record a new value."""
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Estimate a percentile (between 0 and 100) of the observed values. The upper bound of the bucket
+        holding the percentile is returned, capped by the largest observed value.
+        """
+        with self._lock:
+            if not self.count:
+                return 0.
+            rank = percentile / 100. * self.count
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets, self.counts):
+                cumulative_count += count
+                if cumulative_count >= rank:
+                    return min(upper_bound, self.max)
+            return self.max
+
+    def snapshot(self) -> dict:
+        """Return a summary of the observed values."""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+        }
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down, such as the depth of a queue."""
+
+    def __init__(self):
+        self.value = 0.
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Timer:
+    """
+    Context manager that measures the wall time of a block of code (in seconds) into a histogram
+    of its registry, and adds it to the registry's trace if tracing is enabled.
+    """
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Optional[dict] = None):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.histogram = registry.histogram(name, labels=labels)
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start_time
+        self.histogram.observe(duration)
+        self.registry.trace(self.name, duration, self.labels)
+
+
+class MetricsRegistry:
+    """
+    Collection of named metrics, optionally distinguished by labels.
+
+    Metrics are created on first use. They can be exported in the Prometheus text format (see
+    `to_prometheus` and `serve`) and all timings can be recorded as a JSONL trace (see `start_trace`).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._types = {}
+        self._lock = Lock()
+        self._trace_file = None
+        self._trace_lock = Lock()
+
+    def _get(self, metric_type: str, name: str, labels: Optional[dict], create):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                if self._types.setdefault(name, metric_type) == metric_type:
+                    metric = self._metrics.setdefault(key, create())
+        if self._types[name] != metric_type:
+            raise ValueError(f'Metric {name} is already registered as a {self._types[name]}')
+        return metric
+
+    def counter(self, name: str, labels: Optional[dict] = None) -> Counter:
+        return self._get('counter', name, labels, Counter)
+
+    def gauge(self, name: str, labels: Optional[dict] = None) -> Gauge:
+        return self._get('gauge', name, labels, Gauge)
+
+    def histogram(self, name: str, labels: Optional[dict] = None,
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get('histogram', name, labels, lambda: Histogram(buckets))
+
+    def timer(self, name: str, labels: Optional[dict] = None) -> Timer:
+        """Return a context manager that times a block of code into the histogram of the given name."""
+        return Timer(self, name, labels)
+
+    def reset(self):
+        """Remove all metrics."""
+        with self._lock:
+            self._metrics.clear()
+            self._types.clear()
+
+    def snapshot(self) -> dict:
+        """Return the current values of all metrics, histograms being summarized (see `Histogram.snapshot`)."""
+        snapshot = {}
+        for (name, labels), metric in list(self._metrics.items()):
+            key = name + _format_labels(labels)
+            snapshot[key] = metric.snapshot() if isinstance(metric, Histogram) else metric.value
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Export all metrics in the Prometheus text exposition format."""
+        lines = []
+        metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+        for name, group in itertools.groupby(metrics, key=lambda item: item[0][0]):
+            lines.append(f'# TYPE {name} {self._types[name]}')
+            for (_, labels), metric in group:
+                if isinstance(metric, Histogram):
+                    cumulative_count = 0
+                    for upper_bound, count in zip(metric.buckets + (float('inf'),), metric.counts):
+                        cumulative_count += count
+                        bucket_labels = labels + (('le', '+Inf' if upper_bound == float('inf') else upper_bound),)
+                        lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative_count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {metric.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {metric.count}')
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+
+    def start_trace(self, path: str):
+        """Start appending every timing to a JSONL file, one event per line."""
+        self.stop_trace()
+        self._trace_file = open(path, 'a')
+
+    def stop_trace(self):
+        """Stop tracing and close the trace file."""
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+    def trace(self, name: str, duration: float, labels: Optional[dict] = None):
+        """Add an event to the trace, if tracing is enabled."""
+        if self._trace_file is None:
+            return
+        event = {'time': time.time(), 'name': name, 'duration': duration}
+        if labels:
+            event['labels'] = labels
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps(event) + '\n')
+
+    def serve(self, port: int, host: str = '') -> ThreadingHTTPServer:
+        """
+        Serve the metrics in the Prometheus text format under `/metrics` from a background thread.
+        Call `shutdown()` on the returned server to stop serving.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):  # noqa: N802
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+# Registry used by the realtime pipeline
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,98 @@
+import inspect
+import json
+import torch
+import torch.nn as nn
+
+from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
+from sense.onnx_runtime import FRAMES_INPUT
+from sense.onnx_runtime import METADATA_KEY
+from sense.onnx_runtime import OUTPUT
+from sense.onnx_runtime import STATE_INPUT
+from sense.onnx_runtime import STATE_OUTPUT
+
+
+class _ExplicitStateWrapper(nn.Module):
+    """
+    Run a network on raw frames of shape (time, height, width, 3), with the internal states of its
+    steppable layers given as inputs and returned as additional outputs.
+    """
+
+    def __init__(self, net: RealtimeNeuralNet):
+        super().__init__()
+        self.net = net
+        self.layers = net._steppable_layers()
+        # Feature converters given as a list are not registered as sub-modules of `Pipe`, which is needed
+        # for their weights to be traced as parameters
+        feature_converter = getattr(net, 'feature_converter', None)
+        if isinstance(feature_converter, list):
+            self.feature_converters = nn.ModuleList(feature_converter)
+
+    def forward(self, frames, *states):
+        for layer, state in zip(self.layers, states):
+            layer.internal_state = state
+        output = self.net(frames.permute(0, 3, 1, 2))
+        outputs = output if isinstance(output, list) else [output]
+        return (*outputs, *[layer.internal_state for layer in self.layers])
+
+
+def export_onnx(net: RealtimeNeuralNet, path: str, opset_version: int = 11):
+    """
+    Export a network (e.g. a `Pipe` of a feature extractor and a feature converter) to an ONNX file.
+
+    The graph processes one step of uint8 frames of shape (step_size, height, width, 3), as returned by the
+    camera. The internal states of the steppable layers are explicit inputs (`state_in_<index>`) and
+    outputs (`state_out_<index>`) that have to be fed back at the next step, see `OnnxRuntimeNet`. The
+    predictions are the first outputs (`output_<index>`), one per output of the network. The frame size,
+    frame rate and step size of the network are stored in the model metadata.
+
+    :param net:
+        The network to export. It is switched to evaluation mode, but its internal states are left untouched.
+    :param path:
+        Path of the ONNX file.
+    :param opset_version:
+        ONNX operator set to target.
+    """
+    import onnx
+
+    # Switching to evaluation mode resets the internal states
+    internal_state = net.get_internal_state()
+    net.eval()
+    steppable_layers = net._steppable_layers()
+    height, width = net.expected_frame_size
+    frames = torch.zeros(net.step_size, height, width, 3, dtype=torch.uint8)
+
+    for layer in steppable_layers:
+        layer.functional_state = True
+    try:
+        # Run a first step to get the shapes of the internal states
+        net.set_internal_state(None)
+        with torch.no_grad():
+            output = net(frames.permute(0, 3, 1, 2))
+        states = [torch.zeros_like(layer.internal_state) for layer in steppable_layers]
+        num_outputs = len(output) if isinstance(output, list) else 1
+
+        output_names = [OUTPUT.format(index) for index in range(num_outputs)]
+        input_names = [FRAMES_INPUT] + [STATE_INPUT.format(index) for index in range(len(states))]
+        output_names += [STATE_OUTPUT.format(index) for index in range(len(states))]
+        kwargs = {}
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            # The internal states are traced through module attributes, which requires the tracing exporter
+            kwargs['dynamo'] = False
+        with torch.no_grad():
+            torch.onnx.export(_ExplicitStateWrapper(net).eval(), (frames, *states), path, input_names=input_names,
+                              output_names=output_names, opset_version=opset_version, **kwargs)
+    finally:
+        for layer in steppable_layers:
+            layer.functional_state = False
+        net.set_internal_state(internal_state)
+
+    model = onnx.load(path)
+    metadata = {
+        'expected_frame_size': [height, width],
+        'fps': net.fps,
+        'step_size': net.step_size,
+        'num_outputs': num_outputs,
+        'output_is_list': isinstance(output, list),
+    }
+    onnx.helper.set_model_props(model, {METADATA_KEY: json.dumps(metadata)})
+    onnx.save(model, path)
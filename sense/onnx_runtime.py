@@ -0,0 +1,69 @@
+import json
+import numpy as np
+
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+from sense.runtime import RuntimeNet
+
+# Names used in graphs exported with `sense.onnx_export.export_onnx`
+METADATA_KEY = 'sense'
+FRAMES_INPUT = 'frames'
+STATE_INPUT = 'state_in_{}'
+STATE_OUTPUT = 'state_out_{}'
+OUTPUT = 'output_{}'
+
+
+class OnnxRuntimeNet(RuntimeNet):
+    """
+    Run a network exported with `sense.onnx_export.export_onnx` with ONNX Runtime, carrying the internal
+    states over from step to step. It can be used instead of the PyTorch network by an `InferenceEngine`
+    serving a single video stream, and does not depend on PyTorch.
+    """
+
+    def __init__(self, path: str, num_threads: Optional[int] = None,
+                 providers: Sequence[str] = ('CPUExecutionProvider',)):
+        """
+        :param path:
+            Path to the ONNX file.
+        :param num_threads:
+            Number of threads used by ONNX Runtime. Defaults to the number of physical cores.
+        :param providers:
+            Execution providers of ONNX Runtime, by order of preference.
+        """
+        import onnxruntime
+
+        super().__init__()
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=list(providers))
+
+        metadata = json.loads(self.session.get_modelmeta().custom_metadata_map[METADATA_KEY])
+        self.expected_frame_size = tuple(metadata['expected_frame_size'])
+        self.fps = metadata['fps']
+        self.step_size = metadata['step_size']
+        self._output_is_list = metadata['output_is_list']
+        self._output_names = [OUTPUT.format(index) for index in range(metadata['num_outputs'])]
+
+        state_inputs = [node for node in self.session.get_inputs() if node.name != FRAMES_INPUT]
+        self._state_shapes = [tuple(node.shape) for node in state_inputs]
+        self._state_names = [STATE_OUTPUT.format(index) for index in range(len(state_inputs))]
+
+    def preprocess(self, clip: np.ndarray) -> np.ndarray:
+        """Return the frames of a clip of shape (1, time, height, width, 3) as uint8 BGR frames."""
+        return np.asarray(clip[0], dtype=np.uint8)
+
+    def _initial_states(self):
+        return [np.zeros(shape, dtype=np.float32) for shape in self._state_shapes]
+
+    def _run_step(self, frames, states):
+        feed = {FRAMES_INPUT: frames}
+        feed.update((STATE_INPUT.format(index), state) for index, state in enumerate(states))
+        results = self.session.run(self._output_names + self._state_names, feed)
+        return results[:len(self._output_names)], results[len(self._output_names):]
+
+    def _postprocess(self, outputs: List[np.ndarray]) -> Union[np.ndarray, List[np.ndarray]]:
+        return outputs if self._output_is_list else outputs[0]
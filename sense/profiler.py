@@ -0,0 +1,211 @@
+import csv
+import time
+import torch
+import torch.nn as nn
+
+from typing import List
+
+from sense.downstream_tasks.nn_utils import RealtimeNeuralNet
+from sense.feature_extractors.mobilenet import SteppableConv3dAs2d
+
+REPORT_COLUMNS = ['index', 'layer', 'calls', 'time_ms', 'time_percent', 'rearrange_ms', 'state_ms', 'mflops',
+                  'activation_kb', 'state_kb']
+
+
+class LayerProfiler:
+    """
+    Profile the layers of a backbone (the modules of its `cnn` attribute) over a run.
+
+    For each layer, the profiler records the wall time, the number of floating point operations of its
+    convolutions and linear layers, the size of its output activations and the size of its internal
+    state. For layers with steppable convolutions, the time spent in `rearrange_frames` and in
+    updating the internal state (`pad_internal_state` and `shift_internal_state`) is reported
+    separately, as it is included in the layer time.
+
+    Usage:
+        with LayerProfiler(net) as profiler:
+            inference_engine.infer(clip)
+        print(profiler.format_report(sort_by='time_ms'))
+    """
+
+    def __init__(self, net: RealtimeNeuralNet):
+        """
+        :param net:
+            A backbone with a `cnn` attribute, such as `StridedInflatedMobileNetV2`.
+        """
+        self.net = net
+        self.layers = list(net.cnn)
+        self._handles = []
+        self._wrapped = []
+        self._start_times = {}
+        self.reset()
+
+    def reset(self):
+        """Forget about all recorded statistics."""
+        self.stats = [{'calls': 0, 'time': 0., 'rearrange_time': 0., 'state_time': 0., 'flops': 0,
+                       'activation_bytes': 0} for _ in self.layers]
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def attach(self):
+        """Start recording statistics."""
+        for index, layer in enumerate(self.layers):
+            self._handles.append(layer.register_forward_pre_hook(self._make_pre_hook(index)))
+            self._handles.append(layer.register_forward_hook(self._make_hook(index)))
+
+            for module in layer.modules():
+                if isinstance(module, (nn.Conv2d, nn.Linear)):
+                    self._handles.append(module.register_forward_hook(self._make_flops_hook(index)))
+                if isinstance(module, SteppableConv3dAs2d):
+                    self._wrap(module, 'rearrange_frames', index, 'rearrange_time')
+                    self._wrap(module, 'pad_internal_state', index, 'state_time')
+                    self._wrap(module, 'shift_internal_state', index, 'state_time')
+
+        # The first layer is bypassed for uint8 inputs, see `StridedInflatedMobileNetV2.forward_first_layer_uint8`
+        if hasattr(self.net, 'forward_first_layer_uint8'):
+            self._wrap_first_layer_uint8()
+
+    def detach(self):
+        """Stop recording statistics."""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        for obj, name in self._wrapped:
+            delattr(obj, name)
+        self._wrapped = []
+
+    def _synchronize(self):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _make_pre_hook(self, index):
+        def pre_hook(module, inputs):
+            self._synchronize()
+            self._start_times[index] = time.perf_counter()
+        return pre_hook
+
+    def _make_hook(self, index):
+        def hook(module, inputs, output):
+            self._synchronize()
+            stats = self.stats[index]
+            stats['time'] += time.perf_counter() - self._start_times.pop(index)
+            stats['calls'] += 1
+            stats['activation_bytes'] = max(stats['activation_bytes'], output.numel() * output.element_size())
+        return hook
+
+    def _make_flops_hook(self, index):
+        def hook(module, inputs, output):
+            self.stats[index]['flops'] += _count_flops(module, output)
+        return hook
+
+    def _wrap(self, obj, name, index, key):
+        method = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            self._synchronize()
+            start_time = time.perf_counter()
+            result = method(*args, **kwargs)
+            self._synchronize()
+            self.stats[index][key] += time.perf_counter() - start_time
+            return result
+
+        setattr(obj, name, timed)
+        self._wrapped.append((obj, name))
+
+    def _wrap_first_layer_uint8(self):
+        method = self.net.forward_first_layer_uint8
+        pre_hook = self._make_pre_hook(0)
+        hook = self._make_hook(0)
+        conv = next((module for module in self.layers[0].modules() if isinstance(module, nn.Conv2d)), None)
+
+        def timed(video):
+            pre_hook(None, (video,))
+            output = method(video)
+            hook(None, (video,), output)
+            if conv is not None:
+                self.stats[0]['flops'] += _count_flops(conv, output)
+            return output
+
+        self.net.forward_first_layer_uint8 = timed
+        self._wrapped.append((self.net, 'forward_first_layer_uint8'))
+
+    def report(self, sort_by: str = 'index', descending: bool = None) -> List[dict]:
+        """
+        Return one row of statistics per layer, see `REPORT_COLUMNS`. Times and FLOPs are averaged over
+        the calls of each layer.
+
+        :param sort_by:
+            Name of the column used to sort the rows.
+        :param descending:
+            Sort order. By default, rows are sorted by increasing index and by decreasing value of any
+            other column.
+        """
+        if sort_by not in REPORT_COLUMNS:
+            raise ValueError(f'Cannot sort by {sort_by}, must be one of {REPORT_COLUMNS}')
+
+        total_time = sum(stats['time'] for stats in self.stats) or 1.
+        rows = []
+        for index, (layer, stats) in enumerate(zip(self.layers, self.stats)):
+            calls = max(stats['calls'], 1)
+            rows.append({
+                'index': index,
+                'layer': type(layer).__name__,
+                'calls': stats['calls'],
+                'time_ms': 1000 * stats['time'] / calls,
+                'time_percent': 100 * stats['time'] / total_time,
+                'rearrange_ms': 1000 * stats['rearrange_time'] / calls,
+                'state_ms': 1000 * stats['state_time'] / calls,
+                'mflops': stats['flops'] / calls / 1e6,
+                'activation_kb': stats['activation_bytes'] / 1024,
+                'state_kb': _internal_state_bytes(layer) / 1024,
+            })
+
+        if descending is None:
+            descending = sort_by != 'index'
+        return sorted(rows, key=lambda row: row[sort_by], reverse=descending)
+
+    def format_report(self, sort_by: str = 'index', descending: bool = None) -> str:
+        """Return the report as a text table, see `report`."""
+        rows = self.report(sort_by, descending)
+        widths = {column: max(len(column), *(len(_format_value(row[column])) for row in rows))
+                  for column in REPORT_COLUMNS}
+        lines = ['  '.join(column.rjust(widths[column]) for column in REPORT_COLUMNS)]
+        lines.extend('  '.join(_format_value(row[column]).rjust(widths[column]) for column in REPORT_COLUMNS)
+                     for row in rows)
+        return '\n'.join(lines)
+
+    def save_csv(self, path: str, sort_by: str = 'index', descending: bool = None):
+        """Save the report to a csv file, see `report`."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.report(sort_by, descending))
+
+
+def _count_flops(module, output) -> int:
+    """Count the floating point operations (a multiply-add being two) of a convolution or linear layer."""
+    if isinstance(module, nn.Conv2d):
+        kernel_ops = module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+    else:
+        kernel_ops = module.in_features
+    return 2 * output.numel() * kernel_ops
+
+
+def _internal_state_bytes(layer) -> int:
+    num_bytes = 0
+    for module in layer.modules():
+        state = getattr(module, 'internal_state', None)
+        if isinstance(state, torch.Tensor):
+            num_bytes += state.numel() * state.element_size()
+    return num_bytes
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f'{value:.3f}'
+    return str(value)
@@ -0,0 +1,181 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.intrinsic as nni
+import torch.quantization as tq
+
+from typing import Iterable
+from typing import Optional
+
+from sense.feature_extractors.mobilenet import ConvReLU
+from sense.feature_extractors.mobilenet import InvertedResidual
+from sense.feature_extractors.mobilenet import StridedInflatedMobileNetV2
+from sense.feature_extractors.mobilenet import SteppableConv3dAs2d
+
+# Number of steps run with a single forward pass during calibration
+CALIBRATION_STEPS_PER_CHUNK = 16
+
+
+class ReLU6Observer(tq.MinMaxObserver):
+    """
+    Observer of a fused convolution and ReLU that replaces a convolution followed by a ReLU6: the
+    observed range is capped at 6, so that the quantized outputs saturate at 6.
+    """
+
+    def forward(self, x):
+        return super().forward(x.clamp(max=6.))
+
+
+def get_qconfigs(backend: str):
+    """
+    Return the quantization configurations of the plain layers and of the fused convolutions and
+    ReLU6 for the given backend (e.g. "fbgemm", "x86" or "qnnpack").
+    """
+    reduce_range = backend != 'qnnpack'
+    weight_observer = tq.get_default_qconfig(backend).weight
+    qconfig = tq.QConfig(activation=tq.MinMaxObserver.with_args(reduce_range=reduce_range), weight=weight_observer)
+    relu6_qconfig = tq.QConfig(activation=ReLU6Observer.with_args(reduce_range=reduce_range),
+                               weight=weight_observer)
+    return qconfig, relu6_qconfig
+
+
+def prepare_static_quantization(net: StridedInflatedMobileNetV2, backend: Optional[str] = None):
+    """
+    Prepare a backbone for post-training static quantization, in place: observers are attached to
+    all layers that do not keep an internal state, and record the range of their activations when
+    the network is run on calibration clips. Steppable convolutions and the first layer, which
+    normalizes uint8 frames, are kept in floating point.
+
+    :param net:
+        A backbone such as `StridedInflatedMobileNetV2` or `StridedInflatedEfficientNet`, with its
+        weights loaded.
+    :param backend:
+        Quantized engine to use. Defaults to the current `torch.backends.quantized.engine`. Note that
+        the engine is set globally.
+    """
+    backend = backend or torch.backends.quantized.engine
+    torch.backends.quantized.engine = backend
+    qconfig, relu6_qconfig = get_qconfigs(backend)
+
+    net.eval()
+    for index, layer in enumerate(net.cnn[1:], 1):
+        if isinstance(layer, InvertedResidual):
+            if any(isinstance(module, SteppableConv3dAs2d) for module in layer.conv[0].modules()):
+                layer.conv = nn.Sequential(layer.conv[0], _wrap(layer.conv[1:], qconfig, relu6_qconfig))
+            else:
+                layer.conv = _wrap(layer.conv, qconfig, relu6_qconfig)
+        else:
+            net.cnn[index] = _wrap(layer, qconfig, relu6_qconfig)
+
+    tq.prepare(net, inplace=True)
+    return net
+
+
+def convert_static_quantization(net: StridedInflatedMobileNetV2):
+    """
+    Replace the observed layers of a backbone prepared with `prepare_static_quantization` by their
+    quantized counterparts, in place.
+    """
+    tq.convert(net, inplace=True)
+    net.set_internal_state(None)
+    return net
+
+
+def quantize_static(net: StridedInflatedMobileNetV2, videos: Iterable[Iterable[np.ndarray]],
+                    backend: Optional[str] = None):
+    """
+    Quantize a backbone to int8, in place, calibrating the ranges of the activations on the given videos.
+
+    :param net:
+        A backbone with its weights loaded, see `prepare_static_quantization`.
+    :param videos:
+        Calibration videos, each given either as an iterable of uint8 frames of shape (height, width, 3),
+        e.g. as yielded by `sense.scoring.read_frames`, or as an array of shape (1, time, height, width, 3).
+        Frames are consumed by chunks, so that whole videos never need to be held in memory. Internal
+        states are reset before each video.
+    :param backend:
+        Quantized engine to use, see `prepare_static_quantization`.
+    """
+    prepare_static_quantization(net, backend)
+    with torch.no_grad():
+        for video in videos:
+            net.set_internal_state(None)
+            for chunk in _iterate_chunks(video, CALIBRATION_STEPS_PER_CHUNK * net.step_size, net.step_size):
+                net(net.preprocess(chunk))
+    return convert_static_quantization(net)
+
+
+def build_quantized_backbone(net: StridedInflatedMobileNetV2, backend: Optional[str] = None):
+    """
+    Give a backbone the structure of its quantized version, in place, so that a checkpoint saved from
+    a network quantized with `quantize_static` can be loaded into it, e.g.:
+
+        net = build_quantized_backbone(StridedInflatedMobileNetV2())
+        net.load_state_dict(load_weights_from_resources('backbone/strided_inflated_mobilenet_int8.ckpt'))
+    """
+    prepare_static_quantization(net, backend)
+    return convert_static_quantization(net)
+
+
+def quantize_dynamic(module: nn.Module):
+    """
+    Quantize the weights of the linear layers of a module (e.g. a classification head) to int8, in
+    place. Activations are quantized on the fly, so that no calibration is needed.
+    """
+    return tq.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def compare_features(expected: np.ndarray, features: np.ndarray) -> dict:
+    """
+    Measure how far features computed by a quantized network are from the features of the float network.
+
+    :return:
+        A dictionary with the mean cosine similarity between corresponding feature vectors and the
+        relative error of all features.
+    """
+    expected = expected.reshape(len(expected), -1).astype(np.float64)
+    features = features.reshape(len(features), -1).astype(np.float64)
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(features, axis=1)
+    cosine_similarity = (expected * features).sum(axis=1) / np.maximum(norms, 1e-12)
+    return {
+        'cosine_similarity': float(cosine_similarity.mean()),
+        'relative_error': float(np.linalg.norm(features - expected) / max(np.linalg.norm(expected), 1e-12)),
+    }
+
+
+def _iterate_chunks(frames, chunk_size, step_size):
+    # Group frames into clips of shape (1, chunk_size, height, width, 3), the last clip being cut to a
+    # whole number of steps
+    if isinstance(frames, np.ndarray):
+        frames = frames[0]
+    chunk = None
+    num_frames = 0
+    for frame in frames:
+        if chunk is None:
+            chunk = np.empty((1, chunk_size, *frame.shape), dtype=frame.dtype)
+        chunk[0, num_frames] = frame
+        num_frames += 1
+        if num_frames == chunk_size:
+            yield chunk
+            num_frames = 0
+    num_frames -= num_frames % step_size
+    if num_frames > 0:
+        yield chunk[:, :num_frames]
+
+
+def _wrap(module, qconfig, relu6_qconfig):
+    # Fuse each convolution with its ReLU6, the cap at 6 being enforced by the quantization range
+    _fuse_conv_relu(module, relu6_qconfig)
+    wrapper = tq.QuantWrapper(module)
+    wrapper.qconfig = qconfig
+    return wrapper
+
+
+def _fuse_conv_relu(module, relu6_qconfig):
+    for name, child in module.named_children():
+        if isinstance(child, ConvReLU) and type(child[0]) is nn.Conv2d:
+            fused = nni.ConvReLU2d(child[0], nn.ReLU(inplace=True))
+            fused.qconfig = relu6_qconfig
+            setattr(module, name, fused)
+        else:
+            _fuse_conv_relu(child, relu6_qconfig)
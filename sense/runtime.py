@@ -0,0 +1,79 @@
+import numpy as np
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+
+class RuntimeNet:
+    """
+    Base class of the networks that are run by an inference runtime instead of PyTorch, such as
+    `sense.onnx_runtime.OnnxRuntimeNet` and `sense.tflite_interpreter.TFLiteNet`.
+
+    Exported graphs process one step of frames at a time, with the internal states of the steppable
+    layers as explicit inputs and outputs. This class implements the parts of the `RealtimeNeuralNet`
+    interface that are used by `InferenceEngine`, `Controller` and `score_video` on top of that: frames
+    are processed step by step and internal states are carried over from one step to the next. Only a
+    single video stream is supported.
+
+    Subclasses set `expected_frame_size`, `fps` and `step_size`, and implement `preprocess`,
+    `_initial_states` and `_run_step`.
+    """
+
+    expected_frame_size: Tuple[int, int]
+    fps: int
+    step_size: int
+
+    def __init__(self):
+        self._states = None
+
+    @property
+    def num_required_frames_per_layer_padding(self) -> Dict[int, int]:
+        return {0: self.step_size}
+
+    def preprocess(self, clip: np.ndarray) -> np.ndarray:
+        """Turn a clip of shape (1, time, height, width, 3) into the frames expected by `__call__`."""
+        raise NotImplementedError
+
+    def _initial_states(self) -> List[np.ndarray]:
+        """Return the internal states of the first step."""
+        raise NotImplementedError
+
+    def _run_step(self, frames: np.ndarray, states: List[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Run the graph on the frames of one step and return its outputs and the next internal states."""
+        raise NotImplementedError
+
+    def _postprocess(self, outputs: List[np.ndarray]) -> Union[np.ndarray, List[np.ndarray]]:
+        """Turn the outputs of all steps, concatenated along the time dimension, into predictions."""
+        return outputs if len(outputs) > 1 else outputs[0]
+
+    def __call__(self, frames: np.ndarray) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Run the network on preprocessed frames, one step after the other. Trailing frames that do not
+        fill a whole step are ignored.
+        """
+        if self._states is None:
+            self._states = self._initial_states()
+
+        step_outputs = []
+        for start in range(0, len(frames) - self.step_size + 1, self.step_size):
+            outputs, self._states = self._run_step(frames[start:start + self.step_size], self._states)
+            step_outputs.append(outputs)
+
+        return self._postprocess([np.concatenate(output) for output in zip(*step_outputs)])
+
+    def get_internal_state(self) -> Optional[List[np.ndarray]]:
+        """Return a copy of the internal states, see `RealtimeNeuralNet.get_internal_state`."""
+        if self._states is None:
+            return None
+        return [state.copy() for state in self._states]
+
+    def set_internal_state(self, state: Optional[List[np.ndarray]]):
+        """Swap in internal states exported with `get_internal_state`, or reset them with `None`."""
+        self._states = None if state is None else [layer_state.copy() for layer_state in state]
+
+    def set_batch_size(self, batch_size: int):
+        if batch_size != 1:
+            raise ValueError(f'{type(self).__name__} only serves a single video stream')
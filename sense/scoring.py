@@ -0,0 +1,184 @@
+import csv
+import numpy as np
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from sense.camera import VideoSource
+from sense.downstream_tasks.postprocess import PostProcessor
+from sense.engine import InferenceEngine
+
+
+class StepClock:
+    """
+    Clock that follows the video time of the processed steps instead of the wall-clock time. It can
+    be passed to post-processors that measure durations, such as `CalorieAccumulator`, when videos are
+    scored faster than real-time.
+    """
+
+    def __init__(self):
+        self.time = 0.
+
+    def advance(self, duration: float):
+        """Move the clock forward by the given duration (in seconds)."""
+        self.time += duration
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def read_frames(video_path: str, size, fps: float) -> Iterator[np.ndarray]:
+    """
+    Decode a video file and yield its scaled frames, resampled to the given frame rate. Videos with a
+    lower frame rate are not upsampled.
+
+    :param video_path:
+        Path to the video file.
+    :param size:
+        The expected frame size of the neural network, as (height, width).
+    :param fps:
+        The frame rate of the neural network.
+    """
+    video_source = VideoSource(filename=video_path, size=size)
+    frame_interval = max(video_source.get_fps() / fps, 1.) if video_source.get_fps() > 0 else 1.
+    next_frame_index = 0.
+    frame_index = 0
+
+    while True:
+        images = video_source.get_image()
+        if images is None:
+            break
+
+        if frame_index >= next_frame_index:
+            next_frame_index += frame_interval
+            yield images[1]
+        frame_index += 1
+
+
+def flatten_postprocessed(outputs: dict, prefix: str = '') -> dict:
+    """
+    Flatten the output dictionaries of post-processors into scalar columns. Nested dictionaries are
+    flattened with '/'-separated keys and sorted predictions are reduced to the top-1 label and score.
+    """
+    columns = {}
+    for key, value in outputs.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            columns.update(flatten_postprocessed(value, prefix=f'{name}/'))
+        elif key == 'sorted_predictions':
+            label, score = value[0]
+            columns[f'{name}/top_label'] = label
+            columns[f'{name}/top_score'] = score
+        else:
+            columns[name] = value
+    return columns
+
+
+def score_video(inference_engine: InferenceEngine, post_processors: List[PostProcessor], video_path: str,
+                steps_per_chunk: int = 16, clock: Optional[StepClock] = None) -> Dict[str, list]:
+    """
+    Run every step of a video through the neural network as fast as possible and collect the
+    per-step predictions and post-processed outputs. In contrast to `Controller`, no frame and no
+    prediction is dropped: frames are not paced by the wall-clock and several steps are processed with
+    a single forward pass.
+
+    :param inference_engine:
+        The inference engine that runs the neural network. It does not need to be started.
+    :param post_processors:
+        Post processors that are applied to the predictions of every step, in order.
+    :param video_path:
+        Path to the video file.
+    :param steps_per_chunk:
+        Number of steps that are processed with a single forward pass.
+    :param clock:
+        If provided, the clock is advanced by the duration of a step before each step is post-processed.
+
+    :return:
+        A dictionary mapping column names to one value per step.
+    """
+    step_size = inference_engine.step_size
+    step_duration = step_size / inference_engine.fps
+    chunk_size = step_size * steps_per_chunk
+    frame_size = inference_engine.expected_frame_size
+    columns = {}
+
+    # Start from a blank internal state
+    inference_engine.net.set_internal_state(None)
+
+    def process_chunk(chunk, num_frames, first_step):
+        num_steps = num_frames // step_size
+        if num_steps == 0:
+            return
+
+        predictions = inference_engine.infer(chunk[:, :num_steps * step_size])
+        for index in range(num_steps):
+            if isinstance(predictions, list):
+                prediction = [pred[index] if pred is not None else None for pred in predictions]
+            else:
+                prediction = predictions[index]
+
+            if clock is not None:
+                clock.advance(step_duration)
+
+            postprocessed = {}
+            for post_processor in post_processors:
+                postprocessed.update(post_processor(prediction))
+
+            row = {
+                'video': video_path,
+                'step': first_step + index,
+                'time': (first_step + index + 1) * step_duration,
+            }
+            if isinstance(prediction, list):
+                row.update({f'prediction_{idx}': pred for idx, pred in enumerate(prediction)})
+            else:
+                row['prediction'] = prediction
+            row.update(flatten_postprocessed(postprocessed))
+
+            for key, value in row.items():
+                columns.setdefault(key, []).append(value)
+
+    chunk = np.empty((1, chunk_size, frame_size[0], frame_size[1], 3), dtype=np.uint8)
+    num_frames = 0
+    num_steps = 0
+    for frame in read_frames(video_path, frame_size, inference_engine.fps):
+        chunk[0, num_frames] = frame
+        num_frames += 1
+        if num_frames == chunk_size:
+            process_chunk(chunk, num_frames, num_steps)
+            num_steps += steps_per_chunk
+            num_frames = 0
+
+    # Remaining complete steps
+    process_chunk(chunk, num_frames, num_steps)
+
+    return columns
+
+
+def save_columns(path_out: str, columns: Dict[str, list]):
+    """
+    Save scoring results to a columnar file. With a `.npz` extension, each column is stored as
+    a separate array. With a `.csv` extension, array-valued columns are expanded into one column
+    per entry.
+    """
+    if path_out.endswith('.csv'):
+        names = []
+        values = []
+        for name, column in columns.items():
+            column = np.array(column)
+            if column.ndim == 1:
+                names.append(name)
+                values.append(column)
+            else:
+                column = column.reshape(len(column), -1)
+                names.extend(f'{name}_{idx}' for idx in range(column.shape[1]))
+                values.extend(column.T)
+
+        with open(path_out, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(zip(*values))
+    else:
+        np.savez(path_out, **{name: np.array(column) for name, column in columns.items()})
@@ -0,0 +1,148 @@
+import json
+import numpy as np
+import os
+
+from typing import List
+from typing import Optional
+from typing import Union
+
+from sense.runtime import RuntimeNet
+
+HISTORY_TAG = '_history_'
+SAVE_TAG = '_save_'
+
+
+class TFLiteNet(RuntimeNet):
+    """
+    Run a model converted with `tools/conversion/convert_to_tflite.py` with the TensorFlow Lite interpreter.
+
+    The converted graph takes the frames of a step as separate image inputs, from the newest frame
+    backwards, and keeps its temporal context in explicit ports: for each steppable layer, the frames
+    saved at one step (`<layer>_save_<index>` outputs) are fed back as history at the next step
+    (`<layer>_history_<index>` inputs). Layers that read more history frames than they process per
+    step only save their new frames, the rest of their history being shifted from the previous step,
+    see `_state_sources`. The names of the ports are read from the json file written next
+    to the model by the conversion script. It can be used instead of the PyTorch network by an
+    `InferenceEngine` or a `Controller` serving a single video stream.
+
+    The light `tflite_runtime` interpreter is used if it is installed, the one of TensorFlow otherwise.
+    """
+
+    def __init__(self, path: str, path_metadata: Optional[str] = None, num_threads: Optional[int] = None):
+        """
+        :param path:
+            Path to the .tflite file.
+        :param path_metadata:
+            Path to the json file written by the conversion script. Defaults to the path of the model
+            with the .json extension.
+        :param num_threads:
+            Number of threads used by the interpreter.
+        """
+        super().__init__()
+        with open(path_metadata or os.path.splitext(path)[0] + '.json') as f:
+            metadata = json.load(f)
+        self.fps = metadata['fps']
+        self.image_scale = metadata.get('image_scale', 1.)
+        self.use_softmax = metadata.get('use_softmax', False)
+
+        self.interpreter = self._load_interpreter(path, num_threads)
+        self.interpreter.allocate_tensors()
+        inputs = {_tensor_name(detail['name']): detail for detail in self.interpreter.get_input_details()}
+        outputs = _match_outputs(metadata['out_names'], self.interpreter.get_output_details())
+
+        history_names = [name for name in metadata['in_names'] if HISTORY_TAG in name]
+        frame_names = [name for name in metadata['in_names']
+                       if name in metadata['image_inputs'] and name not in history_names]
+        if not frame_names:
+            raise ValueError(f'No image input found in the metadata of {path}')
+        # Frame inputs are listed from the newest frame backwards
+        self._frame_inputs = [inputs[name] for name in frame_names]
+        self._history_inputs = [inputs[name] for name in history_names]
+        self._state_sources = _state_sources(history_names, outputs)
+        self._prediction_outputs = [outputs[name] for name in metadata['out_names']
+                                    if SAVE_TAG not in name and '_share' not in name]
+
+        self.step_size = len(self._frame_inputs)
+        self.expected_frame_size = tuple(int(size) for size in self._frame_inputs[0]['shape'][1:3])
+
+    @staticmethod
+    def _load_interpreter(path, num_threads):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        return Interpreter(model_path=path, num_threads=num_threads)
+
+    def preprocess(self, clip: np.ndarray) -> np.ndarray:
+        """
+        Return the frames of a clip of shape (1, time, height, width, 3) as scaled frames, mirrored
+        horizontally as by the `preprocess` method of the PyTorch backbones.
+        """
+        return clip[0, :, :, ::-1].astype(np.float32) / self.image_scale
+
+    def _initial_states(self):
+        return [np.zeros(detail['shape'], dtype=detail['dtype']) for detail in self._history_inputs]
+
+    def _run_step(self, frames, states):
+        for detail, frame in zip(self._frame_inputs, frames[::-1]):
+            self.interpreter.set_tensor(detail['index'], frame[None].astype(detail['dtype']))
+        for detail, state in zip(self._history_inputs, states):
+            self.interpreter.set_tensor(detail['index'], state)
+        self.interpreter.invoke()
+
+        outputs = [self.interpreter.get_tensor(detail['index']) for detail in self._prediction_outputs]
+        states = [states[source] if isinstance(source, int) else self.interpreter.get_tensor(source['index'])
+                  for source in self._state_sources]
+        return outputs, states
+
+    def _postprocess(self, outputs: List[np.ndarray]) -> Union[np.ndarray, List[np.ndarray]]:
+        if self.use_softmax:
+            outputs = [_softmax(output) for output in outputs]
+        return super()._postprocess(outputs)
+
+
+def _tensor_name(name: str) -> str:
+    # Signature inputs of converted Keras models are named e.g. "serving_default_new_frame:0"
+    name = name.split(':')[0]
+    return name[len('serving_default_'):] if name.startswith('serving_default_') else name
+
+
+def _match_outputs(out_names, details) -> dict:
+    """
+    Map the output names reported by the converter to the output tensors of the interpreter. Outputs
+    are looked up by name, then by the alias given by `export_keras_to_tflite`, and by position otherwise.
+    """
+    details_by_name = {_tensor_name(detail['name']): detail for detail in details}
+    outputs = {}
+    for index, name in enumerate(out_names):
+        alias = 'aa' + 'abcdefghijklmnopqrstuvw'[index] if index < 23 else None
+        outputs[name] = details_by_name.get(name) or details_by_name.get(alias) or details[index]
+    return outputs
+
+
+def _state_sources(history_names, outputs) -> list:
+    """
+    Return where each history input is taken from at the next step. The history of a layer holds the
+    frames that precede the frames of the current step, newest first, but the converter only saves
+    as many of them as the layer processes per step: `<layer>_history_<index>` is fed from the output
+    `<layer>_save_<index>` while such an output exists, and from the input
+    `<layer>_history_<index - num_saved>` of the previous step otherwise, given by its position in
+    `history_names`.
+    """
+    sources = []
+    for name in history_names:
+        layer, index = name.rsplit(HISTORY_TAG, 1)
+        index = int(index)
+        num_saved = sum(1 for out_name in outputs if out_name.startswith(layer + SAVE_TAG))
+        if index < num_saved:
+            sources.append(outputs[f'{layer}{SAVE_TAG}{index}'])
+        elif num_saved > 0:
+            sources.append(history_names.index(f'{layer}{HISTORY_TAG}{index - num_saved}'))
+        else:
+            raise ValueError(f'No saved frames found for the history of {layer}')
+    return sources
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
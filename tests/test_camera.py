@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from sense.camera import ClipBuffer
+from sense.camera import SyntheticVideoSource
+
+
+class TestClipBuffer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clip_buffer = ClipBuffer(step_size=4, frame_size=(8, 8), num_clips=2)
+
+    def append_frames(self, values):
+        return [self.clip_buffer.append(np.full((8, 8, 3), value, dtype=np.uint8)) for value in values]
+
+    def test_append_returns_clip_once_step_is_complete(self):
+        clips = self.append_frames(range(4))
+        assert clips[:3] == [None, None, None]
+        assert clips[3].shape == (1, 4, 8, 8, 3)
+        assert clips[3].dtype == np.uint8
+        np.testing.assert_array_equal(clips[3][0, :, 0, 0, 0], [0, 1, 2, 3])
+
+    def test_completed_clip_is_not_overwritten_by_next_step(self):
+        first_clip = self.append_frames(range(4))[-1]
+        second_clip = self.append_frames(range(4, 8))[-1]
+        np.testing.assert_array_equal(first_clip[0, :, 0, 0, 0], [0, 1, 2, 3])
+        np.testing.assert_array_equal(second_clip[0, :, 0, 0, 0], [4, 5, 6, 7])
+
+
+class TestSyntheticVideoSource(unittest.TestCase):
+
+    def test_get_image(self):
+        video_source = SyntheticVideoSource(size=(32, 32), num_frames=3, frame_shape=(24, 48))
+        frames = [video_source.get_image() for _ in range(4)]
+
+        img, scaled_img = frames[0]
+        assert img.shape == (24, 48, 3)
+        assert scaled_img.shape == (32, 32, 3)
+        assert frames[3] is None
+        assert video_source.get_frame_count() == 3
+
+    def test_non_square_size_is_height_width(self):
+        video_source = SyntheticVideoSource(size=(24, 16), num_frames=1, frame_shape=(30, 40))
+        img, scaled_img = video_source.get_image()
+        assert scaled_img.shape == (24, 16, 3)
+
+        clip_buffer = ClipBuffer(step_size=1, frame_size=(24, 16))
+        clip = clip_buffer.append(scaled_img)
+        assert clip.shape == (1, 1, 24, 16, 3)
+
+    def test_padding_preserves_aspect_ratio(self):
+        video_source = SyntheticVideoSource(size=(24, 16), num_frames=1, frame_shape=(30, 40))
+        padded_img = video_source.pad_to_aspect_ratio(np.ones((30, 40, 3), dtype=np.uint8), (24, 16))
+        assert padded_img.shape == (60, 40, 3)
+        assert padded_img[:15].sum() == 0 and padded_img[45:].sum() == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import asyncio
+import copy
+import threading
+import time
+import unittest
+
+import numpy as np
+import torch
+
+from sense import engine
+from sense import feature_extractors
+from sense.downstream_tasks.nn_utils import LogisticRegression
+from sense.downstream_tasks.nn_utils import MultiHeadPipe
+
+
+FRAME_SIZE = 64
+
+
+def random_clip(num_frames=4):
+    return np.random.randint(0, 256, size=(1, num_frames, FRAME_SIZE, FRAME_SIZE, 3)).astype(np.float32)
+
+
+def strided_multi_head_pipe():
+    # The second head is skipped every other step
+    net = MultiHeadPipe(feature_extractors.StridedInflatedMobileNetV2(),
+                        {'classifier': LogisticRegression(num_in=1280, num_out=5)})
+    net.add_head('regressor', LogisticRegression(num_in=1280, num_out=2), stride=2)
+    return net.eval()
+
+
+def wait_for_prediction(get_nowait, put_nowait, timeout=10):
+    # Run one step through the thread of an engine, returning None if no prediction comes back in time
+    put_nowait(random_clip())
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        prediction = get_nowait()
+        if prediction is not None:
+            return prediction
+        time.sleep(0.01)
+    return None
+
+
+class TestInferenceEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        np.random.seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.eval()
+
+    def test_lossless_delivers_all_predictions(self):
+        inference_engine = engine.InferenceEngine(self.net, lossless=True, queue_size=2)
+        inference_engine.start()
+        try:
+            for _ in range(6):
+                inference_engine.put(random_clip())
+            inference_engine.wait_until_done()
+        finally:
+            inference_engine.stop()
+            inference_engine.join()
+
+        predictions = []
+        prediction = inference_engine.get_nowait()
+        while prediction is not None:
+            predictions.append(prediction)
+            prediction = inference_engine.get_nowait()
+
+        assert len(predictions) == 6
+        assert inference_engine.num_dropped_clips == 0
+        assert inference_engine.num_dropped_predictions == 0
+
+    def test_skipped_head_in_thread(self):
+        inference_engine = engine.InferenceEngine(strided_multi_head_pipe())
+        inference_engine.start()
+        try:
+            predictions = [wait_for_prediction(inference_engine.get_nowait, inference_engine.put_nowait)
+                           for _ in range(3)]
+        finally:
+            inference_engine.stop()
+            inference_engine.join()
+
+        assert all(prediction is not None and prediction[0].shape == (5,) for prediction in predictions)
+        assert [prediction[1] is None for prediction in predictions] == [False, True, False]
+
+    def test_dropped_clips_are_counted(self):
+        inference_engine = engine.InferenceEngine(self.net)
+        for _ in range(3):
+            inference_engine.put(random_clip())
+        assert inference_engine.num_dropped_clips == 2
+
+
+class TestMultiStreamInferenceEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        np.random.seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.eval()
+
+    def test_infer_streams_matches_independent_engines(self):
+        stream_ids = ['camera_0', 'camera_1', 'camera_2']
+        multi_stream_engine = engine.MultiStreamInferenceEngine(self.net)
+        single_stream_engines = {stream_id: engine.InferenceEngine(copy.deepcopy(self.net))
+                                 for stream_id in stream_ids}
+
+        for step in range(4):
+            # Streams join at different steps
+            active_streams = stream_ids[:step + 1]
+            clips = {stream_id: random_clip() for stream_id in active_streams}
+
+            predictions = multi_stream_engine.infer_streams(clips)
+
+            for stream_id in active_streams:
+                expected = single_stream_engines[stream_id].infer(clips[stream_id])
+                np.testing.assert_allclose(predictions[stream_id], expected, rtol=1e-4, atol=1e-5)
+
+    def test_scheduler_batches_clips_within_latency_budget(self):
+        multi_stream_engine = engine.MultiStreamInferenceEngine(self.net, max_batch_size=2, max_latency=0.5)
+        multi_stream_engine.start()
+        try:
+            for stream_id in range(3):
+                multi_stream_engine.put_nowait(stream_id, random_clip())
+
+            predictions = {}
+            timeout = time.perf_counter() + 10
+            while len(predictions) < 3 and time.perf_counter() < timeout:
+                for stream_id in range(3):
+                    prediction = multi_stream_engine.get_nowait(stream_id)
+                    if prediction is not None:
+                        predictions[stream_id] = prediction
+                time.sleep(0.01)
+        finally:
+            multi_stream_engine.stop()
+            multi_stream_engine.join()
+
+        assert len(predictions) == 3
+        # Two full batches cannot be formed: the last clip is processed once its deadline is hit
+        assert multi_stream_engine.batch_size_histogram.count == 2
+        assert multi_stream_engine.batch_size_histogram.max == 2
+        assert multi_stream_engine.latency_histogram.count == 3
+        assert multi_stream_engine.latency_histogram.max >= 0.5
+
+    def test_skipped_head_in_thread(self):
+        multi_stream_engine = engine.MultiStreamInferenceEngine(strided_multi_head_pipe())
+        multi_stream_engine.start()
+        try:
+            predictions = [wait_for_prediction(lambda: multi_stream_engine.get_nowait('camera'),
+                                               lambda clip: multi_stream_engine.put_nowait('camera', clip))
+                           for _ in range(3)]
+        finally:
+            multi_stream_engine.stop()
+            multi_stream_engine.join()
+
+        assert all(prediction is not None and prediction[0].shape == (5,) for prediction in predictions)
+        assert [prediction[1] is None for prediction in predictions] == [False, True, False]
+
+    def test_put_replaces_pending_clip(self):
+        multi_stream_engine = engine.MultiStreamInferenceEngine(self.net)
+        clip = random_clip()
+        multi_stream_engine.put('camera', random_clip())
+        multi_stream_engine.put('camera', clip)
+        assert list(multi_stream_engine._clips) == ['camera']
+        assert multi_stream_engine._clips['camera'][0] is clip
+
+    def test_remove_stream(self):
+        multi_stream_engine = engine.MultiStreamInferenceEngine(self.net)
+        multi_stream_engine.infer_streams({0: random_clip(), 1: random_clip()})
+        multi_stream_engine.remove_stream(0)
+        assert multi_stream_engine.stream_ids == [1]
+
+
+class TestAsyncInferenceEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        np.random.seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.eval()
+
+    def test_infer_async_matches_independent_engines(self):
+        stream_ids = ['client_0', 'client_1', 'client_2']
+        clips = [{stream_id: random_clip() for stream_id in stream_ids} for _ in range(2)]
+        single_stream_engines = {stream_id: engine.InferenceEngine(copy.deepcopy(self.net))
+                                 for stream_id in stream_ids}
+
+        async def serve():
+            async with engine.AsyncInferenceEngine(self.net, max_pending=2) as async_engine:
+                batch_sizes = []
+                infer_streams = async_engine._engine.infer_streams
+
+                def record_batch_size(batch):
+                    batch_sizes.append(len(batch))
+                    return infer_streams(batch)
+
+                async_engine._engine.infer_streams = record_batch_size
+
+                async def client(stream_id):
+                    return [await async_engine.infer_async(step_clips[stream_id], stream_id=stream_id)
+                            for step_clips in clips]
+
+                results = await asyncio.gather(*[client(stream_id) for stream_id in stream_ids])
+                return dict(zip(stream_ids, results)), batch_sizes
+
+        predictions, batch_sizes = asyncio.run(serve())
+
+        # Clips of concurrent clients were batched together
+        assert max(batch_sizes) > 1
+        for stream_id in stream_ids:
+            for step_clips, prediction in zip(clips, predictions[stream_id]):
+                expected = single_stream_engines[stream_id].infer(step_clips[stream_id])
+                np.testing.assert_allclose(prediction, expected, rtol=1e-4, atol=1e-5)
+
+    def test_same_stream_is_not_batched(self):
+        async_engine = engine.AsyncInferenceEngine(self.net, max_batch_size=2)
+        requests = [('a', random_clip(), None), ('a', random_clip(), None), ('b', random_clip(), None),
+                    ('c', random_clip(), None)]
+        batch, remaining = async_engine._next_batch(requests)
+        assert [request[0] for request in batch] == ['a', 'b']
+        assert [request[0] for request in remaining] == ['a', 'c']
+
+        # Later clips of a stream are not batched before a deferred one
+        requests = [('b', random_clip(), None), ('a', random_clip(num_frames=8), None), ('a', random_clip(), None)]
+        batch, remaining = async_engine._next_batch(requests)
+        assert [request[0] for request in batch] == ['b']
+        assert [request[1].shape[1] for request in remaining] == [8, 4]
+
+    def test_stop_cancels_predictions_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_infer_streams(clips):
+            started.set()
+            release.wait(timeout=10)
+            return {stream_id: None for stream_id in clips}
+
+        async def serve():
+            async_engine = engine.AsyncInferenceEngine(self.net)
+            async_engine._engine.infer_streams = slow_infer_streams
+            async_engine.start()
+            request = asyncio.ensure_future(async_engine.infer_async(random_clip(), stream_id='a'))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 10)
+
+            stop = asyncio.ensure_future(async_engine.stop())
+            await asyncio.sleep(0)
+            release.set()
+            await stop
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(request, timeout=10)
+
+        asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    unittest.main()
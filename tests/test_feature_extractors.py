@@ -0,0 +1,152 @@
+import copy
+import unittest
+
+import numpy as np
+import torch
+
+from sense import feature_extractors
+from sense.feature_extractors.mobilenet import FusedConvReLU
+from sense.feature_extractors.mobilenet import SteppableConv3dAs2d
+from sense.feature_extractors.mobilenet import SteppableSparseConv3dAs2d
+
+
+class TestUint8Preprocessing(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.clip = np.random.randint(0, 256, size=(1, 4, 64, 64, 3)).astype(np.uint8)
+
+    def check_uint8_matches_float(self, net):
+        net.eval()
+        with torch.no_grad():
+            float_input = net.preprocess(self.clip.astype(np.float32))
+            expected = net(float_input)
+            net.set_internal_state(None)
+            uint8_input = net.preprocess(self.clip)
+            output = net(uint8_input)
+            # Compare the first layer on its own, as default weights hide most differences at the output
+            first_layer_output = net.forward_first_layer_uint8(uint8_input)
+            expected_first_layer_output = net.cnn[0](float_input)
+
+        assert uint8_input.dtype == torch.uint8
+        assert uint8_input.shape == (4, 3, 64, 64)
+        assert torch.allclose(output, expected, atol=1e-5)
+        assert torch.allclose(first_layer_output, expected_first_layer_output, atol=1e-5)
+
+    def test_mobilenet(self):
+        self.check_uint8_matches_float(feature_extractors.StridedInflatedMobileNetV2())
+
+    def test_efficientnet(self):
+        self.check_uint8_matches_float(feature_extractors.StridedInflatedEfficientNet())
+
+    def test_preprocess_uint8_does_not_copy(self):
+        net = feature_extractors.StridedInflatedMobileNetV2()
+        uint8_input = net.preprocess(self.clip)
+        assert uint8_input.data_ptr() == self.clip.ctypes.data
+
+
+class TestRearrangeFrames(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.num_frames = 7
+        self.batch_size = 2
+        self.frames = torch.rand(self.num_frames, self.batch_size, 8, 2, 2)
+
+    def rearrange(self, layer):
+        layer.batch_size = self.batch_size
+        output = layer.rearrange_frames(self.frames.flatten(0, 1))
+        return output.view(-1, self.batch_size, *output.shape[1:])
+
+    def test_dense(self):
+        for stride in (1, 2):
+            layer = SteppableConv3dAs2d(8, 8, (3, 1, 1), stride=(stride, 1, 1))
+            output = self.rearrange(layer)
+
+            expected = [torch.cat([self.frames[position + offset] for offset in range(3)], dim=1)
+                        for position in range(0, self.num_frames - 2, stride)]
+            assert torch.equal(output, torch.stack(expected))
+            # The index plan is reused
+            assert torch.equal(self.rearrange(layer), output)
+            assert len(layer._index_plans) == 1
+
+    def test_sparse(self):
+        for stride in (1, 2):
+            layer = SteppableSparseConv3dAs2d(8, 8, 1, stride=(stride, 1, 1))
+            output = self.rearrange(layer)
+
+            # Positions are aligned with the last frame
+            positions = range(self.num_frames - 3, -1, -stride)[::-1]
+            expected = [torch.cat([self.frames[position, :, 0:2], self.frames[position + 1, :, 2:4],
+                                   self.frames[position + 2, :, 4:]], dim=1)
+                        for position in positions]
+            assert torch.equal(output, torch.stack(expected))
+
+
+class TestSteppableInternalState(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.layer = SteppableConv3dAs2d(8, 8, (3, 1, 1))
+        self.layer.eval()
+
+    def test_matches_padded_convolution(self):
+        frames = torch.rand(12, 8, 2, 2)
+        with torch.no_grad():
+            outputs = torch.cat([self.layer(frames[index:index + 4]) for index in range(0, 12, 4)])
+            self.layer.internal_padding = False
+            expected = self.layer(torch.cat([torch.zeros(2, 8, 2, 2), frames]))
+        assert torch.allclose(outputs, expected, atol=1e-6)
+
+    def test_window_is_reused(self):
+        with torch.no_grad():
+            self.layer(torch.rand(4, 8, 2, 2))
+            data_ptr = self.layer.internal_state.data_ptr()
+            self.layer(torch.rand(4, 8, 2, 2))
+        assert self.layer.internal_state.data_ptr() == data_ptr
+
+    def test_set_internal_state_does_not_modify_state(self):
+        state = torch.rand(2, 8, 2, 2)
+        state_copy = state.clone()
+        self.layer.internal_state = state
+        with torch.no_grad():
+            self.layer(torch.rand(4, 8, 2, 2))
+        assert torch.equal(state, state_copy)
+
+
+class TestOptimizeForInference(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.clips = [np.random.randint(0, 256, size=(1, 4, 64, 64, 3)).astype(np.uint8) for _ in range(4)]
+
+    def check_matches_eager(self, net, **kwargs):
+        net.eval()
+        optimized_net = copy.deepcopy(net).optimize_for_inference(**kwargs)
+        with torch.no_grad():
+            for clip in self.clips[:3]:
+                expected = net(net.preprocess(clip))
+                output = optimized_net(optimized_net.preprocess(clip))
+                assert torch.allclose(output, expected, atol=1e-5)
+
+            # Internal states can still be swapped in
+            optimized_net.set_internal_state(net.get_internal_state())
+            expected = net(net.preprocess(self.clips[3]))
+            output = optimized_net(optimized_net.preprocess(self.clips[3]))
+        assert torch.allclose(output, expected, atol=1e-5)
+        return optimized_net
+
+    def test_mobilenet(self):
+        optimized_net = self.check_matches_eager(feature_extractors.StridedInflatedMobileNetV2())
+        assert isinstance(optimized_net.cnn[0], FusedConvReLU)
+        assert optimized_net.cnn[0].weight.is_contiguous(memory_format=torch.channels_last)
+
+    def test_efficientnet(self):
+        self.check_matches_eager(feature_extractors.StridedInflatedEfficientNet())
+
+    def test_trace(self):
+        self.check_matches_eager(feature_extractors.StridedInflatedMobileNetV2(), trace=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
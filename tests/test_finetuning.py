@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from sense import RESOURCES_DIR
+from sense import camera
+from sense import feature_extractors
+from sense import finetuning
+from sense.engine import InferenceEngine
+
+TEST_VIDEO = os.path.join(os.path.dirname(RESOURCES_DIR), 'tests', 'resources', 'test_video.mp4')
+
+
+class TestUniformFrameSample(unittest.TestCase):
+
+    def test_indices_match_sampled_frames(self):
+        video = np.arange(95)
+        sampled = finetuning.uniform_frame_sample(video, 16 / 30)
+        np.testing.assert_array_equal(sampled, finetuning.uniform_frame_indices(95, 16 / 30))
+
+    def test_no_upsampling(self):
+        np.testing.assert_array_equal(finetuning.uniform_frame_indices(10, 16 / 12), np.arange(10))
+
+
+class MisreportedVideoSource(camera.VideoSource):
+
+    def __init__(self, frame_count, **kwargs):
+        super().__init__(**kwargs)
+        self.frame_count = frame_count
+
+    def get_frame_count(self) -> int:
+        return self.frame_count
+
+
+class TestReadSampledFrames(unittest.TestCase):
+
+    def read_frames(self, video_source, fps):
+        return np.array(list(finetuning.read_sampled_frames(video_source, fps)))
+
+    def test_misreported_frame_count(self):
+        all_frames = self.read_frames(camera.VideoSource(filename=TEST_VIDEO, size=(32, 32)), fps=12)
+        expected = finetuning.uniform_frame_sample(all_frames, 5 / 12)
+        for frame_count in [-1, 0, 4, 40]:
+            video_source = MisreportedVideoSource(frame_count, filename=TEST_VIDEO, size=(32, 32))
+            np.testing.assert_array_equal(self.read_frames(video_source, fps=5), expected)
+
+    def test_unknown_length(self):
+        video_source = camera.SyntheticVideoSource(size=(32, 32), fps=30)
+        frames = finetuning.read_sampled_frames(video_source, fps=12)
+        for _ in range(5):
+            next(frames)
+        # Frames 0, 3, 5, 8 and 10 were kept
+        assert video_source._frame_index == 11
+
+    def test_no_frame(self):
+        assert len(finetuning.uniform_frame_indices(0, 0.5)) == 0
+
+
+class TestNpyWriter(unittest.TestCase):
+
+    def test_incremental_write(self):
+        chunks = [np.random.rand(n, 3, 2).astype(np.float32) for n in (1, 4, 2)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'features.npy')
+            writer = finetuning.NpyWriter(path)
+            for chunk in chunks:
+                writer.append(chunk)
+            assert not os.path.exists(path)
+            writer.close()
+
+            np.testing.assert_array_equal(np.load(path), np.concatenate(chunks))
+            np.testing.assert_array_equal(np.load(path, mmap_mode='r')[5:7], chunks[2])
+
+    def test_append_mismatching_shape(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = finetuning.NpyWriter(os.path.join(tmp_dir, 'features.npy'))
+            writer.append(np.zeros((1, 3)))
+            self.assertRaises(ValueError, writer.append, np.zeros((1, 4)))
+            writer.close()
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.features_dir = self.tmp_dir.name
+        self.files = []
+        for label, num_preds in [('a', 3), ('a', 5), ('b', 4)]:
+            os.makedirs(os.path.join(self.features_dir, label), exist_ok=True)
+            path = os.path.join(self.features_dir, label, f'video_{len(self.files)}.npy')
+            np.save(path, np.random.rand(num_preds, 8, 2, 2).astype(np.float32))
+            self.files.append(path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_store_matches_feature_files(self):
+        store = finetuning.FeatureStore.open(self.features_dir)
+        for path in self.files:
+            assert path in store
+            np.testing.assert_array_equal(store[path], np.load(path))
+
+    def test_store_is_rebuilt_when_features_are_added(self):
+        finetuning.FeatureStore.open(self.features_dir)
+        assert finetuning.FeatureStore.is_up_to_date(self.features_dir)
+
+        path = os.path.join(self.features_dir, 'b', 'new_video.npy')
+        np.save(path, np.random.rand(2, 8, 2, 2).astype(np.float32))
+        assert not finetuning.FeatureStore.is_up_to_date(self.features_dir)
+        np.testing.assert_array_equal(finetuning.FeatureStore.open(self.features_dir)[path], np.load(path))
+
+    def test_dataset_reads_from_store(self):
+        store = finetuning.FeatureStore.open(self.features_dir)
+        dataset = finetuning.FeaturesDataset(self.files, [0, 0, 1], [None] * 3, full_network_minimum_frames=1,
+                                             num_timesteps=2, feature_store=store)
+        features, label, _ = dataset[1]
+        assert type(features) is np.ndarray
+        assert features.shape == (2, 8, 2, 2)
+        assert label == 0
+
+
+class TestPooledFeatures(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.features_dir = os.path.join(self.tmp_dir.name, 'features_train')
+        os.makedirs(os.path.join(self.features_dir, 'a'))
+        self.path = os.path.join(self.features_dir, 'a', 'video.npy')
+        self.features = np.random.rand(3, 8, 2, 2).astype(np.float32)
+        np.save(self.path, self.features)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_pooled_features_path(self):
+        assert finetuning.get_pooled_features_path(self.path) == os.path.join(
+            self.tmp_dir.name, 'features_train_pooled', 'a', 'video.npy')
+
+    def test_pooled_features_are_computed_and_cached(self):
+        pooled = finetuning.load_pooled_features(self.path)
+        np.testing.assert_allclose(pooled, self.features.mean(axis=(2, 3)))
+        np.testing.assert_allclose(np.load(finetuning.get_pooled_features_path(self.path)), pooled)
+
+    def test_pool_missing_features(self):
+        finetuning.pool_missing_features(self.features_dir)
+        assert os.path.isfile(finetuning.get_pooled_features_path(self.path))
+
+
+class TestExtractFeatures(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.expected_frame_size = (64, 64)
+        self.net.eval()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths_out = []
+        for name in ['video_0', 'video_1']:
+            os.makedirs(os.path.join(self.tmp_dir.name, 'videos_train', 'a'), exist_ok=True)
+            shutil.copy(TEST_VIDEO, os.path.join(self.tmp_dir.name, 'videos_train', 'a', f'{name}.avi'))
+            self.paths_out.append(os.path.join(self.tmp_dir.name, 'features_train_num_layers_to_finetune=0',
+                                               'a', f'{name}.npy'))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_worker_pool_matches_single_process(self):
+        finetuning.extract_features(self.tmp_dir.name, self.net, 0, use_gpu=False, num_workers=2)
+
+        path_expected = os.path.join(self.tmp_dir.name, 'expected.npy')
+        finetuning.compute_features(TEST_VIDEO, path_expected, InferenceEngine(self.net), batch_size=16)
+        expected = np.load(path_expected)
+        for path_out in self.paths_out:
+            np.testing.assert_allclose(np.load(path_out), expected, rtol=1e-5, atol=1e-6)
+            assert os.path.isfile(finetuning.get_pooled_features_path(path_out))
+
+    def test_existing_features_are_skipped(self):
+        os.makedirs(os.path.dirname(self.paths_out[0]))
+        existing = np.zeros((1, 1280, 2, 2), dtype=np.float32)
+        np.save(self.paths_out[0], existing)
+
+        finetuning.extract_features(self.tmp_dir.name, self.net, 0, use_gpu=False, num_workers=2)
+
+        np.testing.assert_array_equal(np.load(self.paths_out[0]), existing)
+        assert os.path.isfile(self.paths_out[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_packages(module):
+    """Return the top-level packages loaded when importing a module in a fresh interpreter."""
+    script = f'import sys, {module}; print(" ".join({{name.split(".")[0] for name in sys.modules}}))'
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True, cwd=ROOT_DIR)
+    return set(result.stdout.split())
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_runtime_backends_do_not_import_torch(self):
+        for module in ['sense.controller', 'sense.engine', 'sense.onnx_runtime', 'sense.tflite_interpreter']:
+            assert 'torch' not in loaded_packages(module), module
+
+    def test_tflite_example_does_not_import_torch(self):
+        # The PyTorch network of the example is only loaded without --tflite_model
+        assert 'torch' not in loaded_packages('examples.run_gesture_recognition')
+
+    def test_finetuning_does_not_import_plotting_and_sklearn(self):
+        loaded = loaded_packages('sense.finetuning')
+        assert 'matplotlib' not in loaded
+        assert 'sklearn' not in loaded
+
+
+if __name__ == '__main__':
+    unittest.main()
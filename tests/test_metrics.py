@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+
+from sense import metrics
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_observe(self):
+        histogram = metrics.Histogram(buckets=(1, 2, 4))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+
+        assert histogram.counts == [2, 1, 1, 1]
+        assert histogram.count == 5
+        assert histogram.mean == 3.2
+        assert histogram.min == 0.5 and histogram.max == 10
+
+    def test_percentile(self):
+        histogram = metrics.Histogram(buckets=(1, 2, 4))
+        assert histogram.percentile(50) == 0.
+        for value in [0.5] * 98 + [3, 3.5]:
+            histogram.observe(value)
+
+        assert histogram.percentile(50) == 1
+        assert histogram.percentile(99) == 3.5
+        histogram.observe(10)
+        assert histogram.percentile(100) == 10
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.registry = metrics.MetricsRegistry()
+
+    def test_metrics_are_created_once(self):
+        self.registry.counter('frames_total').inc()
+        self.registry.counter('frames_total').inc(2)
+        self.registry.counter('frames_total', labels={'camera': '1'}).inc()
+        assert self.registry.snapshot() == {'frames_total': 3, 'frames_total{camera="1"}': 1}
+        self.assertRaises(ValueError, self.registry.gauge, 'frames_total')
+
+    def test_prometheus_export(self):
+        self.registry.gauge('queue_depth').set(2)
+        histogram = self.registry.histogram('latency_seconds', labels={'stage': 'display'}, buckets=(0.1, 1))
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert self.registry.to_prometheus() == (
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{stage="display",le="0.1"} 0\n'
+            'latency_seconds_bucket{stage="display",le="1"} 1\n'
+            'latency_seconds_bucket{stage="display",le="+Inf"} 2\n'
+            'latency_seconds_sum{stage="display"} 5.5\n'
+            'latency_seconds_count{stage="display"} 2\n'
+            '# TYPE queue_depth gauge\n'
+            'queue_depth 2\n'
+        )
+
+    def test_timer_trace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.jsonl')
+            self.registry.start_trace(path)
+            with self.registry.timer('forward_seconds'):
+                pass
+            self.registry.stop_trace()
+            with self.registry.timer('forward_seconds'):
+                pass
+
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+
+        assert [event['name'] for event in events] == ['forward_seconds']
+        assert self.registry.histogram('forward_seconds').count == 2
+
+    def test_serve(self):
+        self.registry.counter('frames_total').inc()
+        server = self.registry.serve(0, host='127.0.0.1')
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url) as response:
+                assert 'frames_total 1' in response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,17 @@
+import copy
+import os
+import tempfile
 import unittest
 
+import numpy as np
+import torch
+import torch.nn as nn
+
 import sense.downstream_tasks.nn_utils as nn_utils
 from sense import RESOURCES_DIR
+from sense import engine
+from sense import feature_extractors
+from sense.downstream_tasks import calorie_estimation
 
 
 class TestLoadWeightsFromResources(unittest.TestCase):
@@ -18,3 +28,260 @@ class TestLoadWeightsFromResources(unittest.TestCase):
     def test_load_weights_from_resources_on_wrong_path(self):
         wrong_path = 'this/path/does/not/exist'
         self.assertRaises(FileNotFoundError, nn_utils.load_weights_from_resources, wrong_path)
+
+
+class TestCheckpointCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        nn_utils.clear_checkpoint_cache()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'net.ckpt')
+        torch.save({'weight': torch.zeros(3)}, self.path)
+
+    def tearDown(self) -> None:
+        nn_utils.clear_checkpoint_cache()
+        self.tmp_dir.cleanup()
+
+    def test_checkpoint_is_read_once(self):
+        checkpoint = nn_utils.load_weights_from_resources(self.path, use_cache=True)
+        cached_checkpoint = nn_utils.load_weights_from_resources(self.path, use_cache=True)
+        assert cached_checkpoint is not checkpoint
+        assert cached_checkpoint['weight'] is checkpoint['weight']
+
+    def test_modified_checkpoint_is_reloaded(self):
+        nn_utils.load_weights_from_resources(self.path, use_cache=True)
+        torch.save({'weight': torch.ones(3)}, self.path)
+        os.utime(self.path, ns=(0, 0))
+        assert torch.equal(nn_utils.load_weights_from_resources(self.path, use_cache=True)['weight'], torch.ones(3))
+
+    def test_no_cache(self):
+        checkpoint = nn_utils.load_weights_from_resources(self.path, use_cache=False)
+        assert nn_utils.load_weights_from_resources(self.path, use_cache=True)['weight'] is not checkpoint['weight']
+
+    def test_ckpt_is_not_cached_by_default(self):
+        checkpoint = nn_utils.load_weights_from_resources(self.path)
+        assert nn_utils.load_weights_from_resources(self.path)['weight'] is not checkpoint['weight']
+        assert not nn_utils._checkpoint_cache
+
+    def test_tensor_archive_is_not_cached(self):
+        path = os.path.join(self.tmp_dir.name, 'net.tensors')
+        nn_utils.save_tensor_archive({'weight': torch.zeros(3)}, path)
+        checkpoint = nn_utils.load_weights_from_resources(path, use_cache=True)
+        assert nn_utils.load_weights_from_resources(path, use_cache=True)['weight'] is not checkpoint['weight']
+        assert not nn_utils._checkpoint_cache
+
+
+class TestTensorArchive(unittest.TestCase):
+
+    def setUp(self) -> None:
+        nn_utils.clear_checkpoint_cache()
+        torch.manual_seed(0)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'net.tensors')
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        nn_utils.save_tensor_archive(self.net.state_dict(), self.path)
+
+    def tearDown(self) -> None:
+        nn_utils.clear_checkpoint_cache()
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        state_dict = {'float': torch.rand(2, 3), 'long': torch.tensor(7), 'empty': torch.zeros(0, 4)}
+        nn_utils.save_tensor_archive(state_dict, self.path)
+        loaded = nn_utils.load_tensor_archive(self.path)
+        assert list(loaded) == list(state_dict)
+        for name, tensor in state_dict.items():
+            assert loaded[name].dtype == tensor.dtype
+            assert torch.equal(loaded[name], tensor)
+
+    def test_networks_use_memory_mapped_weights(self):
+        nets = [feature_extractors.StridedInflatedMobileNetV2() for _ in range(2)]
+        for net in nets:
+            net.load_weights_from_resources(self.path)
+
+        for (name, expected), *weights in zip(self.net.state_dict().items(),
+                                              *[net.state_dict().values() for net in nets]):
+            assert all(torch.equal(weight, expected) for weight in weights), name
+            assert weights[0].data_ptr() != weights[1].data_ptr(), name
+
+    def test_trained_weights_do_not_leak_into_next_load(self):
+        net = feature_extractors.StridedInflatedMobileNetV2()
+        net.load_weights_from_resources(self.path)
+        optimizer = torch.optim.SGD(net.parameters(), lr=1.)
+        net(torch.rand(4, 3, 64, 64)).sum().backward()
+        optimizer.step()
+
+        reloaded_net = feature_extractors.StridedInflatedMobileNetV2()
+        reloaded_net.load_weights_from_resources(self.path)
+        for (name, expected), weight in zip(self.net.state_dict().items(), reloaded_net.state_dict().values()):
+            assert torch.equal(weight, expected), name
+
+    def test_quantized_tensors_are_rejected(self):
+        tensor = torch.quantize_per_tensor(torch.rand(4), scale=0.1, zero_point=0, dtype=torch.quint8)
+        self.assertRaises(ValueError, nn_utils.save_tensor_archive, {'tensor': tensor}, self.path)
+
+
+class TestInternalState(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.eval()
+
+    def random_clip(self):
+        return torch.rand(4, 3, 64, 64)
+
+    def test_get_internal_state_before_warm_up(self):
+        assert self.net.get_internal_state() is None
+
+    def test_restore_internal_state(self):
+        clip_a, clip_b, clip_c = self.random_clip(), self.random_clip(), self.random_clip()
+
+        with torch.no_grad():
+            self.net(clip_a)
+            state = self.net.get_internal_state()
+            expected = self.net(clip_c)
+
+            # Process another stream, then swap the first one back in
+            self.net.set_internal_state(None)
+            self.net(clip_b)
+            self.net.set_internal_state(state)
+            output = self.net(clip_c)
+
+        assert state.data.dim() == 1
+        assert state.nbytes == state.data.numel() * 4
+        assert torch.allclose(output, expected)
+
+    def test_interleave_deinterleave(self):
+        with torch.no_grad():
+            self.net(self.random_clip())
+            state_a = self.net.get_internal_state()
+            self.net(self.random_clip())
+            state_b = self.net.get_internal_state()
+
+        interleaved = nn_utils.InternalState.interleave([state_a, state_b])
+        assert interleaved.shapes[0][0] == 2 * state_a.shapes[0][0]
+
+        restored_a, restored_b = interleaved.deinterleave(2)
+        assert torch.equal(restored_a.data, state_a.data)
+        assert torch.equal(restored_b.data, state_b.data)
+
+
+class TestPipeForwardBatch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        feature_extractor = feature_extractors.StridedInflatedEfficientNet()
+        fine_tuned_layers = feature_extractor.cnn[-9:]
+        for module in fine_tuned_layers.modules():
+            if hasattr(module, 'internal_padding'):
+                module.internal_padding = False
+        classifier = nn_utils.LogisticRegression(num_in=feature_extractor.feature_dim, num_out=4, use_softmax=False)
+        self.net = nn_utils.Pipe(fine_tuned_layers, classifier)
+        self.net.train()
+
+    def test_batched_forward_matches_per_sample_forward(self):
+        inputs = torch.rand(3, 7, 272, 4, 4)
+
+        outputs = self.net(inputs)
+        expected = torch.stack([self.net(input_i) for input_i in inputs])
+
+        assert outputs.shape == expected.shape
+        assert torch.allclose(outputs, expected, atol=1e-5)
+
+    def test_batched_backward(self):
+        inputs = torch.rand(2, 7, 272, 4, 4)
+        self.net(inputs).sum().backward()
+        assert self.net.feature_converter[0].weight.grad is not None
+
+
+class TestMultiHeadPipe(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
+        self.classifier = nn_utils.LogisticRegression(num_in=1280, num_out=5)
+        self.regressor = calorie_estimation.METValueMLPConverter()
+        self.spatial_head = nn.Conv2d(1280, 2, kernel_size=1)
+        heads = [copy.deepcopy(head) for head in (self.classifier, self.regressor, self.spatial_head)]
+        self.pipe = nn_utils.Pipe(copy.deepcopy(self.feature_extractor), heads)
+        self.multi_head_pipe = nn_utils.MultiHeadPipe(self.feature_extractor, {'classifier': self.classifier,
+                                                                               'regressor': self.regressor})
+        self.multi_head_pipe.add_head('spatial', self.spatial_head)
+        for net in (self.pipe, self.multi_head_pipe):
+            net.eval()
+
+    def random_clip(self):
+        return torch.rand(4, 3, 64, 64)
+
+    def test_outputs_match_pipe(self):
+        assert self.multi_head_pipe.head_names == ['classifier', 'regressor', 'spatial']
+        with torch.no_grad():
+            for _ in range(3):
+                clip = self.random_clip()
+                for output, expected in zip(self.multi_head_pipe(clip), self.pipe(clip)):
+                    assert output.shape == expected.shape
+                    assert torch.allclose(output, expected, atol=1e-6)
+
+    def test_heads_are_not_modified(self):
+        assert self.classifier.global_average_pooling
+        assert self.regressor.global_average_pooling
+        with torch.no_grad():
+            clip = self.random_clip()
+            feature = self.feature_extractor(clip)
+            self.multi_head_pipe.set_internal_state(None)
+            assert torch.allclose(self.multi_head_pipe(clip)[0], self.classifier(feature), atol=1e-6)
+
+    def test_strides(self):
+        self.multi_head_pipe.set_stride('regressor', 2)
+        self.multi_head_pipe.set_stride('spatial', 3)
+        with torch.no_grad():
+            outputs = [self.multi_head_pipe(self.random_clip()) for _ in range(4)]
+            self.multi_head_pipe.set_internal_state(None)
+            output_after_reset = self.multi_head_pipe(self.random_clip())
+
+        ran = [[output is not None for output in step_outputs] for step_outputs in outputs]
+        assert ran == [[True, True, True], [True, False, False], [True, True, False], [True, False, True]]
+        assert all(output is not None for output in output_after_reset)
+
+    def test_enable_disable(self):
+        self.multi_head_pipe.disable_head('classifier')
+        with torch.no_grad():
+            assert self.multi_head_pipe(self.random_clip())[0] is None
+            self.multi_head_pipe.enable_head('classifier')
+            assert self.multi_head_pipe(self.random_clip())[0] is not None
+
+    def test_inference_engine_with_skipped_head(self):
+        self.multi_head_pipe.set_stride('regressor', 2)
+        inference_engine = engine.InferenceEngine(self.multi_head_pipe)
+        clip = np.random.randint(0, 256, size=(1, 4, 64, 64, 3), dtype=np.uint8)
+        first, second = inference_engine.infer(clip), inference_engine.infer(clip)
+        assert first[1].shape == (1, 1)
+        assert second[1] is None
+        assert isinstance(second[0], np.ndarray)
+
+    def test_strides_are_counted_per_stream(self):
+        self.multi_head_pipe.set_stride('regressor', 2)
+        inference_engine = engine.MultiStreamInferenceEngine(self.multi_head_pipe)
+        clip = np.random.randint(0, 256, size=(1, 4, 64, 64, 3), dtype=np.uint8)
+
+        ran = [inference_engine.infer_streams({stream_id: clip})[stream_id][1] is not None
+               for stream_id in ['a', 'a', 'b', 'a', 'b']]
+        assert ran == [True, False, True, True, False]
+
+    def test_batched_forward_runs_all_enabled_heads(self):
+        self.multi_head_pipe.set_stride('regressor', 2)
+        self.multi_head_pipe.disable_head('spatial')
+        with torch.no_grad():
+            self.multi_head_pipe(self.random_clip())
+            outputs = self.multi_head_pipe(torch.rand(2, 4, 3, 64, 64))
+            next_outputs = self.multi_head_pipe(self.random_clip())
+
+        assert outputs[0].shape == (2, 1, 5)
+        assert outputs[1].shape == (2, 1, 1)
+        assert outputs[2] is None
+        # The batch does not count towards the strides
+        assert next_outputs[1] is None
+
+    def test_duplicate_head(self):
+        self.assertRaises(ValueError, self.multi_head_pipe.add_head, 'classifier', self.classifier)
@@ -0,0 +1,89 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from sense import feature_extractors
+from sense.downstream_tasks.nn_utils import LogisticRegression
+from sense.downstream_tasks.nn_utils import Pipe
+from sense.engine import InferenceEngine
+
+HAS_ONNX_RUNTIME = all(importlib.util.find_spec(name) is not None for name in ('onnx', 'onnxruntime'))
+
+
+@unittest.skipUnless(HAS_ONNX_RUNTIME, 'onnx and onnxruntime are required')
+class TestOnnxExport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        from sense.onnx_export import export_onnx
+        from sense.onnx_runtime import OnnxRuntimeNet
+
+        torch.manual_seed(0)
+        feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
+        feature_extractor.expected_frame_size = (64, 64)
+        cls.net = Pipe(feature_extractor, [LogisticRegression(num_in=1280, num_out=5),
+                                           LogisticRegression(num_in=1280, num_out=2)])
+        cls.net.eval()
+        for feature_converter in cls.net.feature_converter:
+            feature_converter.eval()
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp_dir.name, 'net.onnx')
+        export_onnx(cls.net, path)
+        cls.onnx_net = OnnxRuntimeNet(path)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
+
+    def setUp(self) -> None:
+        self.net.set_internal_state(None)
+        self.onnx_net.set_internal_state(None)
+        self.clips = [np.random.randint(0, 256, size=(1, 4, 64, 64, 3), dtype=np.uint8) for _ in range(4)]
+
+    def check_outputs_match(self, expected, output):
+        assert len(expected) == len(output) == 2
+        for expected_output, output in zip(expected, output):
+            assert output.shape == expected_output.shape
+            assert np.allclose(output, expected_output, atol=1e-5)
+
+    def test_metadata(self):
+        assert self.onnx_net.expected_frame_size == (64, 64)
+        assert self.onnx_net.fps == self.net.fps
+        assert self.onnx_net.step_size == self.net.step_size
+
+    def test_matches_pytorch_over_steps(self):
+        engine, onnx_engine = InferenceEngine(self.net), InferenceEngine(self.onnx_net)
+        for clip in self.clips:
+            self.check_outputs_match(engine.infer(clip), onnx_engine.infer(clip))
+
+    def test_multiple_steps_at_once(self):
+        clip = np.concatenate(self.clips, axis=1)
+        expected = InferenceEngine(self.net).infer(clip)
+        self.check_outputs_match(expected, InferenceEngine(self.onnx_net).infer(clip, batch_size=8))
+
+    def test_swap_internal_state(self):
+        engine = InferenceEngine(self.onnx_net)
+        engine.infer(self.clips[0])
+        state = self.onnx_net.get_internal_state()
+        expected = engine.infer(self.clips[1])
+
+        engine.infer(self.clips[2])
+        self.onnx_net.set_internal_state(state)
+        self.check_outputs_match(expected, engine.infer(self.clips[1]))
+
+    def test_export_leaves_internal_state_untouched(self):
+        from sense.onnx_export import export_onnx
+
+        InferenceEngine(self.net).infer(self.clips[0])
+        state = self.net.get_internal_state()
+        export_onnx(self.net, os.path.join(self.tmp_dir.name, 'other.onnx'))
+        assert torch.equal(self.net.get_internal_state().data, state.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from sense import feature_extractors
+from sense.engine import InferenceEngine
+from sense.profiler import LayerProfiler
+
+
+class TestLayerProfiler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.net = feature_extractors.StridedInflatedMobileNetV2()
+        self.net.eval()
+        self.inference_engine = InferenceEngine(self.net)
+        self.clip = np.random.randint(0, 256, size=(1, 4, 64, 64, 3), dtype=np.uint8)
+
+    def test_report(self):
+        expected = self.inference_engine.infer(self.clip)
+        self.net.set_internal_state(None)
+
+        with LayerProfiler(self.net) as profiler:
+            predictions = self.inference_engine.infer(self.clip)
+
+        np.testing.assert_allclose(predictions, expected)
+        rows = profiler.report()
+        assert len(rows) == len(self.net.cnn)
+        assert all(row['calls'] == 1 and row['mflops'] > 0 for row in rows)
+        # First convolution: 32 output channels of 32x32 pixels per frame with 3x3x3 kernels
+        assert rows[0]['mflops'] == 2 * 4 * 32 * 32 * 32 * 27 / 1e6
+        assert rows[3]['state_kb'] > 0 and rows[3]['rearrange_ms'] > 0 and rows[3]['state_ms'] > 0
+
+        times = [row['time_ms'] for row in profiler.report(sort_by='time_ms')]
+        assert times == sorted(times, reverse=True)
+
+    def test_detach(self):
+        with LayerProfiler(self.net):
+            pass
+        assert 'forward_first_layer_uint8' not in vars(self.net)
+        assert 'rearrange_frames' not in vars(self.net.cnn[3].conv[0][0])
+        assert 'shift_internal_state' not in vars(self.net.cnn[3].conv[0][0])
+        assert not self.net.cnn[0]._forward_hooks
+
+    def test_save_csv(self):
+        with LayerProfiler(self.net) as profiler:
+            self.inference_engine.infer(self.clip)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'report.csv')
+            profiler.save_csv(path)
+            with open(path) as f:
+                assert len(f.readlines()) == len(self.net.cnn) + 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import copy
+import io
+import unittest
+
+import numpy as np
+import torch
+
+from sense import feature_extractors
+from sense import quantization
+from sense.downstream_tasks.nn_utils import LogisticRegression
+
+
+class TestStaticQuantization(unittest.TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        rng = np.random.RandomState(0)
+        # Smooth frames, closer to natural images than pixel noise
+        frames = rng.randint(0, 256, size=(1, 40, 8, 8, 3)).astype(np.uint8)
+        self.video = np.ascontiguousarray(frames.repeat(8, axis=2).repeat(8, axis=3))
+        self.net = feature_extractors.StridedInflatedMobileNetV2().eval()
+        self.quantized_net = quantization.quantize_static(copy.deepcopy(self.net), [self.video[:, :32]])
+
+    def infer(self, net, clip):
+        with torch.no_grad():
+            return net(net.preprocess(clip)).numpy()
+
+    def test_features_are_close_to_float_network(self):
+        clip = self.video[:, 32:]
+        metrics = quantization.compare_features(self.infer(self.net, clip), self.infer(self.quantized_net, clip))
+        assert metrics['cosine_similarity'] > 0.99
+        assert metrics['relative_error'] < 0.1
+
+    def test_calibrate_on_streamed_frames(self):
+        frames = iter(self.video[0, :34])
+        quantized_net = quantization.quantize_static(copy.deepcopy(self.net), [frames])
+        clip = self.video[:, 32:]
+        assert np.array_equal(self.infer(quantized_net, clip), self.infer(self.quantized_net, clip))
+
+    def test_internal_state_is_kept_in_float(self):
+        self.infer(self.quantized_net, self.video[:, :4])
+        state = self.quantized_net.get_internal_state()
+        assert state is not None
+        assert state.data.dtype == torch.float32
+
+    def test_load_checkpoint(self):
+        buffer = io.BytesIO()
+        torch.save(self.quantized_net.state_dict(), buffer)
+        buffer.seek(0)
+
+        net = quantization.build_quantized_backbone(feature_extractors.StridedInflatedMobileNetV2())
+        net.load_state_dict(torch.load(buffer))
+        clip = self.video[:, 32:]
+        assert np.array_equal(self.infer(net, clip), self.infer(self.quantized_net, clip))
+
+
+class TestDynamicQuantization(unittest.TestCase):
+
+    def test_linear_head(self):
+        torch.manual_seed(0)
+        head = LogisticRegression(num_in=64, num_out=5).eval()
+        features = torch.rand(4, 64, 1, 1)
+        with torch.no_grad():
+            expected = head(features)
+            output = quantization.quantize_dynamic(copy.deepcopy(head))(features)
+        assert torch.allclose(output, expected, atol=1e-2)
+
+
+if __name__ == '__main__':
+    unittest.main()
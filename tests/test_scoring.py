@@ -0,0 +1,50 @@
+import os
+import unittest
+
+import numpy as np
+
+from sense import feature_extractors
+from sense import scoring
+from sense.downstream_tasks.fitness_rep_counting import INT2LAB
+from sense.downstream_tasks.nn_utils import LogisticRegression
+from sense.downstream_tasks.nn_utils import Pipe
+from sense.downstream_tasks.postprocess import PostprocessClassificationOutput
+from sense.downstream_tasks.postprocess import PostprocessRepCounts
+from sense.engine import InferenceEngine
+
+TEST_VIDEO = os.path.join(os.path.dirname(__file__), 'resources', 'test_video.mp4')
+
+
+class TestFlattenPostprocessed(unittest.TestCase):
+
+    def test_flatten_postprocessed(self):
+        outputs = {
+            'counting': {'squats': 2},
+            'sorted_predictions': [('squat', 0.75), ('background', 0.25)],
+            'Total calories': 1.5,
+        }
+        assert scoring.flatten_postprocessed(outputs) == {
+            'counting/squats': 2,
+            'sorted_predictions/top_label': 'squat',
+            'sorted_predictions/top_score': 0.75,
+            'Total calories': 1.5,
+        }
+
+
+class TestScoreVideo(unittest.TestCase):
+
+    def test_score_video(self):
+        net = Pipe(feature_extractors.StridedInflatedMobileNetV2(), LogisticRegression(1280, len(INT2LAB)))
+        net.eval()
+        post_processors = [PostprocessRepCounts(INT2LAB), PostprocessClassificationOutput(INT2LAB)]
+
+        # The test video has 13 frames at 12 fps, i.e. 3 complete steps
+        columns = scoring.score_video(InferenceEngine(net), post_processors, TEST_VIDEO, steps_per_chunk=2)
+
+        assert columns['step'] == [0, 1, 2]
+        assert np.array(columns['prediction']).shape == (3, len(INT2LAB))
+        assert len(columns['counting/squats']) == 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from sense import feature_extractors
+from sense.camera import ClipBuffer
+from sense.camera import SyntheticVideoSource
+from sense.engine import InferenceEngine
+from sense.tflite_interpreter import TFLiteNet
+from sense.tflite_interpreter import _state_sources
+
+# Frames of 4x6 pixels (height, width)
+FRAME_SHAPE = (1, 4, 6, 3)
+
+
+class FakeInterpreter:
+    """
+    Stand-in for the TensorFlow Lite interpreter running a model with a temporally strided layer that
+    sums the two frames of a step into one. The layer reads the two previous sums as history but only
+    saves the current one, as converted layers that process fewer frames than they read. The model
+    outputs the sums of both history frames and of the current frame.
+    """
+
+    def __init__(self):
+        self.tensors = {}
+
+    def allocate_tensors(self):
+        pass
+
+    def get_input_details(self):
+        return [
+            {'name': 'serving_default_cnn.1_history_0:0', 'index': 0, 'shape': np.array(FRAME_SHAPE),
+             'dtype': np.float32},
+            {'name': 'serving_default_new_frame:0', 'index': 1, 'shape': np.array(FRAME_SHAPE), 'dtype': np.float32},
+            {'name': 'serving_default_frame_back_1:0', 'index': 2, 'shape': np.array(FRAME_SHAPE),
+             'dtype': np.float32},
+            {'name': 'serving_default_cnn.1_history_1:0', 'index': 5, 'shape': np.array(FRAME_SHAPE),
+             'dtype': np.float32},
+        ]
+
+    def get_output_details(self):
+        return [
+            {'name': 'StatefulPartitionedCall:0', 'index': 3, 'shape': np.array([1, 3]), 'dtype': np.float32},
+            {'name': 'StatefulPartitionedCall:1', 'index': 4, 'shape': np.array(FRAME_SHAPE), 'dtype': np.float32},
+        ]
+
+    def set_tensor(self, index, value):
+        shape = next(detail['shape'] for detail in self.get_input_details() if detail['index'] == index)
+        if value.shape != tuple(shape):
+            raise ValueError(f'Cannot set tensor {index} of shape {tuple(shape)} to a value of shape {value.shape}')
+        self.tensors[index] = value
+
+    def invoke(self):
+        frame = self.tensors[1] + self.tensors[2]
+        self.tensors[3] = np.array([[self.tensors[0].sum(), self.tensors[5].sum(), frame.sum()]], dtype=np.float32)
+        self.tensors[4] = frame
+
+    def get_tensor(self, index):
+        return self.tensors[index].copy()
+
+
+class FakeTFLiteNet(TFLiteNet):
+
+    @staticmethod
+    def _load_interpreter(path, num_threads):
+        return FakeInterpreter()
+
+
+class TestTFLiteNet(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'model.tflite')
+        self.write_metadata(use_softmax=False)
+        self.net = FakeTFLiteNet(self.path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_metadata(self, use_softmax):
+        metadata = {
+            'in_names': ['cnn.1_history_0', 'new_frame', 'frame_back_1', 'cnn.1_history_1'],
+            'out_names': ['classifier', 'cnn.1_save_0'],
+            'image_inputs': ['new_frame', 'frame_back_1'],
+            'fps': 16,
+            'image_scale': 255.,
+            'use_softmax': use_softmax,
+        }
+        with open(os.path.join(self.tmp_dir.name, 'model.json'), 'w') as f:
+            json.dump(metadata, f)
+
+    @staticmethod
+    def make_clip(values):
+        # BGR frames of 255 in the red channel only, scaled by the given values
+        frames = np.zeros((1, len(values), *FRAME_SHAPE[1:]), dtype=np.float32)
+        frames[0, :, :, :, 2] = 255 * np.array(values)[:, None, None]
+        return frames
+
+    def test_metadata(self):
+        assert self.net.step_size == 2
+        assert self.net.expected_frame_size == (4, 6)
+        assert self.net.fps == 16
+
+    def test_history_is_fed_from_saved_frames(self):
+        num_pixels = np.prod(FRAME_SHAPE[1:3])
+        predictions = InferenceEngine(self.net).infer(self.make_clip([1, 2, 3, 4, 5, 6]))
+
+        # The sum of each step is saved and seen as the newest history frame at the next step, then
+        # shifted to the older history frame
+        expected = num_pixels * np.array([[0, 0, 3], [3, 0, 7], [7, 3, 11]])
+        assert predictions.shape == (3, 3)
+        assert np.allclose(predictions, expected)
+
+    def test_history_without_saved_frames(self):
+        with self.assertRaises(ValueError):
+            _state_sources(['cnn.1_history_0'], {'cnn.2_save_0': {}})
+
+    def test_frames_of_expected_size(self):
+        # Frame sizes are (height, width) from the video source to the interpreter
+        video_source = SyntheticVideoSource(size=self.net.expected_frame_size, num_frames=2)
+        clip_buffer = ClipBuffer(self.net.step_size, self.net.expected_frame_size)
+        clip = [clip_buffer.append(video_source.get_image()[1]) for _ in range(2)][-1]
+        assert InferenceEngine(self.net).infer(clip).shape == (1, 3)
+
+    def test_preprocess_matches_pytorch(self):
+        clip = np.random.randint(0, 256, size=(1, 2, *FRAME_SHAPE[1:]), dtype=np.uint8)
+        expected = feature_extractors.StridedInflatedMobileNetV2().preprocess(clip.astype(np.float32))
+        np.testing.assert_allclose(self.net.preprocess(clip), expected.permute(0, 2, 3, 1).numpy(), rtol=1e-6)
+
+    def test_swap_internal_state(self):
+        engine = InferenceEngine(self.net)
+        engine.infer(self.make_clip([1, 2]))
+        state = self.net.get_internal_state()
+        expected = engine.infer(self.make_clip([3, 4]))
+
+        engine.infer(self.make_clip([5, 6]))
+        self.net.set_internal_state(state)
+        assert np.allclose(engine.infer(self.make_clip([3, 4])), expected)
+
+        self.net.set_internal_state(None)
+        assert engine.infer(self.make_clip([3, 4]))[0, 0] == 0
+
+    def test_softmax(self):
+        self.write_metadata(use_softmax=True)
+        predictions = InferenceEngine(FakeTFLiteNet(self.path)).infer(self.make_clip([0, 0]))
+        assert np.allclose(predictions, [[1 / 3, 1 / 3, 1 / 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
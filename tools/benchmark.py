@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+Benchmark the realtime pipeline on synthetic videos: frames are generated, padded and resized like
+camera frames, assembled into clips, run through the network and post-processed as fast as possible.
+
+Every combination of the given backbones, feature converters, post-processing settings, batch sizes
+(number of video streams served by one network) and thread counts is measured in a separate process,
+and the end-to-end frame rate, the step latency percentiles and the peak memory usage are written to
+a json file. Networks are randomly initialized: the speed does not depend on the weights.
+
+Usage:
+  benchmark.py [--path_out=FILENAME]
+               [--backbones=NAMES]
+               [--converters=NAMES]
+               [--postprocess=VALUES]
+               [--batch_sizes=VALUES]
+               [--num_threads=VALUES]
+               [--num_steps=NUM]
+               [--num_warmup_steps=NUM]
+               [--compare=FILENAME]
+               [--tolerance=PERCENT]
+  benchmark.py (-h | --help)
+
+Options:
+  --path_out=FILENAME         Json file the results are written to [default: benchmark.json]
+  --backbones=NAMES           Comma-separated list of backbones among "efficientnet" and "mobilenet"
+                              [default: efficientnet,mobilenet]
+  --converters=NAMES          Comma-separated list of feature converters among "logistic_regression" and
+                              "met_converter" [default: logistic_regression,met_converter]
+  --postprocess=VALUES        Comma-separated list of whether to apply post-processors ("yes" or "no")
+                              [default: no,yes]
+  --batch_sizes=VALUES        Comma-separated list of numbers of video streams [default: 1]
+  --num_threads=VALUES        Comma-separated list of numbers of torch threads. Defaults to the torch default
+  --num_steps=NUM             Number of measured steps per configuration [default: 50]
+  --num_warmup_steps=NUM      Number of steps run before measuring [default: 5]
+  --compare=FILENAME          Results of a previous run to compare against. The script exits with an error
+                              if a configuration got slower than the tolerance
+  --tolerance=PERCENT         Tolerated slowdown (in percent) of the frame rate and the p99 step latency
+                              when comparing results [default: 10]
+"""
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+from docopt import docopt
+
+from sense import feature_extractors
+from sense.camera import ClipBuffer
+from sense.camera import SyntheticVideoSource
+from sense.downstream_tasks import calorie_estimation
+from sense.downstream_tasks.gesture_recognition import INT2LAB
+from sense.downstream_tasks.nn_utils import LogisticRegression
+from sense.downstream_tasks.nn_utils import Pipe
+from sense.downstream_tasks.postprocess import PostprocessClassificationOutput
+from sense.engine import InferenceEngine
+from sense.engine import MultiStreamInferenceEngine
+
+CONFIG_KEYS = ['backbone', 'converter', 'postprocess', 'batch_size', 'num_threads']
+
+
+def build_pipeline(backbone, converter):
+    """
+    Build a randomly initialized network together with a function creating its post-processors.
+    """
+    if backbone == 'efficientnet':
+        feature_extractor = feature_extractors.StridedInflatedEfficientNet()
+    elif backbone == 'mobilenet':
+        feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
+    else:
+        raise ValueError(f'Unknown backbone: {backbone}')
+
+    if converter == 'logistic_regression':
+        feature_converter = LogisticRegression(num_in=feature_extractor.feature_dim, num_out=len(INT2LAB))
+
+        def create_post_processors():
+            return [PostprocessClassificationOutput(INT2LAB, smoothing=4)]
+
+    elif converter == 'met_converter':
+        feature_converter = calorie_estimation.METValueMLPConverter()
+
+        def create_post_processors():
+            return [calorie_estimation.CalorieAccumulator()]
+
+    else:
+        raise ValueError(f'Unknown feature converter: {converter}')
+
+    net = Pipe(feature_extractor, feature_converter)
+    net.eval()
+    return net, create_post_processors
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the current process (in MB), if available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    return peak_rss / 2 ** 20 if sys.platform == 'darwin' else peak_rss / 2 ** 10
+
+
+def run_config(config, num_steps, num_warmup_steps):
+    """
+    Measure the pipeline for a single configuration and return the configuration along with its results.
+    """
+    if config['num_threads']:
+        torch.set_num_threads(config['num_threads'])
+    net, create_post_processors = build_pipeline(config['backbone'], config['converter'])
+    batch_size = config['batch_size']
+
+    inference_engine = MultiStreamInferenceEngine(net) if batch_size > 1 else InferenceEngine(net)
+    step_size = inference_engine.step_size
+    video_sources = [SyntheticVideoSource(size=inference_engine.expected_frame_size, seed=index)
+                     for index in range(batch_size)]
+    clip_buffers = [ClipBuffer(step_size, inference_engine.expected_frame_size) for _ in range(batch_size)]
+    post_processors = [create_post_processors() if config['postprocess'] else [] for _ in range(batch_size)]
+
+    def run_step():
+        clips = {}
+        for stream_id, (video_source, clip_buffer) in enumerate(zip(video_sources, clip_buffers)):
+            clip = None
+            while clip is None:
+                _, scaled_img = video_source.get_image()
+                clip = clip_buffer.append(scaled_img)
+            clips[stream_id] = clip
+
+        if batch_size > 1:
+            predictions = inference_engine.infer_streams(clips)
+        else:
+            predictions = {0: inference_engine.infer(clips[0])}
+
+        for stream_id, stream_predictions in predictions.items():
+            for post_processor in post_processors[stream_id]:
+                post_processor(stream_predictions[0])
+
+    for _ in range(num_warmup_steps):
+        run_step()
+
+    latencies = []
+    start_time = time.perf_counter()
+    for _ in range(num_steps):
+        step_start_time = time.perf_counter()
+        run_step()
+        latencies.append(time.perf_counter() - step_start_time)
+    duration = time.perf_counter() - start_time
+
+    return {
+        **config,
+        'num_threads': config['num_threads'] or torch.get_num_threads(),
+        'fps': num_steps * step_size * batch_size / duration,
+        'step_latency_p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'step_latency_p99_ms': 1000 * float(np.percentile(latencies, 99)),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def config_key(result):
+    return tuple(result[key] for key in CONFIG_KEYS)
+
+
+def compare_results(results, reference_results, tolerance):
+    """
+    Print the relative change of each configuration compared to the reference results and return
+    the list of configurations whose frame rate or p99 step latency got worse than the tolerance.
+    """
+    reference_results = {config_key(result): result for result in reference_results}
+    regressions = []
+    print("\nComparison with previous results:")
+    for result in results:
+        reference = reference_results.get(config_key(result))
+        if reference is None:
+            continue
+
+        fps_change = 100 * (result['fps'] / reference['fps'] - 1)
+        latency_change = 100 * (result['step_latency_p99_ms'] / reference['step_latency_p99_ms'] - 1)
+        regression = fps_change < -tolerance or latency_change > tolerance
+        if regression:
+            regressions.append(result)
+        print(f"  {format_config(result)}: fps {fps_change:+.1f}%, p99 latency {latency_change:+.1f}%"
+              f"{'  <-- REGRESSION' if regression else ''}")
+    return regressions
+
+
+def format_config(config):
+    return ', '.join(f'{key}={config[key]}' for key in CONFIG_KEYS)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    path_out = args['--path_out']
+    backbones = args['--backbones'].split(',')
+    converters = args['--converters'].split(',')
+    postprocess_values = [value == 'yes' for value in args['--postprocess'].split(',')]
+    batch_sizes = [int(value) for value in args['--batch_sizes'].split(',')]
+    thread_counts = [int(value) for value in args['--num_threads'].split(',')] if args['--num_threads'] else [None]
+    num_steps = int(args['--num_steps'])
+    num_warmup_steps = int(args['--num_warmup_steps'])
+    path_compare = args['--compare']
+    tolerance = float(args['--tolerance'])
+
+    configs = [dict(zip(CONFIG_KEYS, values))
+               for values in itertools.product(backbones, converters, postprocess_values, batch_sizes, thread_counts)]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for index, config in enumerate(configs):
+        print(f"[{index + 1}/{len(configs)}] {format_config(config)}")
+        # Run each configuration in a fresh process so that peak memory usages are not mixed up
+        with context.Pool(1) as pool:
+            result = pool.apply(run_config, (config, num_steps, num_warmup_steps))
+        print(f"  {result['fps']:.1f} frames/s, step latency p50 {result['step_latency_p50_ms']:.1f} ms / "
+              f"p99 {result['step_latency_p99_ms']:.1f} ms, peak RSS {result['peak_rss_mb'] or 0:.0f} MB")
+        results.append(result)
+
+    with open(path_out, 'w') as f:
+        json.dump({'metadata': get_metadata(), 'results': results}, f, indent=2)
+    print(f"Saved results to {path_out}")
+
+    if path_compare:
+        with open(path_compare) as f:
+            reference_results = json.load(f)['results']
+        if compare_results(results, reference_results, tolerance):
+            sys.exit(1)
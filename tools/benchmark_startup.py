@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Benchmark the cold start of the entry points of sense: each module is imported in a fresh Python process,
+several times, and the median import time, the median total run time of the process (including the
+start of the interpreter) and the heavy dependencies that got loaded along the way are reported.
+
+Usage:
+  benchmark_startup.py [--modules=NAMES]
+                       [--num_runs=NUM]
+                       [--path_out=FILENAME]
+  benchmark_startup.py (-h | --help)
+
+Options:
+  --modules=NAMES         Comma-separated list of modules to import. Defaults to the entry points of sense
+  --num_runs=NUM          Number of fresh processes per module [default: 5]
+  --path_out=FILENAME     If provided, write the results to this json file
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from docopt import docopt
+
+DEFAULT_MODULES = ['sense.controller', 'sense.engine', 'sense.onnx_runtime', 'sense.tflite_interpreter',
+                   'sense.feature_extractors', 'sense.finetuning']
+HEAVY_MODULES = ['torch', 'cv2', 'matplotlib', 'sklearn', 'onnxruntime', 'tensorflow', 'tflite_runtime']
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+print(json.dumps({{'import_seconds': duration, 'loaded': [name for name in {heavy} if name in sys.modules]}}))
+'''
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_startup(module, num_runs):
+    """
+    Import a module in fresh processes and return the median import and process times (in ms) along
+    with the heavy dependencies loaded by the import.
+    """
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    import_times, process_times = [], []
+    for _ in range(num_runs):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, cwd=ROOT_DIR)
+        process_times.append(time.perf_counter() - start_time)
+        if result.returncode != 0:
+            raise RuntimeError(f'Importing {module} failed:\n{result.stderr}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        import_times.append(report['import_seconds'])
+
+    return {
+        'module': module,
+        'import_ms': 1000 * float(np.median(import_times)),
+        'process_ms': 1000 * float(np.median(process_times)),
+        'loaded': report['loaded'],
+    }
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    modules = args['--modules'].split(',') if args['--modules'] else DEFAULT_MODULES
+    num_runs = int(args['--num_runs'])
+    path_out = args['--path_out']
+
+    results = []
+    for module in modules:
+        result = measure_startup(module, num_runs)
+        print(f"{module}: import {result['import_ms']:.0f} ms, process {result['process_ms']:.0f} ms, "
+              f"loaded {', '.join(result['loaded']) or 'none'}")
+        results.append(result)
+
+    if path_out:
+        with open(path_out, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f"Saved results to {path_out}")
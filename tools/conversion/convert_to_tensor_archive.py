@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Convert a PyTorch checkpoint to a tensor archive. Archives are memory-mapped when loaded with
+`load_weights_from_resources`, so that worker processes running on the same host share their weights
+through the page cache instead of each holding a private copy.
+
+Usage:
+  convert_to_tensor_archive.py --path_in=FILENAME
+                               [--path_out=FILENAME]
+  convert_to_tensor_archive.py (-h | --help)
+
+Options:
+  --path_in=FILENAME         Path to the checkpoint, absolute or relative to the resources folder
+                             (e.g. backbone/strided_inflated_efficientnet.ckpt)
+  --path_out=FILENAME        Path of the archive. Defaults to the path of the checkpoint with the
+                             .tensors extension
+"""
+import os
+
+from docopt import docopt
+
+from sense import RESOURCES_DIR
+from sense.downstream_tasks.nn_utils import TENSOR_ARCHIVE_EXTENSION
+from sense.downstream_tasks.nn_utils import load_weights_from_resources
+from sense.downstream_tasks.nn_utils import save_tensor_archive
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    path_in = args['--path_in']
+    path_out = args['--path_out'] or os.path.splitext(
+        os.path.join(RESOURCES_DIR, path_in.split(f'resources{os.sep}')[-1]))[0] + TENSOR_ARCHIVE_EXTENSION
+
+    checkpoint = load_weights_from_resources(path_in, use_cache=False)
+    save_tensor_archive(checkpoint, path_out)
+    print(f"Saved {len(checkpoint)} tensors to {path_out}")
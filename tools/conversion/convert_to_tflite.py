@@ -22,6 +22,7 @@ Options:
   -h --help
 """
 
+import json
 import os
 import logging
 from docopt import docopt
@@ -50,6 +51,7 @@ SUPPORTED_BACKBONE_CONVERSIONS = {
     "efficientnet": {
         "config_file": "tools/conversion/cfg/efficientnet.cfg",
         "weights_file": "resources/backbone/strided_inflated_efficientnet.ckpt",
+        "fps": 16,
         "conversion_parameters": {
             **DEFAULT_CONVERSION_PARAMETERS,
             "image_scale": 255.0,
@@ -63,18 +65,21 @@ SUPPORTED_CLASSIFIER_CONVERSIONS = {
         "placeholder_values": {"NUM_CLASSES": "30"},
         "weights_file": "resources/gesture_detection/efficientnet_logistic_regression.ckpt",
         "corresponding_backbone": "efficientnet",
+        "use_softmax": True,
     },
     "efficient_net_fitness_activity_recognition": {
         "config_file": "tools/conversion/cfg/logistic_regression.cfg",
         "placeholder_values": {"NUM_CLASSES": "81"},
         "weights_file": "resources/fitness_activity_recognition/efficientnet_logistic_regression.ckpt",
         "corresponding_backbone": "efficientnet",
+        "use_softmax": True,
     },
     "custom_classifier": {
         "config_file": "tools/conversion/cfg/logistic_regression.cfg",
         "placeholder_values": {"NUM_CLASSES": None},
         "weights_file": None,
         "corresponding_backbone": None,
+        "use_softmax": True,
     },
 }
 
@@ -86,6 +91,7 @@ def convert(backbone_settings, classifier_settings, output_name, plot_model):
     conversion_parameters = backbone_settings["conversion_parameters"]
     keras_file = os.path.join(output_dir, output_name + ".h5")
     tflite_file = os.path.join(output_dir, output_name + ".tflite")
+    metadata_file = os.path.join(output_dir, output_name + ".json")
 
     weights_full = load_weights(
         backbone_settings["weights_file"], classifier_settings["weights_file"]
@@ -117,6 +123,19 @@ def convert(backbone_settings, classifier_settings, output_name, plot_model):
 
     export_keras_to_tflite(keras_file, tflite_file)
 
+    # Names of the ports needed to run the model, see `sense.tflite_interpreter.TFLiteNet`
+    metadata = {
+        "in_names": in_names,
+        "out_names": out_names,
+        "image_inputs": image_inputs,
+        "fps": backbone_settings["fps"],
+        "image_scale": conversion_parameters["image_scale"],
+        "use_softmax": classifier_settings["use_softmax"],
+    }
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f, indent=2)
+    logging.info("Saved model metadata to {}".format(metadata_file))
+
     if fake_weights:
         logging.warning("************************* Warning!! **************************")
         logging.warning("Weights in checkpoint did not match weights required by network")
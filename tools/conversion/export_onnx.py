@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Export the network of a demo task or of a custom classifier to ONNX, with the internal states of the
+steppable layers as explicit inputs and outputs. The exported graph can be run with ONNX Runtime,
+e.g. with `score_videos.py --onnx_model=FILENAME`.
+
+Usage:
+  export_onnx.py --path_out=FILENAME
+                 [--task=TASK]
+                 [--custom_classifier=PATH]
+                 [--opset=VERSION]
+  export_onnx.py (-h | --help)
+
+Options:
+  --path_out=FILENAME        Path of the ONNX file
+  --task=TASK                One of "gesture_recognition", "fitness_tracker", "fitness_rep_counter" or
+                             "calorie_estimation" [default: gesture_recognition]
+  --custom_classifier=PATH   Path to a custom classifier obtained via the train_classifier script. If provided, the
+                             task is ignored
+  --opset=VERSION            ONNX operator set to target [default: 11]
+"""
+import numpy as np
+from docopt import docopt
+
+from sense.engine import InferenceEngine
+from sense.onnx_export import export_onnx
+from sense.onnx_runtime import OnnxRuntimeNet
+from tools.score_videos import load_custom_classifier
+from tools.score_videos import load_task
+
+
+def check_export(net, onnx_net, num_steps=3):
+    """Return the largest difference between the predictions of the PyTorch and ONNX networks on random frames."""
+    engines = [InferenceEngine(net), InferenceEngine(onnx_net)]
+    max_difference = 0.
+    for _ in range(num_steps):
+        clip = np.random.randint(0, 256, size=(1, net.step_size, *net.expected_frame_size, 3), dtype=np.uint8)
+        expected, output = [engine.infer(clip) for engine in engines]
+        if not isinstance(expected, list):
+            expected, output = [expected], [output]
+        max_difference = max(max_difference, *(np.abs(x - y).max() for x, y in zip(expected, output)))
+    net.set_internal_state(None)
+    return max_difference
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    path_out = args['--path_out']
+    task = args['--task']
+    custom_classifier = args['--custom_classifier']
+    opset_version = int(args['--opset'])
+
+    if custom_classifier:
+        net, _ = load_custom_classifier(custom_classifier)
+    else:
+        # User information is only used by the post-processors
+        net, _ = load_task(task, user_info={})
+
+    export_onnx(net, path_out, opset_version=opset_version)
+    print(f"Exported network to {path_out}")
+    print(f"Largest difference with PyTorch predictions: {check_export(net, OnnxRuntimeNet(path_out)):.2e}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Profile the layers of a backbone network: wall time, FLOPs, activation memory and internal state
+size per layer, while running on random frames or on a video file.
+
+Usage:
+  profile_backbone.py [--backbone=NAME]
+                      [--path_in=FILENAME]
+                      [--num_steps=NUM]
+                      [--num_threads=NUM]
+                      [--sort_by=COLUMN]
+                      [--path_out=FILENAME]
+                      [--use_gpu]
+  profile_backbone.py (-h | --help)
+
+Options:
+  --backbone=NAME       Either "efficientnet" or "mobilenet" [default: efficientnet]
+  --path_in=FILENAME    Video file to run the backbone on. If not provided, random frames are used
+  --num_steps=NUM       Number of steps to profile (after 1 warm-up step) [default: 100]
+  --num_threads=NUM     Number of CPU threads used by torch
+  --sort_by=COLUMN      Column used to sort the report, e.g. "index", "time_ms", "mflops" or "state_kb"
+                        [default: time_ms]
+  --path_out=FILENAME   If provided, save the report to this csv file
+"""
+import numpy as np
+import torch
+from docopt import docopt
+
+from sense import feature_extractors
+from sense.engine import InferenceEngine
+from sense.profiler import LayerProfiler
+from sense.scoring import read_frames
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    backbone = args['--backbone']
+    path_in = args['--path_in']
+    num_steps = int(args['--num_steps'])
+    sort_by = args['--sort_by']
+    path_out = args['--path_out']
+    use_gpu = args['--use_gpu']
+    if args['--num_threads']:
+        torch.set_num_threads(int(args['--num_threads']))
+
+    # Weights are not needed to measure the cost of each layer
+    if backbone == 'efficientnet':
+        net = feature_extractors.StridedInflatedEfficientNet()
+    elif backbone == 'mobilenet':
+        net = feature_extractors.StridedInflatedMobileNetV2()
+    else:
+        raise ValueError(f'Unknown backbone: {backbone}')
+    net.eval()
+    inference_engine = InferenceEngine(net, use_gpu=use_gpu)
+
+    step_size = inference_engine.step_size
+    height, width = inference_engine.expected_frame_size
+    if path_in:
+        frames = np.array(list(read_frames(path_in, inference_engine.expected_frame_size, inference_engine.fps)))
+        num_steps = min(num_steps, len(frames) // step_size - 1)
+        clips = [frames[None, index * step_size:(index + 1) * step_size] for index in range(num_steps + 1)]
+    else:
+        clips = [np.random.randint(0, 256, size=(1, step_size, height, width, 3), dtype=np.uint8)
+                 for _ in range(num_steps + 1)]
+
+    # Warm-up step, which also initializes the internal states
+    inference_engine.infer(clips[0])
+
+    with LayerProfiler(net) as profiler:
+        for clip in clips[1:]:
+            inference_engine.infer(clip)
+
+    print(profiler.format_report(sort_by=sort_by))
+    if path_out:
+        profiler.save_csv(path_out, sort_by=sort_by)
+        print(f"Saved report to {path_out}")
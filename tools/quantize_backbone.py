@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Quantize a backbone network to int8 for faster CPU inference. The ranges of the activations are
+calibrated on videos sampled from the `videos_train` folder of a dataset, the features of the quantized
+network are compared to those of the float network on the `videos_valid` folder, and the quantized
+weights are saved to a checkpoint.
+
+The checkpoint can be loaded into a network with the structure of the quantized backbone:
+
+    net = build_quantized_backbone(StridedInflatedMobileNetV2())
+    net.load_state_dict(load_weights_from_resources(PATH_OUT))
+
+Usage:
+  quantize_backbone.py --path_in=PATH --path_out=FILENAME
+                       [--backbone=NAME]
+                       [--num_calibration_videos=NUM]
+                       [--num_valid_videos=NUM]
+                       [--backend=NAME]
+  quantize_backbone.py (-h | --help)
+
+Options:
+  --path_in=PATH                Path to the dataset folder, following the structure described in the README
+  --path_out=FILENAME           Where to save the quantized checkpoint
+  --backbone=NAME               Either "efficientnet" or "mobilenet" [default: efficientnet]
+  --num_calibration_videos=NUM  Number of training videos sampled for the calibration [default: 50]
+  --num_valid_videos=NUM        Maximum number of validation videos used to compare the features [default: 50]
+  --backend=NAME                Quantized engine, e.g. "fbgemm", "x86" or "qnnpack". Defaults to the
+                                engine selected by torch for this machine
+"""
+import copy
+import glob
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import torch
+from docopt import docopt
+
+from sense import feature_extractors
+from sense.engine import InferenceEngine
+from sense.finetuning import compute_features
+from sense.quantization import compare_features
+from sense.quantization import quantize_static
+from sense.scoring import read_frames
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def list_videos(videos_dir):
+    return sorted(path for path in glob.glob(os.path.join(videos_dir, '*', '*'))
+                  if path.lower().endswith(VIDEO_EXTENSIONS))
+
+
+def load_features(video_path, inference_engine, path_out):
+    compute_features(video_path, path_out, inference_engine)
+    return np.load(path_out)
+
+
+def measure_step_time(net, num_steps=10):
+    clip = np.random.randint(0, 256, size=(1, net.step_size, *net.expected_frame_size, 3), dtype=np.uint8)
+    with torch.no_grad():
+        net(net.preprocess(clip))
+        start_time = time.perf_counter()
+        for _ in range(num_steps):
+            net(net.preprocess(clip))
+    net.set_internal_state(None)
+    return (time.perf_counter() - start_time) / num_steps
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    path_in = args['--path_in']
+    path_out = args['--path_out']
+    backbone = args['--backbone']
+    num_calibration_videos = int(args['--num_calibration_videos'])
+    num_valid_videos = int(args['--num_valid_videos'])
+    backend = args['--backend']
+
+    if backbone == 'efficientnet':
+        net = feature_extractors.StridedInflatedEfficientNet()
+        net.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
+    elif backbone == 'mobilenet':
+        net = feature_extractors.StridedInflatedMobileNetV2()
+        net.load_weights_from_resources('backbone/strided_inflated_mobilenet.ckpt')
+    else:
+        raise ValueError(f'Unknown backbone: {backbone}')
+    net.eval()
+
+    # Calibrate on a random sample of training videos
+    train_videos = list_videos(os.path.join(path_in, 'videos_train'))
+    if not train_videos:
+        raise ValueError(f'No training videos found in {path_in}')
+    calibration_videos = random.Random(0).sample(train_videos, min(num_calibration_videos, len(train_videos)))
+    print(f"Calibrating on {len(calibration_videos)} videos")
+    videos = (read_frames(path, net.expected_frame_size, net.fps) for path in calibration_videos)
+    quantized_net = quantize_static(copy.deepcopy(net), videos, backend=backend)
+
+    # Compare with the features of the float network. Features that were precomputed for training
+    # a classifier on top of the whole backbone are reused, but they are only computed with EfficientNet
+    valid_dir = os.path.join(path_in, 'videos_valid')
+    features_dir = os.path.join(path_in, 'features_valid_num_layers_to_finetune=0')
+    reuse_features = backbone == 'efficientnet'
+    float_engine = InferenceEngine(net)
+    quantized_engine = InferenceEngine(quantized_net)
+    metrics = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index, video_path in enumerate(list_videos(valid_dir)[:num_valid_videos]):
+            path_features = os.path.splitext(video_path.replace(valid_dir, features_dir))[0] + '.npy'
+            if reuse_features and os.path.isfile(path_features):
+                expected = np.load(path_features)
+            else:
+                expected = load_features(video_path, float_engine, os.path.join(tmp_dir, f'{index}_float.npy'))
+            features = load_features(video_path, quantized_engine, os.path.join(tmp_dir, f'{index}_int8.npy'))
+            metrics.append(compare_features(expected, features))
+
+    if metrics:
+        print(f"Features of {len(metrics)} validation videos: "
+              f"cosine similarity {np.mean([m['cosine_similarity'] for m in metrics]):.4f}, "
+              f"relative error {np.mean([m['relative_error'] for m in metrics]):.4f}")
+    else:
+        print("No validation videos found, skipping the comparison with the float network")
+
+    print(f"Step time: {1000 * measure_step_time(net):.1f} ms (float) / "
+          f"{1000 * measure_step_time(quantized_net):.1f} ms (int8)")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path_out)), exist_ok=True)
+    torch.save(quantized_net.state_dict(), path_out)
+    print(f"Saved quantized weights to {path_out}")
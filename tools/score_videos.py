@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Score recorded videos offline at maximum throughput. Every step of every video is run through the
+network and the raw predictions as well as the post-processed outputs are written to a columnar file.
+
+Usage:
+  score_videos.py --path_in=PATH --path_out=FILENAME
+                  [--task=TASK]
+                  [--custom_classifier=PATH]
+                  [--weight=WEIGHT --age=AGE --height=HEIGHT --gender=GENDER]
+                  [--steps_per_chunk=NUM]
+                  [--optimize]
+                  [--onnx_model=FILENAME]
+                  [--use_gpu]
+  score_videos.py (-h | --help)
+
+Options:
+  --path_in=PATH             Video file or directory of videos to score
+  --path_out=FILENAME        Output file. Use the `.npz` extension to store one array per column or `.csv`
+                             for a flat table
+  --task=TASK                One of "gesture_recognition", "fitness_tracker", "fitness_rep_counter" or
+                             "calorie_estimation" [default: gesture_recognition]
+  --custom_classifier=PATH   Path to a custom classifier obtained via the train_classifier script. If provided, the
+                             task is ignored
+  --weight=WEIGHT            Weight (in kilograms), used to convert MET values to calories [default: 70]
+  --age=AGE                  Age (in years), used to convert MET values to calories [default: 30]
+  --height=HEIGHT            Height (in centimeters), used to convert MET values to calories [default: 170]
+  --gender=GENDER            Gender ("male" or "female" or "other"), used to convert MET values to calories
+  --steps_per_chunk=NUM      Number of steps processed with a single forward pass [default: 16]
+  --optimize                 Fuse the layers of the backbone and switch it to the channels-last memory format,
+                             see `StridedInflatedMobileNetV2.optimize_for_inference`
+  --onnx_model=FILENAME      Run the network of the task exported to this file with ONNX Runtime instead of
+                             PyTorch, see `tools/conversion/export_onnx.py`
+"""
+import glob
+import json
+import os
+
+import torch
+from docopt import docopt
+
+from sense import feature_extractors
+from sense.downstream_tasks import calorie_estimation
+from sense.downstream_tasks import fitness_activity_recognition
+from sense.downstream_tasks import fitness_rep_counting
+from sense.downstream_tasks import gesture_recognition
+from sense.downstream_tasks.nn_utils import LogisticRegression
+from sense.downstream_tasks.nn_utils import Pipe
+from sense.downstream_tasks.nn_utils import load_weights_from_resources
+from sense.downstream_tasks.postprocess import PostprocessClassificationOutput
+from sense.downstream_tasks.postprocess import PostprocessRepCounts
+from sense.engine import InferenceEngine
+from sense.onnx_runtime import OnnxRuntimeNet
+from sense.scoring import StepClock
+from sense.scoring import save_columns
+from sense.scoring import score_video
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def load_classifier(feature_extractor, num_out, checkpoint_path):
+    classifier = LogisticRegression(num_in=feature_extractor.feature_dim, num_out=num_out)
+    classifier.load_state_dict(load_weights_from_resources(checkpoint_path))
+    classifier.eval()
+    return classifier
+
+
+def load_task(task, user_info):
+    """
+    Build the network of a demo task together with a function that creates fresh post-processors.
+    """
+    if task in ('gesture_recognition', 'fitness_rep_counter'):
+        feature_extractor = feature_extractors.StridedInflatedEfficientNet()
+        feature_extractor.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
+    else:
+        feature_extractor = feature_extractors.StridedInflatedMobileNetV2()
+        feature_extractor.load_weights_from_resources('backbone/strided_inflated_mobilenet.ckpt')
+    feature_extractor.eval()
+
+    if task == 'gesture_recognition':
+        int2lab = gesture_recognition.INT2LAB
+        classifier = load_classifier(feature_extractor, len(int2lab),
+                                     'gesture_detection/efficientnet_logistic_regression.ckpt')
+        net = Pipe(feature_extractor, classifier)
+
+        def create_post_processors(clock):
+            return [PostprocessClassificationOutput(int2lab, smoothing=4)]
+
+    elif task == 'fitness_rep_counter':
+        int2lab = fitness_rep_counting.INT2LAB
+        classifier = load_classifier(feature_extractor, len(int2lab),
+                                     'fitness_rep_counting/efficientnet_logistic_regression.ckpt')
+        net = Pipe(feature_extractor, classifier)
+
+        def create_post_processors(clock):
+            return [PostprocessRepCounts(int2lab),
+                    PostprocessClassificationOutput(int2lab, smoothing=1)]
+
+    elif task in ('fitness_tracker', 'calorie_estimation'):
+        met_value_converter = calorie_estimation.METValueMLPConverter()
+        met_value_converter.load_state_dict(
+            load_weights_from_resources('calorie_estimation/mobilenet_features_met_converter.ckpt'))
+        met_value_converter.eval()
+
+        if task == 'fitness_tracker':
+            int2lab = fitness_activity_recognition.INT2LAB
+            classifier = load_classifier(feature_extractor, 81,
+                                         'fitness_activity_recognition/mobilenet_logistic_regression.ckpt')
+            net = Pipe(feature_extractor, feature_converter=[classifier, met_value_converter])
+
+            def create_post_processors(clock):
+                return [PostprocessClassificationOutput(int2lab, smoothing=8, indices=[0]),
+                        calorie_estimation.CalorieAccumulator(smoothing=12, clock=clock, indices=[1], **user_info)]
+        else:
+            net = Pipe(feature_extractor, met_value_converter)
+
+            def create_post_processors(clock):
+                return [calorie_estimation.CalorieAccumulator(clock=clock, **user_info)]
+
+    else:
+        raise ValueError(f'Unknown task: {task}')
+
+    return net, create_post_processors
+
+
+def load_custom_classifier(custom_classifier):
+    """
+    Build the network of a custom classifier, see `tools/run_custom_classifier.py`.
+    """
+    feature_extractor = feature_extractors.StridedInflatedEfficientNet()
+    feature_extractor.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
+    checkpoint = feature_extractor.state_dict()
+
+    # Update original weights in case some intermediate layers have been finetuned
+    checkpoint_classifier = torch.load(os.path.join(custom_classifier, 'classifier.checkpoint'), map_location='cpu')
+    name_finetuned_layers = set(checkpoint.keys()).intersection(checkpoint_classifier.keys())
+    for key in name_finetuned_layers:
+        checkpoint[key] = checkpoint_classifier.pop(key)
+    feature_extractor.load_state_dict(checkpoint)
+    feature_extractor.eval()
+
+    with open(os.path.join(custom_classifier, 'label2int.json')) as file:
+        class2int = json.load(file)
+    int2lab = {value: key for key, value in class2int.items()}
+
+    classifier = LogisticRegression(num_in=feature_extractor.feature_dim, num_out=len(int2lab))
+    classifier.load_state_dict(checkpoint_classifier)
+    classifier.eval()
+
+    def create_post_processors(clock):
+        return [PostprocessClassificationOutput(int2lab, smoothing=4)]
+
+    return Pipe(feature_extractor, classifier), create_post_processors
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    args = docopt(__doc__)
+    path_in = args['--path_in']
+    path_out = args['--path_out']
+    task = args['--task']
+    custom_classifier = args['--custom_classifier']
+    user_info = {
+        'weight': float(args['--weight']),
+        'age': float(args['--age']),
+        'height': float(args['--height']),
+        'gender': args['--gender'] or None,
+    }
+    steps_per_chunk = int(args['--steps_per_chunk'])
+    optimize = args['--optimize']
+    onnx_model = args['--onnx_model']
+    use_gpu = args['--use_gpu']
+
+    if custom_classifier:
+        net, create_post_processors = load_custom_classifier(custom_classifier)
+    else:
+        net, create_post_processors = load_task(task, user_info)
+
+    if optimize:
+        net.feature_extractor.optimize_for_inference()
+    if onnx_model:
+        net = OnnxRuntimeNet(onnx_model)
+
+    inference_engine = InferenceEngine(net, use_gpu=use_gpu)
+
+    if os.path.isdir(path_in):
+        videos = sorted(path for path in glob.glob(os.path.join(path_in, '**', '*'), recursive=True)
+                        if path.lower().endswith(VIDEO_EXTENSIONS))
+    else:
+        videos = [path_in]
+
+    columns = {}
+    for video_index, video_path in enumerate(videos):
+        print(f"\rScoring video {video_index + 1} / {len(videos)}", end="")
+        clock = StepClock()
+        video_columns = score_video(inference_engine, create_post_processors(clock), video_path,
+                                    steps_per_chunk=steps_per_chunk, clock=clock)
+        for name, column in video_columns.items():
+            columns.setdefault(name, []).extend(column)
+    print()
+
+    save_columns(path_out, columns)
+    print(f"Saved predictions for {len(columns.get('step', []))} steps to {path_out}")
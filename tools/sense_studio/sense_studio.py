@@ -22,12 +22,10 @@ from flask import render_template
 from flask import request
 from flask import send_from_directory
 from flask import url_for
-from joblib import dump
-from joblib import load
 from os.path import join
-from sklearn.linear_model import LogisticRegression
 
 from sense.finetuning import compute_frames_features
+from sense.finetuning import load_pooled_features
 
 
 app = Flask(__name__)
@@ -41,15 +39,13 @@ PROJECT_CONFIG_FILE = 'project_config.json'
 
 def _load_feature_extractor():
     global inference_engine
-    import torch
     from sense import engine
     from sense import feature_extractors
     if inference_engine is None:
         feature_extractor = feature_extractors.StridedInflatedEfficientNet()
 
         # Remove internal padding for feature extraction and training
-        checkpoint = torch.load('../../resources/backbone/strided_inflated_efficientnet.ckpt')
-        feature_extractor.load_state_dict(checkpoint)
+        feature_extractor.load_weights_from_resources('backbone/strided_inflated_efficientnet.ckpt')
         feature_extractor.eval()
 
         # Create Inference Engine
@@ -331,6 +327,7 @@ def show_video_list(split, label, path):
 
     logreg_path = join(logreg_dir, 'logreg.joblib')
     if os.path.isfile(logreg_path):
+        from joblib import load
         global logreg
         logreg = load(logreg_path)
 
@@ -368,8 +365,7 @@ def annotate(split, label, path, idx):
     videos = os.listdir(frames_dir)
     videos.sort()
 
-    features = np.load(join(features_dir, videos[idx] + ".npy"))
-    features = features.mean(axis=(2, 3))
+    features = load_pooled_features(join(features_dir, videos[idx] + ".npy"))
 
     if logreg is not None:
         classes = list(logreg.predict(features))
@@ -454,10 +450,7 @@ def train_logreg():
         y = []
 
         for feature in features:
-            feature = np.load(feature)
-
-            for f in feature:
-                X.append(f.mean(axis=(1, 2)))
+            X.extend(load_pooled_features(feature))
 
         for annotation in annotations:
             annotation = json.load(open(annotation, 'r'))['time_annotation']
@@ -484,6 +477,8 @@ def train_logreg():
 
         X = np.array(X)
         y = np.array(y)
+        from joblib import dump
+        from sklearn.linear_model import LogisticRegression
         logreg = LogisticRegression(C=0.1, class_weight=class_weight)
         logreg.fit(X, y)
         dump(logreg, logreg_path)
@@ -62,6 +62,8 @@ if __name__ == "__main__":
     path_annotations_valid =None
     num_layers_to_finetune = 9
     temporal_training = False
+    # Number of worker processes used for feature extraction
+    num_workers = 1
 
     # Load feature extractor
     feature_extractor = feature_extractors.StridedInflatedEfficientNet()
@@ -90,7 +92,7 @@ if __name__ == "__main__":
 
     # finetune the model
     extract_features(path_in, feature_extractor, num_layers_to_finetune, use_gpu,
-                     num_timesteps=num_timesteps)
+                     num_timesteps=num_timesteps, num_workers=num_workers)
 
     # Find label names
     label_names = os.listdir(os.path.join(os.path.join(path_in, "videos_train")))
@@ -105,16 +107,21 @@ if __name__ == "__main__":
 
     extractor_stride = feature_extractor.num_required_frames_per_layer_padding[0]
 
+    # Without finetuned layers, the classifier only needs spatially pooled features
+    use_pooled_features = num_layers_to_finetune == 0
+
     # create the data loaders
     train_loader = generate_data_loader(path_in, f"features_train_num_layers_to_finetune={num_layers_to_finetune}",
                                         "tags_train", label_names, label2int, label2int_temporal_annotation,
                                         num_timesteps=num_timesteps, stride=extractor_stride,
-                                        temporal_annotation_only=temporal_training)
+                                        temporal_annotation_only=temporal_training,
+                                        use_pooled_features=use_pooled_features)
 
     valid_loader = generate_data_loader(path_in, f"features_valid_num_layers_to_finetune={num_layers_to_finetune}",
                                         "tags_valid", label_names, label2int, label2int_temporal_annotation,
                                         num_timesteps=None, batch_size=1, shuffle=False, stride=extractor_stride,
-                                        temporal_annotation_only=temporal_training)
+                                        temporal_annotation_only=temporal_training,
+                                        use_pooled_features=use_pooled_features)
 
     # modeify the network to generate the training network on top of the features
     if temporal_training:
@@ -125,7 +132,8 @@ if __name__ == "__main__":
     # modify the network to generate the training network on top of the features
     gesture_classifier = LogisticRegression(num_in=feature_extractor.feature_dim,
                                             num_out=num_output,
-                                            use_softmax=False)
+                                            use_softmax=False,
+                                            global_average_pooling=not use_pooled_features)
 
     if num_layers_to_finetune > 0:
         # remove internal padding for training